@@ -30,6 +30,33 @@ Q_NEW_AD = "new_ad_found"
 Q_SEND_DM = "send_dm"
 Q_DM_RESPONSE = "dm_response"
 Q_OWNER_CONFIRMED = "owner_confirmed"
+Q_SEND_DM_DLQ = "send_dm.dlq"
+
+# Owner notifications (see notifier.py)
+OWNER_CONFIRMED_PREFETCH_COUNT = int(os.getenv("OWNER_CONFIRMED_PREFETCH_COUNT", "100")) # Должен быть не меньше NOTIFY_DIGEST_MAX_LEADS
+NOTIFY_COALESCE_MS = int(os.getenv("NOTIFY_COALESCE_MS", "3000")) # Лиды, пришедшие за это время после первого, уходят одним дайджестом
+NOTIFY_DIGEST_MAX_LEADS = 20 # Больше лидов в одном дайджесте не собираем (длинный дайджест все равно режется по 4096 символов)
+NOTIFY_RATE_PER_SECOND = 1.0 # Telegram: не больше ~1 сообщения в секунду в один чат
+NOTIFY_BURST = 3 # Сколько сообщений можно отправить подряд без паузы
+NOTIFY_MAX_ATTEMPTS = 5 # Попыток отправки при ошибках, кроме 429 (после 429 ждем retry_after без ограничения)
+NOTIFY_RETRY_BASE_DELAY_SECONDS = 1.0 # Задержка перед повтором, удваивается с каждой попыткой
+
+# Admin commands
+DLQ_PEEK_LIMIT = 5 # Сколько сообщений из DLQ показывать командой /dlq
+LEADS_PAGE_SIZE = 10 # Лидов на странице /list_leads
+LEADS_EXPORT_FETCH_SIZE = 500 # Сколько строк /export_leads читает из серверного курсора за раз
+LEADS_EXPORT_MAX_PART_BYTES = 45 * 1024 * 1024 # Документ бота ограничен 50 МБ: выгрузка режется на части
+STATS_DEFAULT_PERIOD_HOURS = 24 # Период /stats без аргумента
+STATS_MAX_PERIOD_HOURS = 90 * 24
+
+# Prometheus metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100")) # HTTP /metrics
+
+# Lead tracing (see tracing.py)
+TRACE_SERVICE_NAME = "admin_bot"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "") # JSONL-файл завершенных трасс; пусто — не писать
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "") # Например http://otel-collector:4318/v1/traces; пусто — не отправлять
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000")) # Трассы сверх очереди выгрузки отбрасываются
 
 # Keywords for filtering
 DEFAULT_KEYWORDS = ["продажа", "квартира", "цена", "м2", "собственник"]
@@ -1,5 +1,5 @@
 import asyncpg
-from admin_bot.src import config
+from admin_bot.src import config, metrics
 
 _pool = None
 
@@ -12,20 +12,24 @@ async def get_db_pool():
             password=config.DB_PASS,
             host=config.DB_HOST
         )
+        metrics.track_pool(_pool)
     return _pool
 
+@metrics.db_timed
 async def get_welcome_message():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         message = await conn.fetchval("SELECT value FROM settings WHERE key = 'welcome_message'")
         return message if message else config.DEFAULT_WELCOME_MESSAGE
 
+@metrics.db_timed
 async def set_welcome_message(message: str):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("INSERT INTO settings (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
                            'welcome_message', message)
 
+@metrics.db_timed
 async def add_channel(channel_id: int, name: str):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
@@ -37,35 +41,127 @@ async def add_channel(channel_id: int, name: str):
             print(f"Error adding channel: {e}")
             return False
 
+@metrics.db_timed
 async def remove_channel(channel_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE channels SET is_active = FALSE WHERE telegram_id = $1", channel_id)
 
+@metrics.db_timed
 async def get_active_channels():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         return await conn.fetch("SELECT telegram_id, name FROM channels WHERE is_active = TRUE")
 
+@metrics.db_timed
 async def get_channel_keywords(channel_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         keywords_str = await conn.fetchval("SELECT keywords FROM channels WHERE telegram_id = $1", channel_id)
         return [k.strip() for k in keywords_str.split(',')] if keywords_str else config.DEFAULT_KEYWORDS
 
+@metrics.db_timed
 async def update_channel_keywords(channel_id: int, keywords: list):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE channels SET keywords = $1 WHERE telegram_id = $2", ','.join(keywords), channel_id)
 
-async def get_owner_leads():
+LEAD_COLUMNS = """
+    ol.id, ol.found_at, cu.telegram_id, cu.username, pm.message_text, pm.original_link, ol.owner_response_text
+    FROM owner_leads ol
+    JOIN contacted_users cu ON ol.contacted_user_id = cu.id
+    LEFT JOIN processed_messages pm ON ol.original_message_id = pm.id -- Объявление могло уйти в архив
+"""
+
+@metrics.db_timed
+async def get_owner_leads_page(cursor: tuple = None, newer: bool = False, limit: int = config.LEADS_PAGE_SIZE):
+    """
+    Страница лидов от новых к старым с keyset-пагинацией по (found_at, id) — по индексу
+    owner_leads_found_at_idx, без OFFSET. cursor — (found_at, id) крайнего лида соседней
+    страницы: берутся лиды старше него, а при newer=True — новее. Без cursor — самые новые.
+    Возвращает (лиды страницы, есть ли еще лиды дальше в том же направлении).
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if cursor is None:
+            rows = await conn.fetch(f"SELECT {LEAD_COLUMNS} ORDER BY ol.found_at DESC, ol.id DESC LIMIT $1", limit + 1)
+        elif newer:
+            rows = await conn.fetch(f"""
+                SELECT {LEAD_COLUMNS}
+                WHERE (ol.found_at, ol.id) > ($1, $2)
+                ORDER BY ol.found_at ASC, ol.id ASC
+                LIMIT $3
+            """, *cursor, limit + 1)
+        else:
+            rows = await conn.fetch(f"""
+                SELECT {LEAD_COLUMNS}
+                WHERE (ol.found_at, ol.id) < ($1, $2)
+                ORDER BY ol.found_at DESC, ol.id DESC
+                LIMIT $3
+            """, *cursor, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+async def iter_owner_leads(prefetch: int = config.LEADS_EXPORT_FETCH_SIZE):
+    """
+    Все лиды (от старых к новым) через серверный курсор: в памяти одновременно не больше
+    prefetch строк, сколько бы лидов ни было. Курсор живет в read-only транзакции
+    REPEATABLE READ, поэтому выгрузка — согласованный снимок.
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            async for row in conn.cursor(f"SELECT {LEAD_COLUMNS} ORDER BY ol.found_at, ol.id", prefetch=prefetch):
+                yield row
+
+@metrics.db_timed
+async def get_processed_message_text(processed_message_id: int):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT message_text FROM processed_messages WHERE id = $1", processed_message_id)
+
+@metrics.db_timed
+async def get_channel_stats(hours: int):
+    """
+    Воронка по активным каналам за последние hours часов из почасовых сводок
+    channel_stats_hourly (ведутся триггерами, см. миграции 0005 и 0007). Ответившие — контакты,
+    приславшие хотя бы один ответ, даже неясный. Каналы без объявлений
+    тоже попадают в выборку; last_ad_hour — последний час с объявлением за все время.
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT c.telegram_id, c.name,
+                   COALESCE(sum(s.ads), 0) AS ads,
+                   COALESCE(sum(s.contacted), 0) AS contacted,
+                   COALESCE(sum(s.replied), 0) AS replied,
+                   COALESCE(sum(s.owners), 0) AS owners,
+                   (SELECT max(l.hour) FROM channel_stats_hourly l WHERE l.channel_telegram_id = c.telegram_id AND l.ads > 0) AS last_ad_hour
+            FROM channels c
+            LEFT JOIN channel_stats_hourly s
+                ON s.channel_telegram_id = c.telegram_id AND s.hour >= date_trunc('hour', CURRENT_TIMESTAMP) - make_interval(hours => $1 - 1)
+            WHERE c.is_active = TRUE
+            GROUP BY c.telegram_id, c.name
+            ORDER BY ads DESC, c.name
+        """, hours)
+
+@metrics.db_timed
+async def get_account_stats(hours: int):
+    """DM и ответившие контакты по активным userbot-аккаунтам за последние hours часов (account_stats_hourly)."""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         return await conn.fetch("""
-            SELECT ol.found_at, cu.username, pm.message_text, pm.original_link, ol.owner_response_text
-            FROM owner_leads ol
-            JOIN contacted_users cu ON ol.contacted_user_id = cu.id
-            JOIN processed_messages pm ON ol.original_message_id = pm.id
-            ORDER BY ol.found_at DESC
-            LIMIT 20 -- Последние 20 лидов
-        """)
+            SELECT a.id, a.phone_number,
+                   COALESCE(sum(s.dms_sent), 0) AS dms_sent,
+                   COALESCE(sum(s.replies), 0) AS replies,
+                   (SELECT max(l.hour) FROM account_stats_hourly l WHERE l.account_id = a.id AND l.dms_sent > 0) AS last_dm_hour
+            FROM user_accounts a
+            LEFT JOIN account_stats_hourly s
+                ON s.account_id = a.id AND s.hour >= date_trunc('hour', CURRENT_TIMESTAMP) - make_interval(hours => $1 - 1)
+            WHERE a.is_active = TRUE
+            GROUP BY a.id, a.phone_number
+            ORDER BY dms_sent DESC, a.id
+        """, hours)
@@ -1,37 +1,71 @@
+import datetime
+
 from aiogram import Dispatcher, types
 from aiogram.dispatcher.filters import Command
-from aiogram.utils.markdown import hlink
+from aiogram.utils.callback_data import CallbackData
+from aiogram.utils.markdown import hlink, quote_html
+from aiogram.utils.parts import safe_split_text
 
-from admin_bot.src import db, config
+from admin_bot.src import db, config, envelope, leads_export, metrics, tracing
+from admin_bot.src import notifier as notifier_module
 import aio_pika
-import json
 
 dp = Dispatcher()
 connection = None
 channel = None
 
+# Заголовки попыток доставки send_dm (userbot_core dm_retry и dead-letter RabbitMQ):
+# при возврате из DLQ они сбрасываются, остальные (x-trace и т.п.) переносятся как есть
+DLQ_RETRY_HEADERS = ("x-attempts", "x-last-reason", "x-death", "x-first-death-exchange", "x-first-death-queue", "x-first-death-reason",
+                     "x-last-death-exchange", "x-last-death-queue", "x-last-death-reason")
+
+notifier = notifier_module.Notifier(
+    chat_id=config.ADMIN_USER_ID,
+    coalesce_ms=config.NOTIFY_COALESCE_MS,
+    max_digest=config.NOTIFY_DIGEST_MAX_LEADS,
+    bucket=notifier_module.TokenBucket(config.NOTIFY_RATE_PER_SECOND, config.NOTIFY_BURST),
+    max_attempts=config.NOTIFY_MAX_ATTEMPTS
+)
+
 async def init_rabbitmq():
     global connection, channel
     connection = await aio_pika.connect_robust(
         f"amqp://{config.RABBITMQ_USER}:{config.RABBITMQ_PASS}@{config.RABBITMQ_HOST}/"
     )
     channel = await connection.channel()
-    await channel.declare_queue(config.Q_OWNER_CONFIRMED, durable=True)
-    await channel.consume(config.Q_OWNER_CONFIRMED, on_owner_confirmed)
+    # Доставки owner_confirmed ждут отправки дайджеста неподтвержденными — prefetch ограничивает их число
+    await channel.set_qos(prefetch_count=config.OWNER_CONFIRMED_PREFETCH_COUNT)
+    notifier.start(dp.bot)
+    owner_confirmed_queue = await channel.declare_queue(config.Q_OWNER_CONFIRMED, durable=True)
+    await owner_confirmed_queue.consume(on_owner_confirmed)
 
 async def on_owner_confirmed(message: aio_pika.IncomingMessage):
-    async with message.process():
-        data = json.loads(message.body.decode())
-        await dp.bot.send_message(
-            chat_id=config.ADMIN_USER_ID,
-            text=f"✅ **Новый собственник найден!**\n\n"
-                 f"**Пользователь:** {data['username']} (ID: {data['user_id']})\n"
-                 f"**Объявление:** {hlink('посмотреть оригинал', data['original_link']) if data['original_link'] else data['ad_text'][:200] + '...'}\n"
-                 f"**Ответ:** `{data['response_text']}`\n\n"
-                 f"Время: {data['timestamp']}",
-            parse_mode="HTML"
-        )
-        print(f"Sent owner confirmed notification: {data['username']}")
+    # Отправка и подтверждение доставки — в notifier: consumer не ждет флуд-лимитов Bot API
+    try:
+        data = envelope.unpack(message)
+        trace = tracing.from_message(message)
+        if trace:
+            trace.stamp(f"{config.Q_OWNER_CONFIRMED}.consumed")
+        if data['original_link']:
+            ad = hlink('посмотреть оригинал', data['original_link'])
+        else:
+            # Текст объявления не передается в сообщении — читаем его по id (старые JSON-сообщения несут ad_text)
+            ad_text = data.get('ad_text') or await db.get_processed_message_text(data['processed_message_db_id']) or ''
+            ad = quote_html(ad_text[:200]) + '...'
+        response_text = data['response_text'] or ''
+        if len(response_text) > notifier_module.RESPONSE_MAX_LENGTH:
+            response_text = response_text[:notifier_module.RESPONSE_MAX_LENGTH] + '...'
+    except Exception:
+        await message.reject(requeue=False)
+        raise
+    notifier.submit(notifier_module.Notice(
+        message,
+        f"<b>Пользователь:</b> {quote_html(data['username'])} (ID: {data['user_id']})\n"
+        f"<b>Объявление:</b> {ad}\n"
+        f"<b>Ответ:</b> <code>{quote_html(response_text)}</code>\n"
+        f"Время: {data['timestamp']}",
+        trace
+    ))
 
 @dp.message_handler(Command("start"), user_id=config.ADMIN_USER_ID)
 async def cmd_start(message: types.Message):
@@ -43,7 +77,11 @@ async def cmd_start(message: types.Message):
         "/list_channels - Показать активные каналы.\n"
         "/set_welcome_message <текст> - Изменить приветственное сообщение для DM.\n"
         "/get_welcome_message - Показать текущее приветственное сообщение.\n"
-        "/list_leads - Показать последние найденные собственники.\n"
+        "/list_leads - Показать найденных собственников (листание кнопками).\n"
+        "/export_leads - Выгрузить всех собственников в CSV (.csv.gz).\n"
+        "/stats [период] - Воронка по каналам и аккаунтам, например /stats 7d (по умолчанию 24h).\n"
+        "/dlq - Показать запросы на DM, исчерпавшие попытки отправки.\n"
+        "/dlq_requeue - Вернуть запросы из DLQ в очередь отправки.\n"
     )
 
 @dp.message_handler(Command("add_channel"), user_id=config.ADMIN_USER_ID)
@@ -115,17 +153,159 @@ async def cmd_get_welcome_message(message: types.Message):
     current_message = await db.get_welcome_message()
     await message.reply(f"Текущее приветственное сообщение:\n`{current_message}`", parse_mode="MarkdownV2")
 
-@dp.message_handler(Command("list_leads"), user_id=config.ADMIN_USER_ID)
-async def cmd_list_leads(message: types.Message):
-    leads = await db.get_owner_leads()
+# Курсор страницы — (found_at, id) крайнего лида; время передается точно, в микросекундах от эпохи
+leads_cb = CallbackData("leads", "direction", "found_at", "lead_id")
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _leads_button(text: str, direction: str, lead) -> types.InlineKeyboardButton:
+    found_at = (lead['found_at'] - EPOCH) // datetime.timedelta(microseconds=1)
+    return types.InlineKeyboardButton(text, callback_data=leads_cb.new(direction=direction, found_at=found_at, lead_id=lead['id']))
+
+async def render_leads_page(cursor: tuple = None, newer: bool = False):
+    """Текст страницы лидов и клавиатура «новее/старше»; (None, None), если лидов на странице нет."""
+    leads, has_more = await db.get_owner_leads_page(cursor, newer)
     if not leads:
-        await message.reply("Пока не найдено ни одного собственника.")
-        return
-    
-    text = "Последние найденные собственники:\n\n"
+        return None, None
+
+    text = "Найденные собственники:\n\n"
     for lead in leads:
         text += (f"**Пользователь:** @{lead['username']} \n"
-                 f"**Объявление:** {hlink('ссылка', lead['original_link']) if lead['original_link'] else lead['message_text'][:100] + '...'}\n"
+                 f"**Объявление:** {hlink('ссылка', lead['original_link']) if lead['original_link'] else (lead['message_text'] or '')[:100] + '...'}\n"
                  f"**Подтверждение:** `{lead['owner_response_text']}`\n"
                  f"**Когда:** {lead['found_at'].strftime('%Y-%m-%d %H:%M')}\n\n")
-    await message.reply(text, parse_mode="HTML")
+
+    # Первая страница — самые новые лиды. Листая к новым, знаем, что есть старые (мы пришли оттуда), и наоборот
+    has_newer = has_more if newer else cursor is not None
+    has_older = True if newer else has_more
+    buttons = []
+    if has_newer:
+        buttons.append(_leads_button("« Новее", "newer", leads[0]))
+    if has_older:
+        buttons.append(_leads_button("Старше »", "older", leads[-1]))
+    return text, types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+@dp.message_handler(Command("list_leads"), user_id=config.ADMIN_USER_ID)
+async def cmd_list_leads(message: types.Message):
+    text, keyboard = await render_leads_page()
+    if text is None:
+        await message.reply("Пока не найдено ни одного собственника.")
+        return
+    await message.reply(text, parse_mode="HTML", reply_markup=keyboard)
+
+@dp.callback_query_handler(leads_cb.filter(), user_id=config.ADMIN_USER_ID)
+async def on_leads_page(query: types.CallbackQuery, callback_data: dict):
+    found_at = EPOCH + datetime.timedelta(microseconds=int(callback_data['found_at']))
+    text, keyboard = await render_leads_page((found_at, int(callback_data['lead_id'])), callback_data['direction'] == "newer")
+    if text is None:
+        # Лиды могли удалить, пока страница висела в чате
+        await query.answer("Дальше лидов нет.")
+        return
+    await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await query.answer()
+
+@dp.message_handler(Command("export_leads"), user_id=config.ADMIN_USER_ID)
+async def cmd_export_leads(message: types.Message):
+    await message.reply("Готовлю выгрузку лидов...")
+    total = await leads_export.send_export(message)
+    if not total:
+        await message.reply("Пока не найдено ни одного собственника.")
+
+def _parse_period(arg: str):
+    """'12h', '7d' или число часов -> часы; None, если период не распознан."""
+    arg = arg.strip().lower() or f"{config.STATS_DEFAULT_PERIOD_HOURS}h"
+    unit = arg[-1] if arg[-1] in "hd" else "h"
+    value = arg[:-1] if arg[-1] in "hd" else arg
+    if not value.isdigit() or int(value) <= 0:
+        return None
+    hours = int(value) * (24 if unit == "d" else 1)
+    return hours if hours <= config.STATS_MAX_PERIOD_HOURS else None
+
+def _rate(part: int, total: int) -> str:
+    return f"{part * 100 / total:.0f}%" if total else "—"
+
+def _hour(value) -> str:
+    return value.strftime('%Y-%m-%d %H:00') if value else "никогда"
+
+@dp.message_handler(Command("stats"), user_id=config.ADMIN_USER_ID)
+async def cmd_stats(message: types.Message):
+    hours = _parse_period(message.get_args())
+    if hours is None:
+        await message.reply(f"Использование: /stats [период], например /stats 24h или /stats 7d (не больше {config.STATS_MAX_PERIOD_HOURS // 24}d).")
+        return
+    channels = await db.get_channel_stats(hours)
+    accounts = await db.get_account_stats(hours)
+
+    ads = sum(c['ads'] for c in channels)
+    contacted = sum(c['contacted'] for c in channels)
+    replied = sum(c['replied'] for c in channels)
+    owners = sum(c['owners'] for c in channels)
+    dms_sent = sum(a['dms_sent'] for a in accounts)
+    text = (f"Статистика за {hours} ч.\n\n"
+            f"Объявлений: {ads}, контактов: {contacted}, ответили: {replied} ({_rate(replied, contacted)}), "
+            f"собственников: {owners} ({_rate(owners, contacted)} от контактов)\n"
+            f"DM отправлено: {dms_sent} ({dms_sent / hours:.1f} в час)\n\n"
+            f"Каналы (⚠️ — нет объявлений за период):\n")
+    for c in channels:
+        mark = "⚠️ " if not c['ads'] else ""
+        text += (f"{mark}{c['name']} ({c['telegram_id']}): объявлений {c['ads']}, контактов {c['contacted']}, "
+                 f"ответили {_rate(c['replied'], c['contacted'])}, собственников {c['owners']}; "
+                 f"последнее объявление: {_hour(c['last_ad_hour'])}\n")
+    text += "\nАккаунты (⚠️ — не отправляют DM или не получают ответов):\n"
+    for a in accounts:
+        mark = "⚠️ " if not a['dms_sent'] or not a['replies'] else ""
+        text += (f"{mark}#{a['id']} (…{a['phone_number'][-4:]}): DM {a['dms_sent']}, ответили {a['replies']} "
+                 f"({_rate(a['replies'], a['dms_sent'])}); последний DM: {_hour(a['last_dm_hour'])}\n")
+    for part in safe_split_text(text):
+        await message.reply(part)
+
+@dp.message_handler(Command("dlq"), user_id=config.ADMIN_USER_ID)
+async def cmd_dlq(message: types.Message):
+    queue = await channel.declare_queue(config.Q_SEND_DM_DLQ, durable=True)
+    total = queue.declaration_result.message_count
+    if not total:
+        await message.reply("DLQ пуста.")
+        return
+
+    # Просматриваем несколько сообщений без подтверждения и возвращаем их обратно
+    peeked = []
+    for _ in range(min(total, config.DLQ_PEEK_LIMIT)):
+        dlq_message = await queue.get(no_ack=False, fail=False)
+        if dlq_message is None:
+            break
+        peeked.append(dlq_message)
+
+    text = f"В DLQ {total} запросов на DM. Первые {len(peeked)}:\n\n"
+    for dlq_message in peeked:
+        data = envelope.unpack(dlq_message)
+        headers = dlq_message.headers or {}
+        text += (f"- Пользователь: {data.get('username')} (ID: {data.get('user_id')}), "
+                 f"попыток: {headers.get('x-attempts')}, причина: {headers.get('x-last-reason')}\n")
+    for dlq_message in peeked:
+        await dlq_message.nack(requeue=True)
+    await message.reply(text)
+
+@dp.message_handler(Command("dlq_requeue"), user_id=config.ADMIN_USER_ID)
+async def cmd_dlq_requeue(message: types.Message):
+    queue = await channel.declare_queue(config.Q_SEND_DM_DLQ, durable=True)
+    total = queue.declaration_result.message_count
+    moved = 0
+    for _ in range(total):
+        dlq_message = await queue.get(no_ack=False, fail=False)
+        if dlq_message is None:
+            break
+        # Счетчик попыток сбрасывается: запрос снова проходит все уровни задержки
+        headers = {key: value for key, value in (dlq_message.headers or {}).items() if key not in DLQ_RETRY_HEADERS}
+        await metrics.publish(
+            channel.default_exchange,
+            aio_pika.Message(
+                body=dlq_message.body,
+                content_type=dlq_message.content_type,
+                headers=headers,
+                message_id=dlq_message.message_id,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            config.Q_SEND_DM
+        )
+        await dlq_message.ack()
+        moved += 1
+    await message.reply(f"Возвращено в очередь отправки: {moved}.")
@@ -0,0 +1,84 @@
+"""
+Выгрузка лидов командой /export_leads.
+
+Строки читаются из серверного курсора (db.iter_owner_leads) и сразу пишутся в CSV,
+сжатый gzip, во временный файл на диске. Когда сжатая часть дорастает до
+LEADS_EXPORT_MAX_PART_BYTES, начинается следующая: Telegram не принимает от бота
+документы больше 50 МБ. В памяти — только порция курсора и буферы сжатия, сколько бы
+лидов ни было. Части отправляются после закрытия курсора, чтобы не держать соединение
+пула и транзакцию на время загрузки документов.
+"""
+import csv
+import datetime
+import gzip
+import io
+import tempfile
+
+from aiogram import types
+
+from admin_bot.src import db, config
+
+HEADER = ("lead_id", "found_at", "telegram_id", "username", "original_link", "owner_response_text", "message_text")
+
+
+class _Part:
+    def __init__(self, number: int):
+        self.number = number
+        self.rows = 0
+        self.file = tempfile.TemporaryFile()
+        # utf-8-sig — чтобы Excel открыл кириллицу без выбора кодировки
+        self._text = io.TextIOWrapper(gzip.GzipFile(fileobj=self.file, mode="wb"), encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(HEADER)
+
+    def write(self, lead):
+        self._writer.writerow((
+            lead['id'], lead['found_at'].isoformat(), lead['telegram_id'], lead['username'],
+            lead['original_link'], lead['owner_response_text'], lead['message_text'],
+        ))
+        self.rows += 1
+
+    @property
+    def compressed_size(self) -> int:
+        # Без учета еще не сброшенных буферов — поэтому предел частей взят с запасом
+        return self.file.tell()
+
+    def finish(self):
+        self._text.close() # Дописывает хвост gzip; сам временный файл остается открытым
+        self.file.seek(0)
+
+
+async def _write_parts() -> list:
+    parts = [_Part(1)]
+    try:
+        async for lead in db.iter_owner_leads():
+            if parts[-1].compressed_size >= config.LEADS_EXPORT_MAX_PART_BYTES:
+                parts[-1].finish()
+                parts.append(_Part(len(parts) + 1))
+            parts[-1].write(lead)
+        parts[-1].finish()
+    except BaseException:
+        for part in parts:
+            part.file.close()
+        raise
+    return parts
+
+
+async def send_export(message: types.Message) -> int:
+    """Отправляет все лиды ответом на message частями .csv.gz; возвращает число лидов."""
+    parts = await _write_parts()
+    try:
+        total = sum(part.rows for part in parts)
+        if not total:
+            return 0
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M')
+        for part in parts:
+            suffix = f"_part{part.number}" if len(parts) > 1 else ""
+            await message.reply_document(
+                types.InputFile(part.file, filename=f"leads_{stamp}{suffix}.csv.gz"),
+                caption=f"Лиды: часть {part.number}/{len(parts)}, строк: {part.rows}"
+            )
+        return total
+    finally:
+        for part in parts:
+            part.file.close()
@@ -1,11 +1,13 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher, executor
-from admin_bot.src import config, handlers, db
+from admin_bot.src import config, handlers, db, metrics, tracing
 
 logging.basicConfig(level=logging.INFO)
 
 async def on_startup(dispatcher: Dispatcher):
+    metrics.start_server()
+    tracing.start()
     await db.get_db_pool() # Инициализируем пул подключений к БД
     await handlers.init_rabbitmq() # Инициализируем подключение к RabbitMQ
     logging.info("Admin Bot started")
@@ -14,8 +16,10 @@ async def on_shutdown(dispatcher: Dispatcher):
     pool = await db.get_db_pool()
     if pool:
         await pool.close()
+    await handlers.notifier.close()
     if handlers.connection:
         await handlers.connection.close()
+    await tracing.close()
     logging.info("Admin Bot stopped")
 
 def main():
@@ -0,0 +1,62 @@
+"""
+Метрики Prometheus сервиса, отдаются по HTTP на METRICS_PORT (/metrics).
+
+Общие для всех сервисов метрики (db_*, rabbitmq_*, consumer_*) называются одинаково:
+сервис различается по job/instance в Prometheus. У каждого сервиса свой реестр, поэтому
+несколько сервисов можно поднять в одном процессе (benchmarks/bench_pipeline.py).
+"""
+import functools
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector, start_http_server
+
+from admin_bot.src import config
+
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Время вызова функции db.* вместе с ожиданием соединения из пула", ["function"], registry=REGISTRY
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Соединения пула asyncpg: size — открытые, idle — свободные, max — предел", ["state"], registry=REGISTRY
+)
+PUBLISH_SECONDS = Histogram(
+    "rabbitmq_publish_seconds", "Время публикации в RabbitMQ (с подтверждением брокера, если оно включено)", ["routing_key"], registry=REGISTRY
+)
+CONSUMER_IN_FLIGHT = Gauge(
+    "consumer_in_flight_messages", "Сообщения, которые consumer получил и еще не подтвердил", ["queue"], registry=REGISTRY
+)
+
+OWNER_NOTIFICATIONS = Counter(
+    "admin_owner_notifications_total", "Уведомления администратору о найденных собственниках", registry=REGISTRY
+)
+NOTIFY_RETRIES = Counter(
+    "admin_notify_retries_total", "Повторные отправки уведомлений: flood_wait — после 429, error — после прочих ошибок", ["reason"], registry=REGISTRY
+)
+
+
+def start_server():
+    start_http_server(config.METRICS_PORT, registry=REGISTRY)
+
+
+def track_pool(pool):
+    """Значения пула читаются в момент запроса /metrics."""
+    DB_POOL_CONNECTIONS.labels("size").set_function(pool.get_size)
+    DB_POOL_CONNECTIONS.labels("idle").set_function(pool.get_idle_size)
+    DB_POOL_CONNECTIONS.labels("max").set_function(pool.get_max_size)
+
+
+def db_timed(func):
+    """Декоратор функций db.*: время вызова попадает в DB_QUERY_SECONDS с меткой имени функции."""
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with histogram.time():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+async def publish(exchange, message, routing_key: str):
+    with PUBLISH_SECONDS.labels(routing_key).time():
+        await exchange.publish(message, routing_key=routing_key)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+import aio_pika
+from aiogram.utils.exceptions import BadRequest, NetworkError, RetryAfter
+
+from admin_bot.src import config, metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_MAX_LENGTH = 4096 # Предел длины текста сообщения Bot API
+RESPONSE_MAX_LENGTH = 3000 # Ответ пользователя в уведомлении обрезается: лид с заголовком должен уместиться в одно сообщение
+
+
+class TokenBucket:
+    """
+    Ограничитель исходящих сообщений в один чат: rate сообщений в секунду, до capacity
+    подряд. После 429 от Telegram ведро пустеет и не выдает токены retry_after секунд.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = None
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def block(self, seconds: float):
+        now = asyncio.get_running_loop().time()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._blocked_until
+
+
+class Notice:
+    __slots__ = ("message", "text", "trace")
+
+    def __init__(self, message: aio_pika.abc.AbstractIncomingMessage, text: str, trace: tracing.TraceContext = None):
+        self.message = message # Доставка owner_confirmed: подтверждается после отправки уведомления
+        self.text = text # Описание лида без заголовка
+        self.trace = trace
+
+
+class Notifier:
+    """
+    Отправка уведомлений о собственниках администратору отдельно от consumer-а.
+    Consumer только передает уведомление в submit(); лиды, пришедшие в пределах
+    coalesce_ms после первого (и пока ведро ждет токен), уходят одним сообщением-дайджестом.
+    На 429 уведомления ждут retry_after и отправляются снова, на прочие ошибки — до
+    max_attempts попыток с экспоненциальной задержкой. Доставки owner_confirmed
+    подтверждаются только после отправки их сообщения; если отправить не удалось,
+    доставка отклоняется — при сетевой ошибке с возвратом в очередь. BadRequest (Telegram
+    не принял текст) не повторяется: дайджест отправляется по одному лиду, и без возврата
+    в очередь отклоняются только лиды, не принятые и поодиночке. Число лидов
+    в дайджесте ограничено prefetch канала, поэтому prefetch должен быть не меньше max_digest.
+    """
+
+    def __init__(self, chat_id: int, coalesce_ms: int, max_digest: int, bucket: TokenBucket, max_attempts: int):
+        self.chat_id = chat_id
+        self.coalesce = coalesce_ms / 1000
+        self.max_digest = max_digest
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self._in_flight = metrics.CONSUMER_IN_FLIGHT.labels(config.Q_OWNER_CONFIRMED)
+        self._pending = asyncio.Queue()
+        self._bot = None
+        self._task = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # Неподтвержденные доставки вернутся в очередь при закрытии соединения с RabbitMQ
+        if self._task:
+            self._task.cancel()
+
+    def submit(self, notice: Notice):
+        self._in_flight.inc()
+        self._pending.put_nowait(notice)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            deadline = loop.time() + self.coalesce
+            while len(batch) < self.max_digest:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Пока ждали токен, могли прийти еще лиды — забираем их в тот же дайджест
+            await self.bucket.acquire()
+            while len(batch) < self.max_digest and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+
+            for number, chunk in enumerate(self._split(batch)):
+                if number:
+                    await self.bucket.acquire()
+                await self._deliver(chunk)
+
+    def _split(self, batch: list) -> list:
+        """Делит дайджест на сообщения не длиннее MESSAGE_MAX_LENGTH."""
+        chunks, chunk, length = [], [], 0
+        for notice in batch:
+            if chunk and length + len(notice.text) + 2 > MESSAGE_MAX_LENGTH - 100: # запас на заголовок
+                chunks.append(chunk)
+                chunk, length = [], 0
+            chunk.append(notice)
+            length += len(notice.text) + 2
+        chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _render(chunk: list) -> str:
+        if len(chunk) == 1:
+            return f"✅ <b>Новый собственник найден!</b>\n\n{chunk[0].text}"
+        return f"✅ <b>Новые собственники: {len(chunk)}</b>\n\n" + "\n\n".join(notice.text for notice in chunk)
+
+    async def _send(self, text: str):
+        """Отправляет сообщение с повторами; BadRequest (текст отвергнут Telegram) не повторяется."""
+        attempt = 0
+        while True:
+            try:
+                await self._bot.send_message(chat_id=self.chat_id, text=text, parse_mode="HTML")
+                return
+            except RetryAfter as e:
+                # Флуд-лимит: ждем сколько сказал Telegram, попыткой это не считается
+                metrics.NOTIFY_RETRIES.labels("flood_wait").inc()
+                logger.warning(f"Flood limit on owner notification, retrying in {e.timeout}s")
+                self.bucket.block(e.timeout)
+                await self.bucket.acquire()
+            except BadRequest:
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                metrics.NOTIFY_RETRIES.labels("error").inc()
+                delay = config.NOTIFY_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+                logger.warning(f"Failed to send owner notification (attempt {attempt}), retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                await self.bucket.acquire()
+
+    async def _deliver(self, chunk: list):
+        try:
+            await self._send(self._render(chunk))
+        except BadRequest as e:
+            if len(chunk) > 1:
+                # Один лид не должен стоить всего дайджеста: отправляем лиды по одному
+                logger.warning(f"Digest of {len(chunk)} owners rejected by Telegram ({e}), sending them one by one.")
+                for notice in chunk:
+                    await self.bucket.acquire()
+                    await self._deliver([notice])
+                return
+            logger.error(f"Owner notification rejected by Telegram: {e}")
+            await self._settle(chunk, delivered=False, requeue=False)
+            return
+        except Exception as e:
+            logger.error(f"Failed to send notification for {len(chunk)} owners after {self.max_attempts} attempts: {e}")
+            await self._settle(chunk, delivered=False, requeue=isinstance(e, NetworkError))
+            return
+        await self._settle(chunk, delivered=True)
+
+    async def _settle(self, chunk: list, delivered: bool, requeue: bool = False):
+        if delivered:
+            await asyncio.gather(*(notice.message.ack() for notice in chunk), return_exceptions=True)
+        else:
+            await asyncio.gather(*(notice.message.reject(requeue=requeue) for notice in chunk), return_exceptions=True)
+        self._in_flight.dec(len(chunk))
+        if not delivered:
+            return
+        metrics.OWNER_NOTIFICATIONS.inc(len(chunk))
+        for notice in chunk:
+            if notice.trace:
+                tracing.export(notice.trace.stamp("admin_notified"), "owner")
+        logger.info(f"Sent owner confirmed notification for {len(chunk)} owners")
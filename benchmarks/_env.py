@@ -0,0 +1,6 @@
+import os
+
+# Модули config сервисов читают обязательные переменные окружения при импорте
+os.environ.setdefault("PYROGRAM_API_ID", "0")
+os.environ.setdefault("PYROGRAM_API_HASH", "benchmark")
+os.environ.setdefault("ADMIN_USER_ID", "0")
@@ -0,0 +1,109 @@
+"""
+Точность и скорость классификатора ответов собственник/агент (processing_service)
+на размеченном корпусе benchmarks/fixtures/dialog_responses.jsonl в сравнении
+с прежней реализацией parse_owner_agent_response.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_dialog [--messages N] [--model models/owner_agent.npz]
+
+С --model дополнительно оценивается связка "правила + модель для pending"
+(модель не должна быть обучена на этом же корпусе).
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import time
+
+from benchmarks import _env  # noqa: F401
+from processing_service.src.dialog_manager import classify_batch
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "dialog_responses.jsonl")
+LABELS = ("owner", "agent", "pending")
+
+
+def _legacy_parse_owner_agent_response(text: str) -> str:
+    # Реализация до перехода на ResponseClassifier — для сравнения
+    text_lower = text.lower()
+
+    owner_keywords = ["собственник", "хозяин", "я", "моя", "моё", "прямая продажа", "без посредников", "без агентов"]
+    agent_keywords = ["агент", "риелтор", "посредник", "брокер", "сотрудник агентства", "помогу продать", "комиссия"]
+
+    for keyword in owner_keywords:
+        if keyword in text_lower:
+            if re.search(rf"(?<!не\s)(?<!нет\s)\b{keyword}\b", text_lower):
+                return "owner"
+
+    for keyword in agent_keywords:
+        if keyword in text_lower:
+            return "agent"
+
+    if "нет" in text_lower or "не" in text_lower:
+        if "не собственник" in text_lower or "я не хозяин" in text_lower:
+            return "agent"
+        if "не агент" in text_lower:
+            return "pending"
+
+    if len(text) < 5 or "что" in text_lower or "кто" in text_lower:
+        return "pending"
+
+    return "pending"
+
+
+def load_corpus(path: str = FIXTURE_PATH) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report_accuracy(name: str, predicted: list, labels: list):
+    correct = sum(p == l for p, l in zip(predicted, labels))
+    confusion = collections.Counter(zip(labels, predicted))
+    print(f"{name}: accuracy {correct / len(labels):.1%} ({correct}/{len(labels)})")
+    print("    label \\ predicted " + "".join(f"{p:>9}" for p in LABELS))
+    for label in LABELS:
+        print(f"    {label:<19}" + "".join(f"{confusion[(label, p)]:>9}" for p in LABELS))
+
+
+def bench(fn, texts) -> float:
+    start = time.perf_counter()
+    fn(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200_000, help="Сколько ответов классифицировать при замере скорости")
+    parser.add_argument("--show-errors", action="store_true")
+    parser.add_argument("--model", help="Артефакт OwnerAgentModel для оценки правил вместе с моделью")
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    texts = [row["text"] for row in corpus]
+    labels = [row["label"] for row in corpus]
+
+    legacy = [_legacy_parse_owner_agent_response(t) for t in texts]
+    current = classify_batch(texts)
+    report_accuracy("legacy parse_owner_agent_response", legacy, labels)
+    report_accuracy("ResponseClassifier.classify_batch ", current, labels)
+    if args.show_errors:
+        for text, label, predicted in zip(texts, labels, current):
+            if predicted != label:
+                print(f"    expected {label:<8} got {predicted:<8} {text}")
+
+    if args.model:
+        from processing_service.src.ml_classifier import OwnerAgentModel, resolve_pending
+        model = OwnerAgentModel.load(args.model)
+        hybrid = [status for status, _ in resolve_pending(model, texts, current, args.min_confidence)]
+        report_accuracy(f"rules + model {model.version}     ", hybrid, labels)
+
+    workload = (texts * (args.messages // len(texts) + 1))[:args.messages]
+    legacy_rate = bench(lambda batch: [_legacy_parse_owner_agent_response(t) for t in batch], workload)
+    current_rate = bench(classify_batch, workload)
+    print(f"legacy:              {legacy_rate:12,.0f} msg/s")
+    print(f"classify_batch:      {current_rate:12,.0f} msg/s ({current_rate / legacy_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Сравнение форматов сообщений очередей: прежний JSON (с текстом объявления
+внутри) и msgpack-конверт envelope с передачей текста по ссылке.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_envelope [--iterations N]
+"""
+import argparse
+import json
+import time
+
+from benchmarks import _env  # noqa: F401
+from benchmarks.bench_filters import make_corpus
+from userbot_core.src import config, envelope
+
+AD_TEXT = make_corpus(1, seed=7)[0] + " цена 8500 тыс, собственник"
+
+
+def legacy_payloads() -> dict:
+    # Сообщения в том виде, в котором их публиковали до перехода на envelope
+    return {
+        config.Q_NEW_AD: {
+            "processed_message_db_id": 1234567, "channel_id": -1001234567890, "message_id": 98765,
+            "message_text": AD_TEXT, "author_id": 5123456789, "author_username": "ivan_petrov",
+            "original_link": "https://t.me/c/1234567890/98765",
+        },
+        config.Q_SEND_DM: {
+            "user_id": 5123456789, "username": "ivan_petrov", "welcome_message": config.DEFAULT_WELCOME_MESSAGE,
+            "processed_message_db_id": 1234567, "original_link": "https://t.me/c/1234567890/98765",
+        },
+        config.Q_DM_RESPONSE: {
+            "user_id": 5123456789, "username": "ivan_petrov", "response_text": "Да, я собственник",
+        },
+        config.Q_OWNER_CONFIRMED: {
+            "user_id": 5123456789, "username": "ivan_petrov", "response_text": "Да, я собственник",
+            "ad_text": AD_TEXT, "original_link": "https://t.me/c/1234567890/98765",
+            "timestamp": "2024-05-01T12:00:00.000000",
+        },
+    }
+
+
+def per_message_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'queue':<18}{'json B':>8}{'msgpack B':>11}{'json enc/dec us':>18}{'msgpack enc/dec us':>21}")
+    for queue, legacy in legacy_payloads().items():
+        payload = {k: v for k, v in legacy.items() if k not in ("message_text", "ad_text")}
+        if queue == config.Q_OWNER_CONFIRMED:
+            payload["processed_message_db_id"] = 1234567
+
+        json_body = json.dumps(legacy).encode()
+        packed_body = envelope.encode(queue, payload)
+        assert envelope.decode(packed_body) == {**dict.fromkeys(envelope.SCHEMAS[envelope.SCHEMA_VERSION][queue][1]), **payload}
+
+        json_enc = per_message_us(lambda: json.dumps(legacy).encode(), args.iterations)
+        json_dec = per_message_us(lambda: json.loads(json_body.decode()), args.iterations)
+        packed_enc = per_message_us(lambda: envelope.encode(queue, payload), args.iterations)
+        packed_dec = per_message_us(lambda: envelope.decode(packed_body), args.iterations)
+
+        print(f"{queue:<18}{len(json_body):>8}{len(packed_body):>11}"
+              f"{json_enc:>9.2f}/{json_dec:<8.2f}{packed_enc:>12.2f}/{packed_dec:<8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Микробенчмарк фильтра объявлений userbot_core.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_filters [--messages N] [--target MSGS_PER_SEC]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from benchmarks import _env  # noqa: F401
+from userbot_core.src import config
+from userbot_core.src.filters import get_matcher, is_ad_message
+
+WORDS = [
+    "продаю", "сдаю", "квартира", "студия", "этаж", "ремонт", "центр", "метро", "рядом", "парк",
+    "школа", "новостройка", "ипотека", "срочно", "торг", "звоните", "пишите", "фото", "вид", "балкон",
+    "kitchen", "sale", "room", "большая", "светлая", "уютная", "дом", "район", "улица", "машиноместо",
+]
+AD_TAILS = ["цена 8500 тыс", "площадь 54 м2", "собственник", "без комиссии", "12 млн ₽", "продавец"]
+
+
+def _legacy_is_ad_message(text: str, channel_keywords: list) -> bool:
+    # Реализация до перехода на предкомпилированный матчер — для сравнения
+    text_lower = text.lower()
+    found_keyword = False
+    for keyword in channel_keywords:
+        if keyword.lower() in text_lower:
+            found_keyword = True
+            break
+    if not found_keyword:
+        return False
+    if re.search(r'\b\d{2,7}\s*(₽|руб|млн|тыс|k|m|м2|м²)\b', text_lower):
+        return True
+    if "собственник" in text_lower or "продавец" in text_lower or "без комиссии" in text_lower:
+        return True
+    return False
+
+
+def make_corpus(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        words = rng.choices(WORDS, k=rng.randint(15, 60))
+        if rng.random() < 0.2:
+            words.append(rng.choice(AD_TAILS))
+        corpus.append(" ".join(words).capitalize())
+    return corpus
+
+
+def bench(fn, corpus) -> float:
+    start = time.perf_counter()
+    fn(corpus)
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--target", type=float, default=10_000, help="Минимально допустимая пропускная способность, msg/s")
+    args = parser.parse_args()
+
+    keywords = config.DEFAULT_KEYWORDS + ["студия", "однушка", "двушка", "трешка", "апартаменты", "таунхаус"]
+    corpus = make_corpus(args.messages)
+    matcher = get_matcher(keywords)
+
+    legacy = [_legacy_is_ad_message(t, keywords) for t in corpus]
+    if legacy != matcher.classify_many(corpus) or legacy != [is_ad_message(t, keywords) for t in corpus]:
+        print("FAIL: compiled matcher disagrees with legacy filter")
+        sys.exit(1)
+
+    legacy_rate = bench(lambda texts: [_legacy_is_ad_message(t, keywords) for t in texts], corpus)
+    compiled_rate = bench(matcher.classify_many, corpus)
+    match_rate = bench(lambda texts: [matcher.match(t) for t in texts], corpus)
+
+    print(f"messages:               {len(corpus)} ({sum(legacy)} ads)")
+    print(f"legacy is_ad_message:   {legacy_rate:12,.0f} msg/s")
+    print(f"AdMatcher.classify_many:{compiled_rate:12,.0f} msg/s ({compiled_rate / legacy_rate:.1f}x)")
+    print(f"AdMatcher.match:        {match_rate:12,.0f} msg/s")
+
+    if compiled_rate < args.target:
+        print(f"FAIL: below target of {args.target:,.0f} msg/s")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Сквозной бенчмарк конвейера: пост в канале -> process_channel_message -> outbox ->
+on_new_ads_found -> on_send_dm_request -> отправка DM -> ответ пользователя ->
+on_dm_response -> owner_confirmed.
+
+Telegram заменяет FakeClient (синтетические посты и ответы на DM), RabbitMQ и Redis —
+брокер в памяти и fakeredis, либо настоящие локальные экземпляры (--rabbitmq-url,
+--redis-url, например из docker compose). Нужны Postgres и зависимости userbot_core
+и processing_service. Подключение к Postgres берется из тех же переменных окружения,
+что и у сервисов (POSTGRES_HOST, POSTGRES_DB, ...); база POSTGRES_DB пересоздается
+бенчмарком, поэтому ее имя обязано заканчиваться на "_bench".
+
+Запуск из корня репозитория:
+    POSTGRES_HOST=localhost python -m benchmarks.bench_pipeline [--rate 50] [--duration 30]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import time
+
+from benchmarks import _env  # noqa: F401
+
+os.environ.setdefault("POSTGRES_DB", "telegram_owner_finder_bench")
+
+import aio_pika
+import asyncpg
+import redis.asyncio as redis
+
+from benchmarks.fakes import CountingPool, FakeClient, FakeConnection, FakeMessage, FakeUser, InMemoryBroker
+from db_migrate.src.migrate import apply_migrations
+from processing_service.src import db as processing_db, envelope
+from processing_service.src import main as processing_main
+from userbot_core.src import config as userbot_config, db as userbot_db
+from userbot_core.src import main as userbot_main
+
+INIT_SQL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db_init", "init.sql")
+BENCH_CHANNEL_ID = -1009990000001
+FIRST_AUTHOR_ID = 7_000_000_000
+OWNER_REPLIES = ["Да, я собственник", "Продаю сам, без посредников", "Это моя квартира"]
+AGENT_REPLIES = ["Я агент", "Я риелтор, помогу продать", "Агентство недвижимости, комиссия 2%"]
+SYLLABLES = ["ка", "ро", "ми", "ту", "ла", "не", "зо", "пу", "ди", "ва", "ше", "бо", "ли", "су", "фе", "го"]
+STAGES = [
+    ("ingest", "post", "recorded"), # process_channel_message: фильтр, дедуп, запись в БД вместе с outbox
+    ("outbox_to_new_ad", "recorded", "new_ad"), # OutboxRelay + доставка new_ad_found
+    ("new_ad_to_send_dm", "new_ad", "send_dm"), # on_new_ads_found -> доставка send_dm
+    ("send_dm_to_sent", "send_dm", "sent"), # выбор аккаунта, расписание DmScheduler, send_message
+    ("reply_to_dm_response", "reply", "dm_response"), # process_dm_response -> доставка dm_response
+    ("dm_response_to_confirmed", "dm_response", "confirmed"), # классификация, confirm_owner, outbox -> owner_confirmed
+]
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_post(rng: random.Random, is_ad: bool) -> str:
+    # Случайные слова делают посты непохожими друг на друга: дедуп и near-dup их не отбрасывают
+    words = " ".join(random_word(rng) for _ in range(25))
+    if is_ad:
+        return f"Продажа: квартира {rng.randint(30, 120)} м2, {words}. Цена {rng.randint(3000, 20000)} тыс."
+    return f"Новости района: {words}."
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Timeline:
+    """Отметки времени этапов по автору объявления (он же получатель DM)."""
+
+    def __init__(self):
+        self.marks = collections.defaultdict(dict)
+
+    def mark(self, user_id: int, stage: str):
+        self.marks[user_id].setdefault(stage, time.perf_counter())
+
+    def latencies(self, start: str, end: str) -> list:
+        return [m[end] - m[start] for m in self.marks.values() if start in m and end in m]
+
+
+async def reset_database():
+    db_name = userbot_config.DB_NAME
+    if not db_name.endswith("_bench"):
+        raise SystemExit(f"Refusing to reset database {db_name!r}: POSTGRES_DB must end with '_bench'")
+    conn = await asyncpg.connect(
+        database=db_name, user=userbot_config.DB_USER, password=userbot_config.DB_PASS, host=userbot_config.DB_HOST
+    )
+    try:
+        await conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        with open(INIT_SQL, encoding="utf-8") as f:
+            await conn.execute(f.read())
+        await apply_migrations(conn)
+        await conn.execute(
+            "INSERT INTO channels (telegram_id, name, keywords) VALUES ($1, 'bench', 'продажа, квартира')", BENCH_CHANNEL_ID
+        )
+        await conn.executemany(
+            "INSERT INTO user_accounts (phone_number, session_string) VALUES ($1, 'bench')",
+            [(f"+7000000{i:04d}",) for i in range(args.accounts)]
+        )
+    finally:
+        await conn.close()
+
+
+def install_stand_ins(timeline: Timeline, query_counts: collections.Counter):
+    if args.rabbitmq_url:
+        connect_robust = aio_pika.connect_robust
+        aio_pika.connect_robust = lambda *_, **__: connect_robust(args.rabbitmq_url)
+    else:
+        broker = InMemoryBroker()
+
+        async def connect_in_memory(*_, **__):
+            return FakeConnection(broker)
+        aio_pika.connect_robust = connect_in_memory
+
+    if args.redis_url:
+        redis_client = redis.Redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+        redis_client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    userbot_main.redis.Redis = lambda **_: redis_client
+
+    # Оба сервиса в одном процессе: /metrics processing_service — на соседнем порту
+    processing_main.config.METRICS_PORT = userbot_config.METRICS_PORT + 1
+
+    # Все DM отправляются сразу: бенчмарк меряет конвейер, а не антиспам-паузы
+    userbot_config.DM_SEND_DELAY_SECONDS = (0, 0)
+    userbot_config.MAX_DMS_PER_HOUR_PER_ACCOUNT = 10 ** 9
+
+    userbot_main.Client = FakeClient
+    rng = random.Random(args.seed + 1)
+
+    async def reply(client, user_id: int, text: str):
+        timeline.mark(user_id, "sent")
+        await asyncio.sleep(args.reply_delay)
+        answer = rng.choice(OWNER_REPLIES if rng.random() < args.owner_ratio else AGENT_REPLIES)
+        timeline.mark(user_id, "reply")
+        await userbot_main.process_dm_response(client, FakeMessage(user_id, answer, from_user=FakeUser(user_id, f"author{user_id}")))
+    FakeClient.on_send = reply
+
+    # Отметки этапов ставят обертки над обработчиками; consumer-ы подписываются в init_services
+    on_new_ads_found = processing_main.on_new_ads_found
+
+    async def timed_new_ads_found(messages: list):
+        for message in messages:
+            timeline.mark(envelope.unpack(message)['author_id'], "new_ad")
+        await on_new_ads_found(messages)
+    processing_main.on_new_ads_found = timed_new_ads_found
+
+    on_dm_response = processing_main.on_dm_response
+
+    async def timed_dm_response(message):
+        timeline.mark(envelope.unpack(message)['user_id'], "dm_response")
+        await on_dm_response(message)
+    processing_main.on_dm_response = timed_dm_response
+
+    on_send_dm_request = userbot_main.on_send_dm_request
+
+    async def timed_send_dm_request(message):
+        timeline.mark(envelope.unpack(message)['user_id'], "send_dm")
+        await on_send_dm_request(message)
+    userbot_main.on_send_dm_request = timed_send_dm_request
+
+    async def create_counting_pool(label: str, config):
+        pool = await asyncpg.create_pool(database=config.DB_NAME, user=config.DB_USER, password=config.DB_PASS, host=config.DB_HOST)
+        return CountingPool(pool, query_counts, label)
+    return create_counting_pool
+
+
+async def on_owner_confirmed(timeline: Timeline, message):
+    # Admin Bot в бенчмарке не участвует: owner_confirmed — конечная точка конвейера
+    async with message.process():
+        timeline.mark(envelope.unpack(message)['user_id'], "confirmed")
+
+
+async def run():
+    timeline = Timeline()
+    query_counts = collections.Counter()
+    await reset_database()
+    create_counting_pool = install_stand_ins(timeline, query_counts)
+    userbot_db._pool = await create_counting_pool("userbot_core", userbot_config)
+    processing_db._pool = await create_counting_pool("processing_service", processing_main.config)
+
+    await processing_main.init_services()
+    await userbot_main.init_services()
+    await userbot_main.load_and_start_userbots()
+    send_dm_queue = await userbot_main.rabbit_channel.declare_queue(userbot_config.Q_SEND_DM, durable=True)
+    await send_dm_queue.consume(userbot_main.on_send_dm_request)
+    owner_confirmed_queue = await processing_main.rabbit_channel.declare_queue(userbot_config.Q_OWNER_CONFIRMED, durable=True)
+    await owner_confirmed_queue.consume(lambda message: on_owner_confirmed(timeline, message))
+
+    while len(userbot_main.userbot_clients) < args.accounts:
+        await asyncio.sleep(0.05)
+    client = next(iter(userbot_main.userbot_clients.values()))
+    rng = random.Random(args.seed)
+    query_counts.clear() # Запросы запуска сервисов не считаем
+
+    print(f"Injecting {args.rate} posts/s for {args.duration}s (ads {args.ad_ratio:.0%}, owners {args.owner_ratio:.0%})...")
+    posts = ads = 0
+    ingest_tasks = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.duration:
+        is_ad = rng.random() < args.ad_ratio
+        author_id = FIRST_AUTHOR_ID + posts
+        message = FakeMessage(
+            BENCH_CHANNEL_ID, make_post(rng, is_ad), from_user=FakeUser(author_id, f"author{author_id}"),
+            link=f"https://t.me/c/{-BENCH_CHANNEL_ID}/{posts}"
+        )
+
+        async def ingest(author_id=author_id, message=message):
+            timeline.mark(author_id, "post")
+            await userbot_main.process_channel_message(client, message)
+            timeline.mark(author_id, "recorded")
+        ingest_tasks.append(asyncio.create_task(ingest()))
+        posts += 1
+        ads += is_ad
+        await asyncio.sleep(max(0.0, started + posts / args.rate - time.perf_counter()))
+    injected_for = time.perf_counter() - started
+    await asyncio.gather(*ingest_tasks)
+
+    # Ждем хвост конвейера: пока новые подтверждения перестанут приходить
+    confirmed = -1
+    while confirmed != len(timeline.latencies("post", "confirmed")):
+        confirmed = len(timeline.latencies("post", "confirmed"))
+        await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+
+    await shutdown()
+
+    print(f"posts: {posts} ({posts / injected_for:.1f}/s), ads: {ads}, "
+          f"DMs sent: {len(timeline.latencies('post', 'sent'))}, owners confirmed: {confirmed}")
+    print(f"confirmed throughput: {confirmed / elapsed:.1f}/s over {elapsed:.1f}s")
+    print(f"{'stage':<28} {'n':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    rows = STAGES + [("end_to_end", "post", "confirmed")]
+    for name, start, end in rows:
+        values = timeline.latencies(start, end)
+        if name == "end_to_end":
+            values = [v - args.reply_delay for v in values] # Без синтетической паузы перед ответом
+        if values:
+            print(f"{name:<28} {len(values):>6} {percentile(values, 0.5) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}")
+        else:
+            print(f"{name:<28} {0:>6} {'-':>9} {'-':>9}")
+    for label, count in sorted(query_counts.items()):
+        print(f"DB queries {label}: {count} ({count / max(posts, 1):.2f} per post)")
+
+
+async def shutdown():
+    for component in (
+        userbot_main.channel_catch_up, userbot_main.shard_manager, userbot_main.dm_scheduler, userbot_main.processed_message_writer,
+        userbot_main.dialog_message_writer, userbot_main.outbox_relay, processing_main.new_ad_consumer,
+        processing_main.outbox_relay, userbot_main.channel_checkpoints,
+    ):
+        if component:
+            await component.close()
+    await userbot_main.rate_limiter.close_local_cache()
+    await userbot_main.config_cache.close()
+    await processing_main.config_cache.close()
+    await userbot_main.tracing.close()
+    await processing_main.tracing.close()
+    await userbot_main.rabbit_connection.close()
+    await processing_main.rabbit_connection.close()
+    await userbot_db._pool.close()
+    await processing_db._pool.close()
+
+
+def main():
+    global args
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="Постов в секунду")
+    parser.add_argument("--duration", type=float, default=30, help="Сколько секунд подавать посты")
+    parser.add_argument("--ad-ratio", type=float, default=0.5, help="Доля постов-объявлений")
+    parser.add_argument("--owner-ratio", type=float, default=0.5, help="Доля ответов собственников")
+    parser.add_argument("--reply-delay", type=float, default=0.1, help="Пауза перед ответом пользователя на DM, с")
+    parser.add_argument("--accounts", type=int, default=5, help="Сколько фейковых аккаунтов userbot")
+    parser.add_argument("--drain", type=float, default=3, help="Ожидание хвоста конвейера после подачи постов, с")
+    parser.add_argument("--rabbitmq-url", help="Настоящий RabbitMQ (amqp://...) вместо брокера в памяти")
+    parser.add_argument("--redis-url", help="Настоящий Redis (redis://...) вместо fakeredis")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run())
+
+
+args = None
+
+if __name__ == "__main__":
+    main()
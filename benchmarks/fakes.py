@@ -0,0 +1,306 @@
+"""
+Локальные заменители внешних систем для бенчмарков: брокер RabbitMQ в памяти
+(подмножество API aio-pika, которым пользуются сервисы), клиент Pyrogram без сети
+и пул asyncpg со счетчиком запросов.
+"""
+import asyncio
+import collections
+import contextlib
+import datetime
+import itertools
+import logging
+import types
+
+logger = logging.getLogger(__name__)
+
+
+# --- RabbitMQ ---
+
+class FakeIncomingMessage:
+    def __init__(self, queue, message, consumer):
+        self._queue = queue
+        self._consumer = consumer
+        self._message = message
+        self.body = message.body
+        self.content_type = message.content_type
+        self.headers = message.headers
+        self.message_id = message.message_id
+        self.delivery_mode = message.delivery_mode
+        self.processed = False
+
+    def _settle(self, requeue: bool = False):
+        if self.processed:
+            return
+        self.processed = True
+        self._consumer.in_flight -= 1
+        if requeue:
+            self._queue.messages.appendleft(self._message)
+        self._queue.wakeup()
+
+    async def ack(self, multiple: bool = False):
+        self._settle()
+
+    async def reject(self, requeue: bool = False):
+        self._settle(requeue)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        self._settle(requeue)
+
+    @contextlib.asynccontextmanager
+    async def process(self, requeue: bool = False, reject_on_redelivered: bool = False, ignore_processed: bool = False):
+        try:
+            yield self
+        except BaseException:
+            self._settle(requeue)
+            raise
+        self._settle()
+
+
+class _Consumer:
+    def __init__(self, callback, prefetch_count: int):
+        self.callback = callback
+        self.prefetch_count = prefetch_count # 0 — без ограничения, как в RabbitMQ
+        self.in_flight = 0
+
+    def has_capacity(self) -> bool:
+        return not self.prefetch_count or self.in_flight < self.prefetch_count
+
+
+class FakeQueue:
+    """
+    Очередь брокера: доставляет сообщения потребителям по кругу с учетом prefetch их
+    каналов; x-message-ttl + x-dead-letter-routing-key перекладывают сообщение по таймеру.
+    """
+
+    def __init__(self, broker, name: str, arguments: dict = None):
+        self.broker = broker
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages = collections.deque()
+        self.consumers = []
+        self._round_robin = 0
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def wakeup(self):
+        self._ready.set()
+
+    def put(self, message):
+        ttl = self.arguments.get("x-message-ttl")
+        dead_letter_key = self.arguments.get("x-dead-letter-routing-key")
+        if ttl is not None and dead_letter_key and not self.consumers:
+            asyncio.get_running_loop().call_later(ttl / 1000, self.broker.route, dead_letter_key, message)
+            return
+        self.messages.append(message)
+        self.wakeup()
+
+    def add_consumer(self, consumer: _Consumer):
+        self.consumers.append(consumer)
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+        self.wakeup()
+
+    def _next_consumer(self):
+        for _ in range(len(self.consumers)):
+            consumer = self.consumers[self._round_robin % len(self.consumers)]
+            self._round_robin += 1
+            if consumer.has_capacity():
+                return consumer
+        return None
+
+    async def _dispatch(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.messages:
+                consumer = self._next_consumer()
+                if consumer is None:
+                    break # Ждем ack/reject, освобождающих prefetch
+                consumer.in_flight += 1
+                incoming = FakeIncomingMessage(self, self.messages.popleft(), consumer)
+                asyncio.create_task(self._deliver(consumer, incoming))
+
+    async def _deliver(self, consumer: _Consumer, incoming: FakeIncomingMessage):
+        try:
+            await consumer.callback(incoming)
+        except Exception as e:
+            logger.error(f"Consumer of {self.name} failed: {e}")
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+
+
+class InMemoryBroker:
+    """Default exchange RabbitMQ: сообщение уходит в очередь с именем routing_key (или теряется, если ее нет)."""
+
+    def __init__(self):
+        self.queues = {}
+        self.published = collections.Counter() # routing_key -> число публикаций
+
+    def queue(self, name: str, arguments: dict = None) -> FakeQueue:
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = FakeQueue(self, name, arguments)
+        elif arguments:
+            queue.arguments = arguments
+        return queue
+
+    def route(self, routing_key: str, message):
+        self.published[routing_key] += 1
+        queue = self.queues.get(routing_key)
+        if queue is not None:
+            queue.put(message)
+
+    def close(self):
+        for queue in self.queues.values():
+            queue.close()
+
+
+class _FakeExchange:
+    def __init__(self, broker: InMemoryBroker):
+        self._broker = broker
+
+    async def publish(self, message, routing_key: str, **kwargs):
+        self._broker.route(routing_key, message)
+
+
+class _FakeQueueHandle:
+    def __init__(self, channel, queue: FakeQueue):
+        self._channel = channel
+        self._queue = queue
+        self.name = queue.name
+        self.declaration_result = types.SimpleNamespace(message_count=len(queue.messages))
+
+    async def consume(self, callback, no_ack: bool = False, **kwargs):
+        self._queue.add_consumer(_Consumer(callback, self._channel.prefetch_count))
+        return f"ctag.{self.name}.{len(self._queue.consumers)}"
+
+
+class FakeChannel:
+    def __init__(self, broker: InMemoryBroker):
+        self._broker = broker
+        self.default_exchange = _FakeExchange(broker)
+        self.prefetch_count = 0
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, durable: bool = False, arguments: dict = None, **kwargs):
+        return _FakeQueueHandle(self, self._broker.queue(name, arguments))
+
+    async def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, broker: InMemoryBroker):
+        self._broker = broker
+
+    async def channel(self, publisher_confirms: bool = True, **kwargs):
+        return FakeChannel(self._broker)
+
+    async def close(self):
+        pass
+
+
+# --- Telegram ---
+
+class FakeUser:
+    def __init__(self, user_id: int, username: str = None, is_bot: bool = False):
+        self.id = user_id
+        self.username = username
+        self.is_bot = is_bot
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id: int, text: str, from_user: FakeUser = None, link: str = None, message_id: int = None):
+        self.id = message_id or next(self._ids)
+        self.chat = types.SimpleNamespace(id=chat_id)
+        self.text = text
+        self.from_user = from_user
+        self.link = link
+        self.date = datetime.datetime.now() # Как в Pyrogram: локальное время без часового пояса
+
+
+class FakeClient:
+    """
+    Замена pyrogram.Client с тем же конструктором: ничего не подключает, send_message
+    сразу "доставляет" сообщение и передает его в on_send(client, user_id, text),
+    чтобы бенчмарк мог сымитировать ответ пользователя.
+    """
+    on_send = None # async (client, user_id, text) -> None
+    history = {} # chat_id -> [FakeMessage, ...] от старых к новым, для get_chat_history
+    start_delay = 0.0
+
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        self.me = FakeUser(10_000_000 + int(name), username=f"bench_account_{name}")
+        self.handlers = []
+        self.sent = 0
+
+    def add_handler(self, *args, **kwargs):
+        self.handlers.append(args)
+
+    async def start(self):
+        await asyncio.sleep(self.start_delay)
+
+    async def stop(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def get_chat_history(self, chat_id: int, limit: int = 0):
+        # Как в Pyrogram: от новых к старым. Бенчмарк историю не задает — догон ничего не находит
+        for n, message in enumerate(reversed(FakeClient.history.get(chat_id, []))):
+            if limit and n >= limit:
+                return
+            yield message
+
+    async def send_message(self, chat_id: int, text: str):
+        self.sent += 1
+        message = FakeMessage(chat_id, text, from_user=self.me)
+        if FakeClient.on_send is not None:
+            asyncio.create_task(FakeClient.on_send(self, chat_id, text))
+        return message
+
+
+# --- Postgres ---
+
+class _CountingConnection:
+    QUERY_METHODS = ("execute", "executemany", "fetch", "fetchrow", "fetchval", "copy_from_table", "copy_records_to_table")
+
+    def __init__(self, conn, counter: collections.Counter, label: str):
+        self._conn = conn
+        self._counter = counter
+        self._label = label
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in self.QUERY_METHODS:
+            return attr
+
+        async def counted(*args, **kwargs):
+            self._counter[self._label] += 1
+            return await attr(*args, **kwargs)
+        return counted
+
+
+class CountingPool:
+    """Обертка пула asyncpg: считает запросы по метке сервиса (label)."""
+
+    def __init__(self, pool, counter: collections.Counter, label: str):
+        self._pool = pool
+        self._counter = counter
+        self._label = label
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        async with self._pool.acquire() as conn:
+            yield _CountingConnection(conn, self._counter, self._label)
+
+    async def close(self):
+        await self._pool.close()
@@ -0,0 +1,67 @@
+"""
+Разбивка задержек лида по этапам из трасс, выгруженных сервисами (TRACE_EXPORT_PATH,
+формат — см. tracing.py): для каждого перехода между соседними этапами и для всей
+трассы по исходам печатает число трасс и перцентили.
+
+Запуск из корня репозитория:
+    python -m benchmarks.trace_report traces/*.jsonl [--outcome owner]
+"""
+import argparse
+import json
+import statistics
+
+
+def load_traces(paths: list) -> dict:
+    """trace_id -> запись. Ответы 'pending' выгружают трассу повторно — берем самую длинную."""
+    traces = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                known = traces.get(record["trace_id"])
+                if known is None or len(record["stages"]) >= len(known["stages"]):
+                    traces[record["trace_id"]] = record
+    return traces
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def print_table(title: str, rows: dict):
+    print(f"{title:<56} {'n':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+    for name, values in rows.items():
+        print(f"{name:<56} {len(values):>6} {percentile(values, 0.5) * 1000:>10.1f} {percentile(values, 0.9) * 1000:>10.1f} "
+              f"{percentile(values, 0.99) * 1000:>10.1f} {statistics.fmean(values) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSONL-файлы трасс сервисов")
+    parser.add_argument("--outcome", help="Только трассы с этим исходом (owner, agent, pending, known_user, ...)")
+    args = parser.parse_args()
+
+    traces = [t for t in load_traces(args.paths).values() if not args.outcome or t["outcome"] == args.outcome]
+    if not traces:
+        parser.error("no traces found")
+
+    # Переходы в порядке первого появления: он совпадает с порядком этапов конвейера
+    transitions = {}
+    end_to_end = {}
+    for trace in traces:
+        stages = trace["stages"]
+        for (start, started_at), (end, ended_at) in zip(stages, stages[1:]):
+            transitions.setdefault(f"{start} -> {end}", []).append(ended_at - started_at)
+        end_to_end.setdefault(f"{stages[0][0]} -> {stages[-1][0]} [{trace['outcome']}]", []).append(stages[-1][1] - stages[0][1])
+
+    print(f"traces: {len(traces)}")
+    print_table("stage transition", transitions)
+    print()
+    print_table("end to end", end_to_end)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+-- Базовая схема для новой базы. Дальнейшие изменения схемы — миграциями сервиса db_migrate
+-- (db_migrate/src/migrations), они применяются поверх этого файла и к новым, и к существующим базам.
+
 -- Таблица для настроек бота (например, приветственное сообщение, ID админ-канала)
 CREATE TABLE IF NOT EXISTS settings (
     key TEXT PRIMARY KEY,
@@ -35,6 +38,7 @@ CREATE TABLE IF NOT EXISTS processed_messages (
     channel_telegram_id BIGINT NOT NULL REFERENCES channels(telegram_id),
     message_text TEXT NOT NULL,
     message_hash TEXT UNIQUE NOT NULL, -- Хеш текста для дедупликации
+    simhash BIGINT, -- 64-битный SimHash текста для поиска почти-дубликатов
     author_telegram_id BIGINT,
     author_username TEXT,
     original_link TEXT,
@@ -52,10 +56,48 @@ CREATE TABLE IF NOT EXISTS contacted_users (
     status contact_status DEFAULT 'pending',
     first_contact_message_id BIGINT,
     last_contact_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    dialog_history JSONB DEFAULT '[]', -- История диалога (опционально)
+    dialog_history JSONB DEFAULT '[]', -- Устарело: история диалога хранится в dialog_messages
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- История диалогов: append-only, секционирована по месяцам created_at
+CREATE TYPE dialog_direction AS ENUM ('out', 'in'); -- out: DM от userbot-а, in: ответ пользователя
+
+CREATE TABLE IF NOT EXISTS dialog_messages (
+    id BIGSERIAL,
+    user_telegram_id BIGINT NOT NULL, -- Собеседник (contacted_users.telegram_id)
+    account_id INTEGER, -- Userbot-аккаунт, через который шел диалог (user_accounts.id)
+    direction dialog_direction NOT NULL,
+    message_text TEXT NOT NULL,
+    telegram_message_id BIGINT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Страховочная секция для строк вне заранее созданных месяцев
+CREATE TABLE IF NOT EXISTS dialog_messages_default PARTITION OF dialog_messages DEFAULT;
+
+CREATE INDEX IF NOT EXISTS dialog_messages_user_idx ON dialog_messages (user_telegram_id, created_at);
+
+-- Создает месячные секции dialog_messages на текущий и months_ahead следующих месяцев
+CREATE OR REPLACE FUNCTION ensure_dialog_messages_partitions(months_ahead INTEGER) RETURNS void AS $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF dialog_messages FOR VALUES FROM (%L) TO (%L)',
+            'dialog_messages_' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_dialog_messages_partitions(2);
+
 -- Таблица для подтвержденных собственников (лидов)
 CREATE TABLE IF NOT EXISTS owner_leads (
     id SERIAL PRIMARY KEY,
@@ -64,3 +106,51 @@ CREATE TABLE IF NOT EXISTS owner_leads (
     owner_response_text TEXT NOT NULL,
     found_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Уведомления об изменении конфигурации (каналы, настройки) для in-memory кэшей сервисов
+CREATE OR REPLACE FUNCTION notify_config_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('config_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER channels_config_changed
+    AFTER INSERT OR UPDATE OR DELETE ON channels
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_config_changed();
+
+CREATE TRIGGER settings_config_changed
+    AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_config_changed();
+
+-- Уведомления userbot_core об изменении аккаунтов (добавление/отключение без перезапуска)
+CREATE OR REPLACE FUNCTION notify_user_accounts_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_accounts_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_accounts_changed
+    AFTER INSERT OR DELETE OR UPDATE OF session_string, is_active ON user_accounts
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_user_accounts_changed();
+
+-- Transactional outbox: события пишутся в одной транзакции с изменением данных,
+-- relay сервисов публикует их в RabbitMQ и удаляет после подтверждения брокера
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    routing_key TEXT NOT NULL, -- Очередь назначения, она же тип сообщения в envelope
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION notify_outbox_added() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('outbox_added', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER outbox_added
+    AFTER INSERT ON outbox
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_outbox_added();
@@ -0,0 +1,25 @@
+import os
+
+# Database settings
+DB_HOST = os.getenv("POSTGRES_HOST", "db")
+DB_NAME = os.getenv("POSTGRES_DB", "telegram_owner_finder")
+DB_USER = os.getenv("POSTGRES_USER", "user")
+DB_PASS = os.getenv("POSTGRES_PASSWORD", "password")
+
+# Schema migrations
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATIONS_LOCK_ID = 724311 # pg_advisory_lock: миграции не выполняются параллельно из нескольких контейнеров
+
+# Monthly partitions and retention
+PARTITION_MONTHS_AHEAD = 2 # Сколько будущих месячных секций держать созданными
+PROCESSED_MESSAGES_RETENTION_MONTHS = int(os.getenv("PROCESSED_MESSAGES_RETENTION_MONTHS", "6"))
+DIALOG_MESSAGES_RETENTION_MONTHS = int(os.getenv("DIALOG_MESSAGES_RETENTION_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/archive") # Куда выгружаются (csv.gz) отсоединенные секции
+DETACH_LOCK_TIMEOUT_MS = int(os.getenv("DETACH_LOCK_TIMEOUT_MS", "5000")) # DETACH без CONCURRENTLY не ждет блокировку дольше — секция отсоединится при следующем обслуживании
+MAINTENANCE_INTERVAL_SECONDS = 24 * 3600
+
+# Partitioned tables: имя -> срок хранения в месяцах
+PARTITIONED_TABLES = {
+    "processed_messages": PROCESSED_MESSAGES_RETENTION_MONTHS,
+    "dialog_messages": DIALOG_MESSAGES_RETENTION_MONTHS,
+}
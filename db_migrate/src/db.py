@@ -0,0 +1,11 @@
+import asyncpg
+from db_migrate.src import config
+
+async def connect():
+    """Обслуживание схемы выполняется на одном соединении, без пула."""
+    return await asyncpg.connect(
+        database=config.DB_NAME,
+        user=config.DB_USER,
+        password=config.DB_PASS,
+        host=config.DB_HOST
+    )
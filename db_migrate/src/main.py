@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from db_migrate.src import config, db
+from db_migrate.src.migrate import apply_migrations
+from db_migrate.src.plan_check import check_plans
+from db_migrate.src.retention import apply_retention, ensure_partitions
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def run_migrate():
+    conn = await db.connect()
+    try:
+        applied = await apply_migrations(conn)
+        logger.info(f"Migrations applied: {', '.join(applied) if applied else 'none, schema is up to date'}.")
+    finally:
+        await conn.close()
+
+
+async def run_plan_check() -> int:
+    conn = await db.connect()
+    try:
+        failures = await check_plans(conn)
+    finally:
+        await conn.close()
+    return 1 if failures else 0
+
+
+async def run_maintenance_once():
+    conn = await db.connect()
+    try:
+        await ensure_partitions(conn)
+        await apply_retention(conn)
+    finally:
+        await conn.close()
+
+
+async def run_maintenance():
+    """Раз в MAINTENANCE_INTERVAL_SECONDS создает секции наперед и архивирует устаревшие."""
+    while True:
+        try:
+            await run_maintenance_once()
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+        await asyncio.sleep(config.MAINTENANCE_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы и обслуживание секционированных таблиц.")
+    parser.add_argument("command", choices=["migrate", "plan_check", "maintenance", "maintenance_once"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        asyncio.run(run_migrate())
+    elif args.command == "plan_check":
+        sys.exit(asyncio.run(run_plan_check()))
+    elif args.command == "maintenance":
+        asyncio.run(run_maintenance())
+    else:
+        asyncio.run(run_maintenance_once())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import logging
+import os
+
+import asyncpg
+
+from db_migrate.src import config
+
+logger = logging.getLogger(__name__)
+
+
+def list_migrations() -> list:
+    """Файлы миграций NNNN_описание.sql в порядке номеров: (версия, путь)."""
+    return [
+        (name[:-len(".sql")], os.path.join(config.MIGRATIONS_DIR, name))
+        for name in sorted(os.listdir(config.MIGRATIONS_DIR))
+        if name.endswith(".sql")
+    ]
+
+
+async def apply_migrations(conn: asyncpg.Connection) -> list:
+    """
+    Применяет еще не выполненные миграции, каждую в своей транзакции, и отмечает их
+    в schema_migrations. Базовая схема — db_init/init.sql (выполняется Postgres при
+    создании базы), миграции идут поверх нее. Возвращает список примененных версий.
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await conn.execute("SELECT pg_advisory_lock($1)", config.MIGRATIONS_LOCK_ID)
+    try:
+        applied = {row['version'] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        newly_applied = []
+        for version, path in list_migrations():
+            if version in applied:
+                continue
+            with open(path, encoding="utf-8") as f:
+                sql = f.read()
+            logger.info(f"Applying migration {version}...")
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", config.MIGRATIONS_LOCK_ID)
@@ -0,0 +1,75 @@
+-- Приводит базы, созданные до появления db_migrate, к схеме db_init/init.sql.
+-- На свежей базе (init.sql уже выполнен) ничего не меняет.
+
+ALTER TABLE processed_messages ADD COLUMN IF NOT EXISTS simhash BIGINT;
+
+CREATE OR REPLACE FUNCTION notify_config_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('config_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS channels_config_changed ON channels;
+CREATE TRIGGER channels_config_changed
+    AFTER INSERT OR UPDATE OR DELETE ON channels
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_config_changed();
+
+DROP TRIGGER IF EXISTS settings_config_changed ON settings;
+CREATE TRIGGER settings_config_changed
+    AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_config_changed();
+
+CREATE OR REPLACE FUNCTION notify_user_accounts_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_accounts_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_accounts_changed ON user_accounts;
+CREATE TRIGGER user_accounts_changed
+    AFTER INSERT OR DELETE OR UPDATE OF session_string, is_active ON user_accounts
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_user_accounts_changed();
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    routing_key TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION notify_outbox_added() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('outbox_added', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS outbox_added ON outbox;
+CREATE TRIGGER outbox_added
+    AFTER INSERT ON outbox
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_outbox_added();
+
+DO $$
+BEGIN
+    CREATE TYPE dialog_direction AS ENUM ('out', 'in');
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS dialog_messages (
+    id BIGSERIAL,
+    user_telegram_id BIGINT NOT NULL,
+    account_id INTEGER,
+    direction dialog_direction NOT NULL,
+    message_text TEXT NOT NULL,
+    telegram_message_id BIGINT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS dialog_messages_default PARTITION OF dialog_messages DEFAULT;
+
+CREATE INDEX IF NOT EXISTS dialog_messages_user_idx ON dialog_messages (user_telegram_id, created_at);
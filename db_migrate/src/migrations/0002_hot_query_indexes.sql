@@ -0,0 +1,10 @@
+-- Индексы под горячие запросы (проверяются командой plan_check).
+-- Таблицы небольшие, поэтому индексы строятся обычным CREATE INDEX внутри транзакции миграции.
+
+-- /list_leads: последние лиды по found_at и соединение с contacted_users/processed_messages
+CREATE INDEX IF NOT EXISTS owner_leads_found_at_idx ON owner_leads (found_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS owner_leads_contacted_user_id_idx ON owner_leads (contacted_user_id);
+CREATE INDEX IF NOT EXISTS owner_leads_original_message_id_idx ON owner_leads (original_message_id);
+
+-- Выборки и подсчеты контактов по статусу
+CREATE INDEX IF NOT EXISTS contacted_users_status_idx ON contacted_users (status);
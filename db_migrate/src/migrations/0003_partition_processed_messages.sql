@@ -0,0 +1,88 @@
+-- Секционирование processed_messages по месяцам processed_at.
+-- Уникальность (message_hash) и (message_telegram_id, channel_telegram_id) на секционированной
+-- таблице потребовала бы включить processed_at в ключ, поэтому дедупликация переезжает
+-- в несекционированную таблицу ключей processed_message_keys.
+
+-- Создает месячные секции parent_YYYY_MM с месяца from_month по текущий + months_ahead
+CREATE OR REPLACE FUNCTION create_monthly_partitions(parent TEXT, from_month DATE, months_ahead INTEGER) RETURNS void AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            parent || '_' || to_char(month_start, 'YYYY_MM'),
+            parent,
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_dialog_messages_partitions(months_ahead INTEGER) RETURNS void AS $$
+BEGIN
+    PERFORM create_monthly_partitions('dialog_messages', CURRENT_DATE, months_ahead);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Внешний ключ на секционированную таблицу возможен только по ключу с processed_at;
+-- к тому же старые секции уходят в архив, а лиды остаются
+ALTER TABLE owner_leads DROP CONSTRAINT IF EXISTS owner_leads_original_message_id_fkey;
+ALTER TABLE owner_leads ALTER COLUMN original_message_id TYPE BIGINT;
+
+ALTER TABLE processed_messages RENAME TO processed_messages_legacy;
+ALTER TABLE processed_messages_legacy RENAME CONSTRAINT processed_messages_pkey TO processed_messages_legacy_pkey;
+ALTER TABLE processed_messages_legacy RENAME CONSTRAINT processed_messages_message_hash_key TO processed_messages_legacy_message_hash_key;
+ALTER TABLE processed_messages_legacy RENAME CONSTRAINT unique_message_in_channel TO processed_messages_legacy_unique_message_in_channel;
+ALTER SEQUENCE processed_messages_id_seq OWNED BY NONE;
+
+CREATE TABLE processed_messages (
+    id BIGINT NOT NULL DEFAULT nextval('processed_messages_id_seq'),
+    message_telegram_id BIGINT NOT NULL,
+    channel_telegram_id BIGINT NOT NULL REFERENCES channels(telegram_id),
+    message_text TEXT NOT NULL,
+    message_hash TEXT NOT NULL, -- Уникальность обеспечивает processed_message_keys
+    simhash BIGINT,
+    author_telegram_id BIGINT,
+    author_username TEXT,
+    original_link TEXT,
+    processed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, processed_at)
+) PARTITION BY RANGE (processed_at);
+
+ALTER SEQUENCE processed_messages_id_seq AS BIGINT OWNED BY processed_messages.id;
+
+CREATE TABLE processed_messages_default PARTITION OF processed_messages DEFAULT;
+
+CREATE INDEX processed_messages_processed_at_idx ON processed_messages (processed_at);
+
+-- Ключи дедупликации: строка на каждое сохраненное сообщение, без текста
+CREATE TABLE processed_message_keys (
+    message_hash TEXT PRIMARY KEY,
+    message_telegram_id BIGINT NOT NULL,
+    channel_telegram_id BIGINT NOT NULL,
+    processed_message_id BIGINT NOT NULL,
+    processed_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT unique_message_key_in_channel UNIQUE (message_telegram_id, channel_telegram_id)
+);
+
+CREATE INDEX processed_message_keys_processed_at_idx ON processed_message_keys (processed_at);
+
+SELECT create_monthly_partitions(
+    'processed_messages',
+    COALESCE((SELECT min(processed_at) FROM processed_messages_legacy)::date, CURRENT_DATE),
+    2
+);
+
+INSERT INTO processed_messages (id, message_telegram_id, channel_telegram_id, message_text, message_hash, simhash, author_telegram_id, author_username, original_link, processed_at)
+SELECT id, message_telegram_id, channel_telegram_id, message_text, message_hash, simhash, author_telegram_id, author_username, original_link, COALESCE(processed_at, CURRENT_TIMESTAMP)
+FROM processed_messages_legacy;
+
+INSERT INTO processed_message_keys (message_hash, message_telegram_id, channel_telegram_id, processed_message_id, processed_at)
+SELECT message_hash, message_telegram_id, channel_telegram_id, id, COALESCE(processed_at, CURRENT_TIMESTAMP)
+FROM processed_messages_legacy;
+
+DROP TABLE processed_messages_legacy;
@@ -0,0 +1,3 @@
+-- Контекст трассировки лида (tracing.py сервисов) для событий outbox:
+-- relay публикует его в AMQP-заголовке x-trace. NULL — событие без трассы.
+ALTER TABLE outbox ADD COLUMN IF NOT EXISTS trace JSONB;
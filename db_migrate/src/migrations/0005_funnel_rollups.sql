@@ -0,0 +1,168 @@
+-- Почасовые сводки воронки для /stats: объявления -> контакты -> ответы -> собственники
+-- по каналам и отправленные DM/ответы по аккаунтам. Сводки ведут statement-триггеры
+-- с transition tables: одна агрегированная запись на пачку строк (BatchWriter пишет пачками),
+-- без сканирования исходных таблиц. Отсоединение секций при архивации триггеры не вызывает,
+-- поэтому сводки переживают архив.
+
+CREATE TABLE IF NOT EXISTS channel_stats_hourly (
+    channel_telegram_id BIGINT NOT NULL,
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    ads INTEGER NOT NULL DEFAULT 0, -- Сохраненные объявления (processed_messages)
+    contacted INTEGER NOT NULL DEFAULT 0, -- Новые контакты по объявлениям канала (contacted_users)
+    replied INTEGER NOT NULL DEFAULT 0, -- Контакты, ответ которых классифицирован (pending -> owner/agent)
+    owners INTEGER NOT NULL DEFAULT 0, -- Лиды (owner_leads)
+    PRIMARY KEY (channel_telegram_id, hour)
+);
+
+CREATE TABLE IF NOT EXISTS account_stats_hourly (
+    account_id INTEGER NOT NULL,
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    dms_sent INTEGER NOT NULL DEFAULT 0, -- Исходящие сообщения диалогов
+    replies INTEGER NOT NULL DEFAULT 0, -- Входящие сообщения диалогов
+    PRIMARY KEY (account_id, hour)
+);
+
+-- /stats читает сводки за последние N часов
+CREATE INDEX IF NOT EXISTS channel_stats_hourly_hour_idx ON channel_stats_hourly (hour);
+CREATE INDEX IF NOT EXISTS account_stats_hourly_hour_idx ON account_stats_hourly (hour);
+
+-- ORDER BY в каждом upsert: параллельные пачки блокируют строки сводок в одном порядке и не взаимоблокируются
+
+CREATE OR REPLACE FUNCTION rollup_processed_messages() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO channel_stats_hourly (channel_telegram_id, hour, ads)
+    SELECT channel_telegram_id, date_trunc('hour', processed_at), count(*)
+    FROM new_rows
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET ads = channel_stats_hourly.ads + EXCLUDED.ads;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_contacted_users_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO channel_stats_hourly (channel_telegram_id, hour, contacted)
+    SELECT pm.channel_telegram_id, date_trunc('hour', n.created_at), count(*)
+    FROM new_rows n
+    JOIN processed_messages pm ON pm.id = n.first_contact_message_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET contacted = channel_stats_hourly.contacted + EXCLUDED.contacted;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_contacted_users_update() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO channel_stats_hourly (channel_telegram_id, hour, replied)
+    SELECT pm.channel_telegram_id, date_trunc('hour', n.last_contact_at), count(*)
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    JOIN processed_messages pm ON pm.id = n.first_contact_message_id
+    WHERE o.status = 'pending' AND n.status IN ('owner', 'agent')
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET replied = channel_stats_hourly.replied + EXCLUDED.replied;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_owner_leads() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO channel_stats_hourly (channel_telegram_id, hour, owners)
+    SELECT pm.channel_telegram_id, date_trunc('hour', n.found_at), count(*)
+    FROM new_rows n
+    JOIN processed_messages pm ON pm.id = n.original_message_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET owners = channel_stats_hourly.owners + EXCLUDED.owners;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_dialog_messages() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO account_stats_hourly (account_id, hour, dms_sent, replies)
+    SELECT account_id, date_trunc('hour', created_at),
+           count(*) FILTER (WHERE direction = 'out'),
+           count(*) FILTER (WHERE direction = 'in')
+    FROM new_rows
+    WHERE account_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, hour) DO UPDATE SET
+        dms_sent = account_stats_hourly.dms_sent + EXCLUDED.dms_sent,
+        replies = account_stats_hourly.replies + EXCLUDED.replies;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS processed_messages_rollup ON processed_messages;
+CREATE TRIGGER processed_messages_rollup
+    AFTER INSERT ON processed_messages
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_processed_messages();
+
+-- Повторный контакт (ON CONFLICT DO UPDATE в add_contacted_user) попадает в UPDATE, а не в INSERT
+DROP TRIGGER IF EXISTS contacted_users_insert_rollup ON contacted_users;
+CREATE TRIGGER contacted_users_insert_rollup
+    AFTER INSERT ON contacted_users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_contacted_users_insert();
+
+-- Transition tables несовместимы с UPDATE OF <столбец>: отбор по смене статуса — в функции
+DROP TRIGGER IF EXISTS contacted_users_update_rollup ON contacted_users;
+CREATE TRIGGER contacted_users_update_rollup
+    AFTER UPDATE ON contacted_users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_contacted_users_update();
+
+DROP TRIGGER IF EXISTS owner_leads_rollup ON owner_leads;
+CREATE TRIGGER owner_leads_rollup
+    AFTER INSERT ON owner_leads
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_owner_leads();
+
+DROP TRIGGER IF EXISTS dialog_messages_rollup ON dialog_messages;
+CREATE TRIGGER dialog_messages_rollup
+    AFTER INSERT ON dialog_messages
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_dialog_messages();
+
+-- Начальное заполнение из уже накопленных данных (единственный полный проход).
+-- Ответы считаем по текущему статусу и времени последнего контакта.
+TRUNCATE channel_stats_hourly, account_stats_hourly;
+
+INSERT INTO channel_stats_hourly (channel_telegram_id, hour, ads, contacted, replied, owners)
+SELECT channel_telegram_id, hour, sum(ads), sum(contacted), sum(replied), sum(owners)
+FROM (
+    SELECT channel_telegram_id, date_trunc('hour', processed_at) AS hour, count(*) AS ads, 0 AS contacted, 0 AS replied, 0 AS owners
+    FROM processed_messages
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT pm.channel_telegram_id, date_trunc('hour', cu.created_at), 0, count(*), 0, 0
+    FROM contacted_users cu
+    JOIN processed_messages pm ON pm.id = cu.first_contact_message_id
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT pm.channel_telegram_id, date_trunc('hour', cu.last_contact_at), 0, 0, count(*), 0
+    FROM contacted_users cu
+    JOIN processed_messages pm ON pm.id = cu.first_contact_message_id
+    WHERE cu.status IN ('owner', 'agent')
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT pm.channel_telegram_id, date_trunc('hour', ol.found_at), 0, 0, 0, count(*)
+    FROM owner_leads ol
+    JOIN processed_messages pm ON pm.id = ol.original_message_id
+    GROUP BY 1, 2
+) counts
+GROUP BY 1, 2;
+
+INSERT INTO account_stats_hourly (account_id, hour, dms_sent, replies)
+SELECT account_id, date_trunc('hour', created_at),
+       count(*) FILTER (WHERE direction = 'out'),
+       count(*) FILTER (WHERE direction = 'in')
+FROM dialog_messages
+WHERE account_id IS NOT NULL
+GROUP BY 1, 2;
@@ -0,0 +1,8 @@
+-- Последний обработанный пост каждого канала: с него userbot_core догоняет историю
+-- канала после простоя или переподключения (catch_up.py). Отдельная таблица, а не колонка
+-- channels: обновление channels вызывает NOTIFY config_changed и перезагрузку кэшей сервисов.
+CREATE TABLE IF NOT EXISTS channel_checkpoints (
+    channel_telegram_id BIGINT PRIMARY KEY,
+    last_message_id BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,95 @@
+-- "Ответили" в /stats — контакты, приславшие хотя бы один ответ, а не только те, чей ответ
+-- классифицирован (pending -> owner/agent): неясный ответ — тоже ответ. Первый входящий
+-- dialog_messages контакта отмечается в contacted_users.first_reply_at и засчитывается
+-- в channel_stats_hourly.replied (канал — по first_contact_message_id) и в
+-- account_stats_hourly.replies (аккаунт, получивший ответ). Так ответы по каналам и по
+-- аккаунтам считают одно и то же — ответивших контактов, а не входящие сообщения.
+
+ALTER TABLE contacted_users ADD COLUMN IF NOT EXISTS first_reply_at TIMESTAMP WITH TIME ZONE;
+
+-- Смена статуса больше не считается ответом
+DROP TRIGGER IF EXISTS contacted_users_update_rollup ON contacted_users;
+DROP FUNCTION IF EXISTS rollup_contacted_users_update();
+
+CREATE OR REPLACE FUNCTION rollup_dialog_messages() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO account_stats_hourly (account_id, hour, dms_sent)
+    SELECT account_id, date_trunc('hour', created_at), count(*)
+    FROM new_rows
+    WHERE account_id IS NOT NULL AND direction = 'out'
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, hour) DO UPDATE SET dms_sent = account_stats_hourly.dms_sent + EXCLUDED.dms_sent;
+
+    -- Блокируем строки контактов в одном порядке: параллельные пачки не взаимоблокируются,
+    -- и первый ответ засчитывает ровно одна из них (first_reply_at IS NULL под блокировкой)
+    PERFORM 1 FROM contacted_users
+    WHERE telegram_id IN (SELECT user_telegram_id FROM new_rows WHERE direction = 'in') AND first_reply_at IS NULL
+    ORDER BY telegram_id
+    FOR UPDATE;
+
+    WITH replies AS (
+        SELECT DISTINCT ON (user_telegram_id) user_telegram_id, account_id, created_at
+        FROM new_rows
+        WHERE direction = 'in'
+        ORDER BY user_telegram_id, created_at
+    ), first_replies AS (
+        UPDATE contacted_users cu SET first_reply_at = r.created_at
+        FROM replies r
+        WHERE cu.telegram_id = r.user_telegram_id AND cu.first_reply_at IS NULL
+        RETURNING cu.first_contact_message_id, r.account_id, cu.first_reply_at
+    ), channel_replies AS (
+        INSERT INTO channel_stats_hourly (channel_telegram_id, hour, replied)
+        SELECT pm.channel_telegram_id, date_trunc('hour', f.first_reply_at), count(*)
+        FROM first_replies f
+        JOIN processed_messages pm ON pm.id = f.first_contact_message_id
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET replied = channel_stats_hourly.replied + EXCLUDED.replied
+    )
+    INSERT INTO account_stats_hourly (account_id, hour, replies)
+    SELECT account_id, date_trunc('hour', first_reply_at), count(*)
+    FROM first_replies
+    WHERE account_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, hour) DO UPDATE SET replies = account_stats_hourly.replies + EXCLUDED.replies;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполнение по накопленной истории. Контактам без входящих dialog_messages (ответы
+-- до перехода на dialog_messages), но уже классифицированным, засчитываем last_contact_at.
+UPDATE contacted_users cu SET first_reply_at = COALESCE(r.first_reply_at, cu.last_contact_at)
+FROM (
+    SELECT cu.telegram_id, min(dm.created_at) AS first_reply_at
+    FROM contacted_users cu
+    LEFT JOIN dialog_messages dm ON dm.user_telegram_id = cu.telegram_id AND dm.direction = 'in'
+    GROUP BY cu.telegram_id
+) r
+WHERE cu.telegram_id = r.telegram_id AND cu.first_reply_at IS NULL
+  AND (r.first_reply_at IS NOT NULL OR cu.status IN ('owner', 'agent'));
+
+UPDATE channel_stats_hourly SET replied = 0 WHERE replied <> 0;
+UPDATE account_stats_hourly SET replies = 0 WHERE replies <> 0;
+
+INSERT INTO channel_stats_hourly (channel_telegram_id, hour, replied)
+SELECT pm.channel_telegram_id, date_trunc('hour', cu.first_reply_at), count(*)
+FROM contacted_users cu
+JOIN processed_messages pm ON pm.id = cu.first_contact_message_id
+WHERE cu.first_reply_at IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (channel_telegram_id, hour) DO UPDATE SET replied = EXCLUDED.replied;
+
+INSERT INTO account_stats_hourly (account_id, hour, replies)
+SELECT account_id, date_trunc('hour', created_at), count(*)
+FROM (
+    SELECT DISTINCT ON (dm.user_telegram_id) dm.account_id, dm.created_at
+    FROM dialog_messages dm
+    JOIN contacted_users cu ON cu.telegram_id = dm.user_telegram_id
+    WHERE dm.direction = 'in'
+    ORDER BY dm.user_telegram_id, dm.created_at
+) first_in
+WHERE account_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (account_id, hour) DO UPDATE SET replies = EXCLUDED.replies;
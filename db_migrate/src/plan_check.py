@@ -0,0 +1,80 @@
+import datetime
+import json
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Горячие запросы сервисов (копии SQL из их db.py) и параметры для EXPLAIN
+HOT_QUERIES = [
+    ("admin_bot.get_owner_leads_page", """
+        SELECT ol.id, ol.found_at, cu.telegram_id, cu.username, pm.message_text, pm.original_link, ol.owner_response_text
+        FROM owner_leads ol
+        JOIN contacted_users cu ON ol.contacted_user_id = cu.id
+        LEFT JOIN processed_messages pm ON ol.original_message_id = pm.id
+        WHERE (ol.found_at, ol.id) < ($1, $2)
+        ORDER BY ol.found_at DESC, ol.id DESC
+        LIMIT $3
+    """, [datetime.datetime.now(datetime.timezone.utc), 2 ** 31 - 1, 11]),
+    ("admin_bot.get_processed_message_text", "SELECT message_text FROM processed_messages WHERE id = $1", [1]),
+    ("processing_service.get_contacted_user_statuses", "SELECT telegram_id, status FROM contacted_users WHERE telegram_id = ANY($1::bigint[])", [[1, 2, 3]]),
+    ("contacted_users by status", "SELECT count(*) FROM contacted_users WHERE status = $1::contact_status", ["owner"]),
+    ("leads of a contacted user", "SELECT id FROM owner_leads WHERE contacted_user_id = $1", [1]),
+    ("userbot_core.get_recent_simhashes", """
+        SELECT simhash, processed_at FROM processed_messages
+        WHERE simhash IS NOT NULL AND processed_at > CURRENT_TIMESTAMP - make_interval(secs => $1)
+    """, [7 * 24 * 3600]),
+    ("userbot_core.record_processed_messages_bulk (existing keys)", """
+        SELECT processed_message_id FROM processed_message_keys
+        WHERE message_telegram_id = $1 AND channel_telegram_id = $2
+    """, [1, -1001]),
+    ("OutboxRelay.relay_batch", """
+        SELECT id, routing_key, payload FROM outbox
+        ORDER BY id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    """, [100]),
+    ("admin_bot.get_channel_stats (period)", """
+        SELECT channel_telegram_id, sum(ads) FROM channel_stats_hourly
+        WHERE hour >= date_trunc('hour', CURRENT_TIMESTAMP) - make_interval(hours => $1 - 1)
+        GROUP BY channel_telegram_id
+    """, [24]),
+    ("admin_bot.get_channel_stats (last ad)", """
+        SELECT max(hour) FROM channel_stats_hourly WHERE channel_telegram_id = $1 AND ads > 0
+    """, [-1001]),
+    ("dialog history of a user", """
+        SELECT direction, message_text, created_at FROM dialog_messages
+        WHERE user_telegram_id = $1
+        ORDER BY created_at
+    """, [1]),
+]
+
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+async def check_plans(conn: asyncpg.Connection) -> list:
+    """
+    Строит планы горячих запросов с enable_seqscan = off: если у запроса есть
+    подходящий индекс, планировщик обязан его выбрать, и Seq Scan в плане означает,
+    что индекса нет. Возвращает список (запрос, таблицы с Seq Scan) для проблемных запросов.
+    """
+    failures = []
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, sql, args in HOT_QUERIES:
+            plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))
+            tables = _seq_scans(plan[0]["Plan"])
+            if tables:
+                logger.error(f"{name}: sequential scan on {', '.join(tables)}")
+                failures.append((name, tables))
+            else:
+                logger.info(f"{name}: OK")
+    return failures
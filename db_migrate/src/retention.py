@@ -0,0 +1,145 @@
+import datetime
+import gzip
+import logging
+import os
+import re
+
+import asyncpg
+
+from db_migrate.src import config
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_RE = re.compile(r"_(\d{4})_(\d{2})$")
+
+
+def _add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+async def ensure_partitions(conn: asyncpg.Connection):
+    """Создает месячные секции всех секционированных таблиц на PARTITION_MONTHS_AHEAD вперед."""
+    for table in config.PARTITIONED_TABLES:
+        await conn.execute("SELECT create_monthly_partitions($1, CURRENT_DATE, $2)", table, config.PARTITION_MONTHS_AHEAD)
+
+
+async def list_partitions(conn: asyncpg.Connection, table: str) -> list:
+    """
+    Месячные секции таблицы: (имя, первый день месяца, отсоединяется ли). Секция DEFAULT не входит.
+    «Отсоединяется» — прерванный DETACH PARTITION CONCURRENTLY, его нужно завершить через FINALIZE.
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname, i.inhdetachpending
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    """, table)
+    partitions = []
+    for row in rows:
+        month = _partition_month(table, row['relname'])
+        if month:
+            partitions.append((row['relname'], month, row['inhdetachpending']))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+async def list_detached(conn: asyncpg.Connection, table: str) -> list:
+    """
+    Бывшие секции таблицы, уже отсоединенные, но еще не выгруженные в архив: архивация
+    прервалась между DETACH и DROP. Возвращает (имя, первый день месяца).
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname
+        FROM pg_class c
+        WHERE c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = $1::regclass)
+          AND c.relkind = 'r' AND NOT c.relispartition
+          AND c.relname LIKE $2
+    """, table, f"{table}\\_%")
+    detached = []
+    for row in rows:
+        month = _partition_month(table, row['relname'])
+        if month:
+            detached.append((row['relname'], month))
+    return sorted(detached, key=lambda p: p[1])
+
+
+def _partition_month(table: str, name: str):
+    match = _PARTITION_RE.search(name)
+    if match and name == f"{table}_{match.group(1)}_{match.group(2)}":
+        return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+    return None
+
+
+async def detach_partition(conn: asyncpg.Connection, table: str, partition: str, pending: bool = False):
+    """
+    Отсоединяет секцию, не держа родительскую таблицу заблокированной на время выгрузки.
+    DETACH PARTITION CONCURRENTLY (PG14) берет только SHARE UPDATE EXCLUSIVE и не может
+    выполняться в транзакции — conn должен быть вне транзакции. Если у таблицы есть секция
+    DEFAULT, CONCURRENTLY недоступен: тогда обычный DETACH в отдельной короткой транзакции
+    с lock_timeout, чтобы запросы сервисов не выстраивались в очередь за блокировкой.
+    """
+    if pending:
+        await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}" FINALIZE')
+    elif await conn.fetchval("SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = $1::regclass", table):
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = {config.DETACH_LOCK_TIMEOUT_MS}")
+            await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}"')
+    else:
+        await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}" CONCURRENTLY')
+
+
+async def archive_detached(conn: asyncpg.Connection, partition: str) -> str:
+    """
+    Выгружает отсоединенную секцию в ARCHIVE_DIR/<секция>.csv.gz и удаляет таблицу —
+    только когда архив записан на диск. Если выгрузка не удалась, таблица остается и
+    будет выгружена при следующем обслуживании (list_detached).
+    """
+    os.makedirs(config.ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(config.ARCHIVE_DIR, f"{partition}.csv.gz")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            await conn.copy_from_table(partition, output=f, format="csv", header=True)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    await conn.execute(f'DROP TABLE "{partition}"')
+    return path
+
+
+async def archive_partition(conn: asyncpg.Connection, table: str, partition: str, pending: bool = False) -> str:
+    """
+    Отсоединяет секцию (DETACH фиксируется сразу), затем выгружает ее в архив и удаляет.
+    Выгрузка идет уже без блокировок на родительской таблице.
+    """
+    await detach_partition(conn, table, partition, pending)
+    return await archive_detached(conn, partition)
+
+
+async def apply_retention(conn: asyncpg.Connection, today: datetime.date = None) -> list:
+    """
+    Архивирует секции, целиком вышедшие за срок хранения своей таблицы.
+    Для processed_messages заодно удаляет ключи дедупликации архивированных сообщений.
+    Возвращает пути созданных архивов.
+    """
+    today = today or datetime.date.today()
+    current_month = today.replace(day=1)
+    archived = []
+    for table, retention_months in config.PARTITIONED_TABLES.items():
+        cutoff = _add_months(current_month, -retention_months)
+        for partition, month in await list_detached(conn, table):
+            if _add_months(month, 1) > cutoff:
+                continue
+            path = await archive_detached(conn, partition)
+            logger.info(f"Previously detached partition {partition} archived to {path}.")
+            archived.append(path)
+        for partition, month, pending in await list_partitions(conn, table):
+            if _add_months(month, 1) > cutoff:
+                continue
+            path = await archive_partition(conn, table, partition, pending)
+            logger.info(f"Partition {partition} archived to {path}.")
+            archived.append(path)
+        if table == "processed_messages":
+            deleted = await conn.execute("DELETE FROM processed_message_keys WHERE processed_at < $1::date", cutoff)
+            logger.info(f"Expired processed_message_keys removed: {deleted}.")
+    return archived
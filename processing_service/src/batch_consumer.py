@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+import aio_pika
+import asyncpg
+
+from processing_service.src import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сбои, после которых пачку стоит повторить: соединение с БД или брокером, таймауты
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, aio_pika.exceptions.AMQPError)
+
+
+class BatchConsumer:
+    """
+    Потребитель очереди, отдающий обработчику пачки сообщений: до max_batch
+    доставок или все, что пришло за max_wait_ms после первой. Размер пачки ограничен
+    prefetch канала, поэтому prefetch должен быть не меньше max_batch.
+
+    Исход каждой доставки — как у message.process(): обработчик сам разбирает и проверяет
+    каждое сообщение и возвращает отклоненные — словарь {сообщение: requeue}; остальные
+    подтверждаются. Если обработчик упал целиком, пачка возвращается в очередь при сбое
+    соединения с БД или брокером (TRANSIENT_ERRORS) и отклоняется без повторной
+    постановки при прочих ошибках.
+    """
+
+    def __init__(self, handler, max_batch: int, max_wait_ms: int, queue_name: str = ""):
+        self._handler = handler # async (list[aio_pika.IncomingMessage]) -> {сообщение: requeue} отклоненных или None
+        self._in_flight = metrics.CONSUMER_IN_FLIGHT.labels(queue_name)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = asyncio.Queue()
+        self._task = None
+
+    async def start(self, queue: aio_pika.abc.AbstractQueue):
+        self._task = asyncio.create_task(self._run())
+        await queue.consume(self._on_message)
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        self._in_flight.inc()
+        await self._pending.put(message)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if self._pending.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self._pending.get_nowait())
+
+            try:
+                rejected = await self._handler(batch) or {}
+            except Exception as e:
+                requeue = isinstance(e, TRANSIENT_ERRORS)
+                logger.error(f"Batch of {len(batch)} messages failed ({'requeued' if requeue else 'rejected'}): {e}")
+                rejected = {message: requeue for message in batch}
+            try:
+                await asyncio.gather(
+                    *(message.reject(requeue=rejected[message]) if message in rejected else message.ack() for message in batch),
+                    return_exceptions=True
+                )
+            finally:
+                self._in_flight.dec(len(batch))
@@ -11,6 +11,16 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASSWORD", "guest")
 
+# Postgres LISTEN/NOTIFY channel for config cache invalidation
+PG_CONFIG_CHANNEL = "config_changed"
+# Safety-net full refresh of the config cache (seconds), in case a NOTIFY was missed
+CONFIG_CACHE_REFRESH_SECONDS = 300
+
+# Transactional outbox: events are written to the outbox table in the same transaction as the DB row
+PG_OUTBOX_CHANNEL = "outbox_added" # NOTIFY после вставки в outbox
+OUTBOX_BATCH_SIZE = 100 # Сколько строк outbox публикуется одной пачкой (подтверждения брокера ждем конвейером)
+OUTBOX_POLL_SECONDS = 1 # Страховочный опрос outbox на случай пропущенного NOTIFY
+
 # Redis settings
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 
@@ -27,5 +37,25 @@ Q_SEND_DM = "send_dm"
 Q_DM_RESPONSE = "dm_response"
 Q_OWNER_CONFIRMED = "owner_confirmed"
 
+# Batch consumer for new_ad_found
+NEW_AD_BATCH_MAX_SIZE = int(os.getenv("NEW_AD_BATCH_MAX_SIZE", "100")) # Сколько доставок обрабатывается одной пачкой
+NEW_AD_BATCH_MAX_WAIT_MS = 50 # Сколько ждать добора пачки после первой доставки
+NEW_AD_PREFETCH_COUNT = int(os.getenv("NEW_AD_PREFETCH_COUNT", "200")) # Должен быть не меньше NEW_AD_BATCH_MAX_SIZE
+
+# Statistical owner/agent classifier for replies the rules leave as 'pending' (see train_classifier.py)
+# Пусто — модель выключена. Включать, только если на bench_dialog и в отчете train_classifier
+# "правила + модель" не хуже одних правил: ложный собственник — это лид и уведомление администратору
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "") # Например /app/models/owner_agent.npz; нет файла — работают только правила
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.9"))
+
+# Prometheus metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100")) # HTTP /metrics
+
+# Lead tracing (see tracing.py)
+TRACE_SERVICE_NAME = "processing_service"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "") # JSONL-файл завершенных трасс; пусто — не писать
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "") # Например http://otel-collector:4318/v1/traces; пусто — не отправлять
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000")) # Трассы сверх очереди выгрузки отбрасываются
+
 # Keywords for filtering
 DEFAULT_KEYWORDS = ["продажа", "квартира", "цена", "м2", "собственник"]
@@ -1,5 +1,5 @@
 import asyncpg
-from processing_service.src import config
+from processing_service.src import config, metrics
 
 _pool = None
 
@@ -12,42 +12,95 @@ async def get_db_pool():
             password=config.DB_PASS,
             host=config.DB_HOST
         )
+        metrics.track_pool(_pool)
     return _pool
 
-async def update_contacted_user_status(user_id: int, status: str, response_text: str = None):
+async def create_listener_connection():
+    """Отдельное (не из пула) соединение для LISTEN: оно живет все время работы сервиса."""
+    return await asyncpg.connect(
+        database=config.DB_NAME,
+        user=config.DB_USER,
+        password=config.DB_PASS,
+        host=config.DB_HOST
+    )
+
+@metrics.db_timed
+async def update_contacted_user_status(user_id: int, status: str):
+    """Обновляет только статус: история диалога пишется userbot_core в dialog_messages."""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Обновляем статус и добавляем ответ в историю диалога
-        if response_text:
-            await conn.execute("""
-                UPDATE contacted_users
-                SET status = $1,
-                    last_contact_at = CURRENT_TIMESTAMP,
-                    dialog_history = dialog_history || jsonb_build_object('timestamp', NOW(), 'sender', 'user', 'text', $2)
-                WHERE telegram_id = $3
-            """, status, response_text, user_id)
-        else:
-            await conn.execute("""
-                UPDATE contacted_users
-                SET status = $1,
-                    last_contact_at = CURRENT_TIMESTAMP
-                WHERE telegram_id = $2
-            """, status, user_id)
+        await conn.execute("""
+            UPDATE contacted_users
+            SET status = $1,
+                last_contact_at = CURRENT_TIMESTAMP
+            WHERE telegram_id = $2
+        """, status, user_id)
 
-async def get_contacted_user_info(user_id: int):
+@metrics.db_timed
+async def get_contacted_user_statuses(user_ids: list) -> dict:
+    """Статусы сразу для нескольких пользователей: telegram_id -> status (кто не найден — отсутствует)."""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        return await conn.fetchrow("SELECT id, telegram_id, username FROM contacted_users WHERE telegram_id = $1", user_id)
+        rows = await conn.fetch("SELECT telegram_id, status FROM contacted_users WHERE telegram_id = ANY($1::bigint[])", user_ids)
+        return {row['telegram_id']: row['status'] for row in rows}
 
-async def get_processed_message_info(processed_message_db_id: int):
+@metrics.db_timed
+async def get_active_channels():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        return await conn.fetchrow("SELECT message_text, original_link FROM processed_messages WHERE id = $1", processed_message_db_id)
+        return await conn.fetch("SELECT telegram_id, name, keywords FROM channels WHERE is_active = TRUE")
 
-async def add_owner_lead(contacted_user_id: int, original_message_id: int, owner_response_text: str):
+@metrics.db_timed
+async def get_settings():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO owner_leads (contacted_user_id, original_message_id, owner_response_text)
-            VALUES ($1, $2, $3)
-        """, contacted_user_id, original_message_id, owner_response_text)
+        return await conn.fetch("SELECT key, value FROM settings")
+
+@metrics.db_timed
+async def confirm_owner(user_id: int, username: str, response_text: str, trace: str = None):
+    """
+    Подтверждение собственника одним запросом на одном соединении: обновляет статус
+    сохраняет лид и в той же транзакции ставит уведомление
+    owner_confirmed в outbox. Возвращает ссылку на исходное объявление и id лида.
+    Возвращает None, если пользователь не найден; поля объявления и lead_id равны NULL,
+    если исходное объявление не найдено (лид и уведомление в этом случае не создаются).
+    trace — контекст трассировки (JSON), с которым уйдет уведомление.
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchrow("""
+            WITH contacted AS (
+                UPDATE contacted_users
+                SET status = 'owner',
+                    last_contact_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = $1
+                RETURNING id, first_contact_message_id
+            ), ad AS (
+                SELECT pm.id, pm.original_link
+                FROM processed_messages pm
+                JOIN contacted ON pm.id = contacted.first_contact_message_id
+            ), lead AS (
+                INSERT INTO owner_leads (contacted_user_id, original_message_id, owner_response_text)
+                SELECT contacted.id, ad.id, $2 FROM contacted JOIN ad ON TRUE
+                RETURNING id
+            ), outboxed AS (
+                -- Текст объявления не передаем: Admin Bot прочитает его по processed_message_db_id, если нет ссылки
+                INSERT INTO outbox (routing_key, payload, trace)
+                SELECT $4::text, jsonb_build_object(
+                    'user_id', $1::bigint,
+                    'username', $3::text,
+                    'response_text', $2::text,
+                    'processed_message_db_id', ad.id,
+                    'original_link', ad.original_link,
+                    'timestamp', NOW()
+                ), $5::jsonb
+                FROM ad JOIN lead ON TRUE
+            )
+            SELECT contacted.id AS contacted_user_id,
+                   contacted.first_contact_message_id AS processed_message_db_id,
+                   ad.original_link,
+                   lead.id AS lead_id
+            FROM contacted
+            LEFT JOIN ad ON TRUE
+            LEFT JOIN lead ON TRUE
+        """, user_id, response_text, username, config.Q_OWNER_CONFIRMED, trace)
@@ -1,38 +1,127 @@
 import re
 
+# Признаки в ответе: кортеж основ подряд идущих слов одной фразы.
+# Основа длиннее 3 букв совпадает со словом по префиксу (собственн -> собственником),
+# короткая — только целиком, иначе "я" или "мой" находились бы внутри других слов.
+OWNER_TERMS = [
+    ("собственн",), # собственник, собственница
+    ("хозя",), # хозяин, хозяйка
+    ("владел",), # владелец, владелица
+    ("прям", "продаж"),
+    ("продаю", "сам"),
+    ("сам", "продаю"),
+    ("моя",),
+    ("мое",),
+    ("мой",),
+]
+AGENT_TERMS = [
+    ("агент",), # агент, агентство, сотрудник агентства
+    ("риелтор",),
+    ("риэлтор",),
+    ("посредник",),
+    ("брокер",),
+    ("комисси",),
+    ("помог", "прода"), # помогу продать
+]
+NEGATORS = frozenset({"не", "ни", "нет"})
+ABSENCE_MARKERS = frozenset({"без"}) # "без посредников", "без комиссии" — признак собственника
+NEGATION_WINDOW = 2 # Сколько слов перед признаком просматривается в поисках отрицания
+
+_WORD = "0-9a-zа-я"
+_PHRASE_GAP = r"[^\S\n]+" # Слова фразы разделены только пробелами, не знаками препинания
+_CLAUSE_BREAK_RE = re.compile(r"[.,;:!?()\n—–-]")
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def _stem_pattern(stem: str) -> str:
+    # Основа длиннее 3 букв совпадает с началом слова, короткая — только со словом целиком
+    if len(stem) <= 3:
+        return f"{re.escape(stem)}(?![{_WORD}])"
+    return f"{re.escape(stem)}[{_WORD}]*"
+
+
+class ResponseClassifier:
+    """
+    Правила определения собственника/агента, собранные один раз в одно регулярное
+    выражение: все признаки находятся за один проход по тексту, без токенизации
+    каждого ответа в Python. Для найденного признака отрицание ("не", "ни", "нет")
+    ищется среди NEGATION_WINDOW слов перед ним в пределах той же части фразы
+    (окно не переходит через знаки препинания: "Нет, я собственник" — собственник).
+    Отрицание признака собственника голосует за агента; отрицание признака агента
+    ("не агент") само по себе ничего не решает; "без" перед признаком агента
+    ("без посредников") голосует за собственника. Побеждает сторона с большим числом голосов.
+    """
+
+    def __init__(self, owner_terms=OWNER_TERMS, agent_terms=AGENT_TERMS, negators=NEGATORS,
+                 absence_markers=ABSENCE_MARKERS, negation_window=NEGATION_WINDOW):
+        self.negators = negators
+        self.absence_markers = absence_markers
+        self.negation_window = negation_window
+        self._labels = {} # имя группы -> 'owner'/'agent'
+        alternatives = []
+        for label, terms in (("owner", owner_terms), ("agent", agent_terms)):
+            for stems in terms:
+                group = f"t{len(self._labels)}"
+                self._labels[group] = label
+                alternatives.append(f"(?P<{group}>{_PHRASE_GAP.join(_stem_pattern(stem) for stem in stems)})")
+        self._terms_re = re.compile(f"(?<![{_WORD}])(?:{'|'.join(alternatives)})")
+        self._words_re = re.compile(f"[{_WORD}]+")
+        # Окно отрицания: хвост текста перед признаком длиной не больше стольких символов
+        self._window_chars = 32 * negation_window
+
+    def _window(self, text: str, start: int) -> list:
+        prefix = text[max(0, start - self._window_chars):start]
+        clause_break = None
+        for clause_break in _CLAUSE_BREAK_RE.finditer(prefix):
+            pass
+        if clause_break is not None:
+            prefix = prefix[clause_break.end():]
+        return self._words_re.findall(prefix)[-self.negation_window:]
+
+    def votes(self, text: str) -> tuple:
+        """Возвращает (голоса за собственника, голоса за агента)."""
+        owner = agent = 0
+        text = normalize(text)
+        for match in self._terms_re.finditer(text):
+            label = self._labels[match.lastgroup]
+            window = self._window(text, match.start())
+            if label == "agent" and not self.absence_markers.isdisjoint(window):
+                owner += 1
+            elif not self.negators.isdisjoint(window):
+                if label == "owner":
+                    agent += 1
+            elif label == "owner":
+                owner += 1
+            else:
+                agent += 1
+        return owner, agent
+
+    def classify(self, text: str) -> str:
+        owner, agent = self.votes(text)
+        if owner > agent:
+            return "owner"
+        if agent > owner:
+            return "agent"
+        return "pending"
+
+    def classify_batch(self, texts: list) -> list:
+        classify = self.classify
+        return [classify(text) for text in texts]
+
+
+_classifier = ResponseClassifier()
+
+
+def classify_batch(texts: list) -> list:
+    return _classifier.classify_batch(texts)
+
+
 def parse_owner_agent_response(text: str) -> str:
     """
     Парсит ответ пользователя, чтобы определить, собственник он или агент.
     Возвращает 'owner', 'agent' или 'pending' (если не ясно).
     """
-    text_lower = text.lower()
-
-    owner_keywords = ["собственник", "хозяин", "я", "моя", "моё", "прямая продажа", "без посредников", "без агентов"]
-    agent_keywords = ["агент", "риелтор", "посредник", "брокер", "сотрудник агентства", "помогу продать", "комиссия"]
-
-    # Проверка на прямое подтверждение собственника
-    for keyword in owner_keywords:
-        if keyword in text_lower:
-            # Избегаем ложных срабатываний, если рядом есть "не" или "нет"
-            if re.search(rf"(?<!не\s)(?<!нет\s)\b{keyword}\b", text_lower):
-                return "owner"
-    
-    # Проверка на прямое подтверждение агента
-    for keyword in agent_keywords:
-        if keyword in text_lower:
-            return "agent"
-
-    # Если есть "нет" или "не", но нет прямого подтверждения
-    if "нет" in text_lower or "не" in text_lower:
-        if "не собственник" in text_lower or "я не хозяин" in text_lower:
-            return "agent" # Или 'not_owner', но пока схлопнем в agent
-        if "не агент" in text_lower:
-            # Если "не агент", но нет "собственник", то это "pending" или "owner"
-            # Для простоты пока в 'pending'
-            return "pending"
-    
-    # Если ответ слишком короткий или не содержит ключевых слов
-    if len(text) < 5 or "что" in text_lower or "кто" in text_lower:
-        return "pending" # Возможно, уточняющий вопрос или спам
-
-    return "pending"
+    return _classifier.classify(text or "")
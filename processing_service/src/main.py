@@ -1,22 +1,46 @@
 import asyncio
 import logging
-import json
-import datetime
+import os
 
 import aio_pika
 
-from processing_service.src import config, db
+from processing_service.src import config, db, envelope, metrics, tracing
+from processing_service.src.batch_consumer import BatchConsumer
+from processing_service.src.config_cache import ConfigCache
 from processing_service.src.dialog_manager import parse_owner_agent_response
+from processing_service.src.ml_classifier import OwnerAgentModel, resolve_pending
+from processing_service.src.outbox import OutboxRelay
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 rabbit_connection = None
 rabbit_channel = None
+new_ad_channel = None
+new_ad_consumer = None
+config_cache = None
+outbox_relay = None
+owner_agent_model = None
 
 async def init_services():
-    global rabbit_connection, rabbit_channel
+    global rabbit_connection, rabbit_channel, new_ad_channel, new_ad_consumer, config_cache, outbox_relay, owner_agent_model
+    metrics.start_server()
+    tracing.start()
     await db.get_db_pool() # Инициализируем пул БД
+
+    if not config.CLASSIFIER_MODEL_PATH:
+        logger.info("Classifier model is disabled. Using rules only.")
+    elif os.path.exists(config.CLASSIFIER_MODEL_PATH):
+        try:
+            owner_agent_model = OwnerAgentModel.load(config.CLASSIFIER_MODEL_PATH)
+            logger.info(f"Owner/agent classifier {owner_agent_model.version} loaded from {config.CLASSIFIER_MODEL_PATH}.")
+        except ValueError as e:
+            logger.warning(f"Classifier model {config.CLASSIFIER_MODEL_PATH} cannot be used ({e}), retrain it. Using rules only.")
+    else:
+        logger.warning(f"Classifier model {config.CLASSIFIER_MODEL_PATH} not found. Using rules only.")
+
+    config_cache = ConfigCache()
+    await config_cache.start()
     
     rabbit_connection = await aio_pika.connect_robust(
         f"amqp://{config.RABBITMQ_USER}:{config.RABBITMQ_PASS}@{config.RABBITMQ_HOST}/"
@@ -25,57 +49,109 @@ async def init_services():
     
     # Объявляем очереди
     await rabbit_channel.declare_queue(config.Q_NEW_AD, durable=True)
-    await rabbit_channel.declare_queue(config.Q_DM_RESPONSE, durable=True)
+    dm_response_queue = await rabbit_channel.declare_queue(config.Q_DM_RESPONSE, durable=True)
     await rabbit_channel.declare_queue(config.Q_OWNER_CONFIRMED, durable=True)
     await rabbit_channel.declare_queue(config.Q_SEND_DM, durable=True) # На случай, если нужно будет отправлять DM отсюда
 
-    # Запускаем consumer-ы
-    await rabbit_channel.consume(config.Q_NEW_AD, on_new_ad_found)
-    await rabbit_channel.consume(config.Q_DM_RESPONSE, on_dm_response)
+    outbox_relay = OutboxRelay(rabbit_connection)
+    await outbox_relay.start()
+
+    # Запускаем consumer-ы. new_ad_found читается пачками на отдельном канале со своим prefetch
+    new_ad_channel = await rabbit_connection.channel()
+    await new_ad_channel.set_qos(prefetch_count=config.NEW_AD_PREFETCH_COUNT)
+    new_ad_queue = await new_ad_channel.declare_queue(config.Q_NEW_AD, durable=True)
+    new_ad_consumer = BatchConsumer(on_new_ads_found, config.NEW_AD_BATCH_MAX_SIZE, config.NEW_AD_BATCH_MAX_WAIT_MS, config.Q_NEW_AD)
+    await new_ad_consumer.start(new_ad_queue)
+    await dm_response_queue.consume(on_dm_response)
 
-async def on_new_ad_found(message: aio_pika.IncomingMessage):
+async def on_new_ads_found(messages: list) -> dict:
     """
-    Обрабатывает событие о новом найденном объявлении.
-    Инициирует отправку DM, если пользователь ранее не был опрошен.
+    Обрабатывает пачку событий о новых найденных объявлениях.
+    Инициирует отправку DM пользователям, которые ранее не были опрошены:
+    статусы всех авторов пачки получаем одним запросом, повторяющихся в пачке авторов
+    отбрасываем, запросы на DM публикуем пачкой.
+    Возвращает отклоненные доставки {сообщение: requeue} (см. BatchConsumer):
+    нечитаемое событие отклоняется одно, запрос на DM, который не удалось опубликовать,
+    возвращается в очередь; остальные доставки пачки подтверждаются.
     """
-    async with message.process():
-        data = json.loads(message.body.decode())
-        user_id = data['author_id']
-        username = data['author_username']
-        processed_message_db_id = data['processed_message_db_id']
-        original_link = data['original_link']
-        
-        if not user_id: # Если не удалось получить ID автора, пропускаем
+    rejected = {}
+    ads = []
+    finished_traces = [] # (трасса, исход) объявлений, для которых DM не будет
+    for message in messages:
+        try:
+            data = envelope.unpack(message)
+            processed_message_db_id = data['processed_message_db_id']
+        except Exception as e:
+            logger.error(f"Rejecting malformed {config.Q_NEW_AD} message {message.message_id}: {e!r}")
+            metrics.NEW_ADS.labels("malformed").inc()
+            rejected[message] = False
+            continue
+        trace = tracing.from_message(message)
+        if trace:
+            trace.stamp(f"{config.Q_NEW_AD}.consumed")
+        if not data.get('author_id'): # Если не удалось получить ID автора, пропускаем
             logger.warning(f"Skipping ad {processed_message_db_id}: no author ID found.")
-            return
-
-        # Проверяем статус пользователя в БД
-        contact_status = await db.get_contacted_user_status(user_id)
+            metrics.NEW_ADS.labels("no_author").inc()
+            finished_traces.append((trace, "no_author"))
+            continue
+        ads.append((message, data, trace))
+    if not ads:
+        for trace, outcome in finished_traces:
+            tracing.export(trace, outcome)
+        return rejected
+
+    # Проверяем статусы пользователей в БД одним запросом
+    contact_statuses = await db.get_contacted_user_statuses(list({data['author_id'] for _, data, _ in ads}))
+
+    # Получаем актуальное приветственное сообщение (из кэша, обновляется по NOTIFY)
+    welcome_message = config_cache.get_welcome_message()
+
+    requested_users = set()
+    publishes = [] # (доставка, публикация запроса на DM)
+    for message, data, trace in ads:
+        user_id = data['author_id']
+        if user_id in requested_users:
+            logger.info(f"User {user_id} already has a DM request in this batch. Skipping ad {data['processed_message_db_id']}.")
+            metrics.NEW_ADS.labels("duplicate_in_batch").inc()
+            finished_traces.append((trace, "duplicate_in_batch"))
+            continue
 
+        contact_status = contact_statuses.get(user_id)
         if contact_status in ['owner', 'agent', 'blacklisted']:
             logger.info(f"User {user_id} already has status '{contact_status}'. Skipping DM initiation.")
-            return
-        
+            metrics.NEW_ADS.labels("known_user").inc()
+            finished_traces.append((trace, "known_user"))
+            continue
+
+        requested_users.add(user_id)
+        metrics.NEW_ADS.labels("dm_requested").inc()
         logger.info(f"New ad from user {user_id}. Initiating DM request.")
-        
-        # Получаем актуальное приветственное сообщение
-        welcome_message = await db.get_welcome_message_from_settings()
-
-        # Публикуем запрос на отправку DM
-        await rabbit_channel.default_exchange.publish(
-            aio_pika.Message(
-                body=json.dumps({
-                    "user_id": user_id,
-                    "username": username,
-                    "welcome_message": welcome_message,
-                    "processed_message_db_id": processed_message_db_id,
-                    "original_link": original_link
-                }).encode(),
-                content_type='application/json'
-            ),
-            routing_key=config.Q_SEND_DM
-        )
-        logger.info(f"DM request for user {user_id} published.")
+        if trace:
+            trace.stamp(f"{config.Q_SEND_DM}.published")
+        publishes.append((message, metrics.publish(
+            rabbit_channel.default_exchange,
+            envelope.make_message(config.Q_SEND_DM, {
+                "user_id": user_id,
+                "username": data.get('author_username'),
+                "welcome_message": welcome_message,
+                "processed_message_db_id": data['processed_message_db_id'],
+                "original_link": data.get('original_link')
+            }, headers=tracing.headers(trace)),
+            config.Q_SEND_DM
+        )))
+
+    # Публикуем запросы на отправку DM пачкой (подтверждения брокера ждем параллельно);
+    # объявление, чей запрос не опубликован, вернется в очередь — остальные не повторяются
+    results = await asyncio.gather(*(publish for _, publish in publishes), return_exceptions=True)
+    for (message, _), result in zip(publishes, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to publish DM request for {config.Q_NEW_AD} message {message.message_id}, requeueing: {result!r}")
+            rejected[message] = True
+    for trace, outcome in finished_traces:
+        tracing.export(trace, outcome)
+    published = sum(not isinstance(result, Exception) for result in results)
+    logger.info(f"{published} DM requests published from a batch of {len(messages)} ads.")
+    return rejected
 
 
 async def on_dm_response(message: aio_pika.IncomingMessage):
@@ -83,54 +159,54 @@ async def on_dm_response(message: aio_pika.IncomingMessage):
     Обрабатывает ответы от пользователей на DM.
     Определяет статус (собственник/агент) и сохраняет результат.
     """
-    async with message.process():
-        data = json.loads(message.body.decode())
-        user_id = data['user_id']
-        username = data['username']
-        response_text = data['response_text']
-
-        logger.info(f"Processing DM response from {user_id}: '{response_text}'")
-
-        status = parse_owner_agent_response(response_text)
-        await db.update_contacted_user_status(user_id, status, response_text)
-
-        if status == 'owner':
-            user_info = await db.get_contacted_user_info(user_id)
-            if user_info:
-                # Получаем processed_message_db_id из contacted_users
-                processed_message_db_id = user_info['first_contact_message_id'] 
-                original_ad_info = await db.get_processed_message_info(processed_message_db_id)
-
-                if original_ad_info:
-                    await db.add_owner_lead(user_info['id'], processed_message_db_id, response_text)
-                    logger.info(f"User {user_id} confirmed as owner! Lead saved.")
-
-                    # Уведомляем Admin Bot
-                    await rabbit_channel.default_exchange.publish(
-                        aio_pika.Message(
-                            body=json.dumps({
-                                "user_id": user_id,
-                                "username": username,
-                                "response_text": response_text,
-                                "ad_text": original_ad_info['message_text'],
-                                "original_link": original_ad_info['original_link'],
-                                "timestamp": datetime.datetime.now().isoformat()
-                            }).encode(),
-                            content_type='application/json'
-                        ),
-                        routing_key=config.Q_OWNER_CONFIRMED
-                    )
-                    logger.info(f"Owner confirmed notification for {user_id} published.")
+    with metrics.CONSUMER_IN_FLIGHT.labels(config.Q_DM_RESPONSE).track_inprogress():
+        async with message.process():
+            data = envelope.unpack(message)
+            user_id = data['user_id']
+            username = data['username']
+            response_text = data['response_text']
+            trace = tracing.from_message(message)
+            if trace:
+                trace.stamp(f"{config.Q_DM_RESPONSE}.consumed")
+
+            logger.info(f"Processing DM response from {user_id}: '{response_text}'")
+
+            status = parse_owner_agent_response(response_text)
+            source = "rules"
+            if status == 'pending' and owner_agent_model is not None:
+                # Правила не решили — пробуем статистическую модель
+                [(status, confidence)] = resolve_pending(owner_agent_model, [response_text or ''], [status], config.CLASSIFIER_MIN_CONFIDENCE)
+                if confidence is not None:
+                    source = "model"
+                    logger.info(f"Classifier resolved reply from {user_id} as '{status}' (confidence {confidence:.2f}).")
+            metrics.DM_RESPONSES.labels(status, source).inc()
+            if trace:
+                trace.stamp("classified")
+
+            if status == 'owner':
+                # Статус, лид и уведомление для Admin Bot (через outbox) — одним запросом в одной транзакции
+                # Трасса продолжится в Admin Bot: уведомление уходит с ней через outbox
+                confirmation = await db.confirm_owner(user_id, username, response_text, tracing.to_json(trace))
+                if confirmation is None:
+                    logger.error(f"Could not retrieve contacted user info for user_id {user_id} after owner confirmation.")
+                    tracing.export(trace, "owner_unresolved")
+                elif confirmation['lead_id'] is None:
+                    logger.error(f"Could not retrieve original ad info for processed_message_db_id {confirmation['processed_message_db_id']} for user {user_id}")
+                    tracing.export(trace, "owner_unresolved")
                 else:
-                    logger.error(f"Could not retrieve original ad info for processed_message_db_id {processed_message_db_id} for user {user_id}")
-            else:
-                logger.error(f"Could not retrieve contacted user info for user_id {user_id} after owner confirmation.")
-        elif status == 'agent':
-            logger.info(f"User {user_id} identified as agent. Dialogue stopped.")
-        else: # pending
-            logger.info(f"User {user_id} response unclear. Status remains 'pending'.")
-            # Можно добавить логику для отправки повторных вопросов
-            pass
+                    # Уведомление owner_confirmed публикует OutboxRelay
+                    logger.info(f"User {user_id} confirmed as owner! Lead saved, admin notification queued via outbox.")
+                return
+
+            await db.update_contacted_user_status(user_id, status)
+            tracing.export(trace, status)
+
+            if status == 'agent':
+                logger.info(f"User {user_id} identified as agent. Dialogue stopped.")
+            else: # pending
+                logger.info(f"User {user_id} response unclear. Status remains 'pending'.")
+                # Можно добавить логику для отправки повторных вопросов
+                pass
 
 async def main():
     await init_services()
@@ -138,8 +214,15 @@ async def main():
     try:
         await asyncio.Future() # Runs forever
     finally:
+        if new_ad_consumer:
+            await new_ad_consumer.close()
+        if outbox_relay:
+            await outbox_relay.close()
+        if config_cache:
+            await config_cache.close()
         if rabbit_connection:
             await rabbit_connection.close()
+        await tracing.close()
         pool = await db.get_db_pool()
         if pool:
             await pool.close()
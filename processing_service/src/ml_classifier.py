@@ -0,0 +1,148 @@
+import datetime
+import logging
+import zlib
+
+import numpy as np
+
+from processing_service.src.dialog_manager import normalize
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2 # Версия формата артефакта .npz; модель другой версии не загружается (1 — без класса 'pending')
+DEFAULT_FEATURE_DIM = 2 ** 18
+DEFAULT_NGRAM_RANGE = (2, 4)
+
+
+def char_ngrams(text: str, ngram_range: tuple) -> set:
+    """Символьные n-граммы нормализованного текста, дополненного пробелами по краям."""
+    padded = f" {' '.join(normalize(text).split())} "
+    low, high = ngram_range
+    return {padded[i:i + n] for n in range(low, high + 1) for i in range(len(padded) - n + 1)}
+
+
+def featurize(texts: list, dim: int, ngram_range: tuple) -> tuple:
+    """
+    Hashing trick: разреженная матрица признаков в виде (rows, cols, values).
+    Каждая n-грамма дает признак crc32(n-грамма) % dim; строка нормируется на единичную длину.
+    """
+    rows, cols, values = [], [], []
+    for row, text in enumerate(texts):
+        indices = {zlib.crc32(gram.encode()) % dim for gram in char_ngrams(text, ngram_range)}
+        if not indices:
+            continue
+        rows.extend([row] * len(indices))
+        cols.extend(indices)
+        values.extend([1 / len(indices) ** 0.5] * len(indices))
+    return (
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(cols, dtype=np.int64),
+        np.asarray(values, dtype=np.float32),
+    )
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class OwnerAgentModel:
+    """
+    Мультиномиальная логистическая регрессия на хешированных символьных n-граммах с тремя
+    классами: собственник, агент и 'pending' — ответ, по которому статус не определить.
+    Без третьего класса модель обязана выбрать сторону и уверенно относит неясные ответы
+    к собственникам или агентам; с ним она воздерживается там же, где воздержался бы
+    человек. predict_proba возвращает вероятности классов CLASSES; скоринг пачки
+    векторизован (одно суммирование весов по всем n-граммам пачки на класс).
+    """
+
+    CLASSES = ("owner", "agent", "pending")
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, ngram_range: tuple = DEFAULT_NGRAM_RANGE, version: str = ""):
+        self.weights = weights.astype(np.float32) # (dim, len(CLASSES))
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.dim = len(weights)
+        self.ngram_range = tuple(ngram_range)
+        self.version = version
+
+    @classmethod
+    def train(cls, texts: list, labels: list, dim: int = DEFAULT_FEATURE_DIM, ngram_range: tuple = DEFAULT_NGRAM_RANGE,
+              epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-4) -> "OwnerAgentModel":
+        """Полнопакетный градиентный спуск с AdaGrad. labels: 'owner', 'agent' или 'pending'."""
+        rows, cols, values = featurize(texts, dim, ngram_range)
+        n, k = len(texts), len(cls.CLASSES)
+        y = np.zeros((n, k), dtype=np.float32)
+        y[np.arange(n), [cls.CLASSES.index(label) for label in labels]] = 1
+        weights = np.zeros((dim, k), dtype=np.float32)
+        bias = np.zeros(k)
+        grad_sq = np.full((dim, k), 1e-8, dtype=np.float32)
+        bias_grad_sq = np.full(k, 1e-8)
+        for _ in range(epochs):
+            error = (_softmax(cls._scores(weights, bias, rows, cols, values, n)) - y) / n
+            grad = np.stack([
+                np.bincount(cols, weights=values * error[rows, c], minlength=dim) for c in range(k)
+            ], axis=1).astype(np.float32) + l2 * weights
+            grad_sq += grad * grad
+            weights -= learning_rate * grad / np.sqrt(grad_sq)
+            bias_grad = error.sum(axis=0)
+            bias_grad_sq += bias_grad * bias_grad
+            bias -= learning_rate * bias_grad / np.sqrt(bias_grad_sq)
+        version = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
+        return cls(weights, bias, ngram_range, version)
+
+    @staticmethod
+    def _scores(weights, bias, rows, cols, values, n) -> np.ndarray:
+        return np.stack([
+            np.bincount(rows, weights=weights[cols, c] * values, minlength=n) for c in range(weights.shape[1])
+        ], axis=1) + bias
+
+    @classmethod
+    def load(cls, path: str) -> "OwnerAgentModel":
+        with np.load(path) as artifact:
+            format_version = int(artifact["format_version"])
+            if format_version != FORMAT_VERSION:
+                raise ValueError(f"Unsupported classifier artifact format {format_version} (expected {FORMAT_VERSION})")
+            return cls(
+                artifact["weights"],
+                artifact["bias"],
+                tuple(int(n) for n in artifact["ngram_range"]),
+                str(artifact["version"]),
+            )
+
+    def save(self, path: str):
+        # Нулевые веса (n-граммы, не встречавшиеся в обучении) хорошо сжимаются
+        np.savez_compressed(
+            path,
+            format_version=FORMAT_VERSION,
+            weights=self.weights,
+            bias=self.bias,
+            ngram_range=np.asarray(self.ngram_range),
+            version=self.version,
+        )
+
+    def predict_proba(self, texts: list) -> np.ndarray:
+        """Матрица (len(texts), len(CLASSES)) вероятностей классов."""
+        rows, cols, values = featurize(texts, self.dim, self.ngram_range)
+        return _softmax(self._scores(self.weights, self.bias, rows, cols, values, len(texts)))
+
+    def classify_batch(self, texts: list) -> list:
+        """Список (метка из CLASSES, ее вероятность) для каждого текста."""
+        probabilities = self.predict_proba(texts)
+        return [(self.CLASSES[int(p.argmax())], float(p.max())) for p in probabilities]
+
+
+def resolve_pending(model: OwnerAgentModel, texts: list, statuses: list, min_confidence: float) -> list:
+    """
+    Дополняет решения правил dialog_manager: ответы со статусом 'pending' получают метку
+    модели, если модель не отнесла их к 'pending' и уверенность не ниже min_confidence.
+    Возвращает список (статус, уверенность); для решений правил и оставшихся 'pending'
+    уверенность — None.
+    """
+    pending = [i for i, status in enumerate(statuses) if status == "pending"]
+    resolved = [(status, None) for status in statuses]
+    if model is None or not pending:
+        return resolved
+    for i, (label, confidence) in zip(pending, model.classify_batch([texts[i] for i in pending])):
+        if label != "pending" and confidence >= min_confidence:
+            resolved[i] = (label, confidence)
+    return resolved
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+
+import aio_pika
+
+from processing_service.src import config, db, envelope, metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """
+    Публикует события из таблицы outbox в RabbitMQ. Строки outbox пишутся в одной
+    транзакции с изменением данных, поэтому падение сервиса между записью в БД и
+    публикацией не теряет событие: его опубликует этот или любой другой relay.
+
+    Пачка строк забирается FOR UPDATE SKIP LOCKED (relay-и нескольких реплик и
+    сервисов делят outbox без конфликтов), публикуется на канале с publisher confirms
+    без ожидания подтверждения каждого сообщения и удаляется, когда брокер подтвердил
+    всю пачку. Если какая-то публикация не подтверждена, транзакция откатывается и
+    пачка уходит повторно: доставка at-least-once, message_id сообщения — id строки outbox.
+    Контекст трассировки строки (колонка trace) публикуется в заголовке x-trace.
+    Relay просыпается по NOTIFY на вставку в outbox и раз в OUTBOX_POLL_SECONDS.
+    """
+
+    def __init__(self, rabbit_connection: aio_pika.abc.AbstractConnection):
+        self._rabbit_connection = rabbit_connection
+        self._channel = None
+        self._wakeup = asyncio.Event()
+        self._listener_conn = None
+        self._task = None
+
+    async def start(self):
+        self._channel = await self._rabbit_connection.channel(publisher_confirms=True)
+        await self._listen()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._listener_conn and not self._listener_conn.is_closed():
+            await self._listener_conn.close()
+        if self._channel:
+            await self._channel.close()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    async def _listen(self):
+        try:
+            self._listener_conn = await db.create_listener_connection()
+            await self._listener_conn.add_listener(config.PG_OUTBOX_CHANNEL, self._on_notify)
+        except Exception as e:
+            # Без уведомлений outbox все равно разбирается периодическим опросом
+            logger.error(f"Failed to LISTEN for outbox inserts: {e}")
+            self._listener_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if self._listener_conn is None or self._listener_conn.is_closed():
+                    await self._listen()
+                while await self.relay_batch() == config.OUTBOX_BATCH_SIZE:
+                    pass # Полная пачка: в outbox, скорее всего, есть еще строки
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox relay failed: {e}")
+
+    async def _publish(self, row):
+        trace = tracing.TraceContext.from_json(row['trace'])
+        if trace:
+            trace.stamp(f"{row['routing_key']}.published")
+        await metrics.publish(
+            self._channel.default_exchange,
+            envelope.make_message(
+                row['routing_key'],
+                json.loads(row['payload']),
+                message_id=str(row['id']),
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                headers=tracing.headers(trace)
+            ),
+            row['routing_key']
+        )
+
+    async def relay_batch(self) -> int:
+        """Публикует одну пачку строк outbox и возвращает ее размер."""
+        pool = await db.get_db_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch("""
+                    SELECT id, routing_key, payload, trace FROM outbox
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                """, config.OUTBOX_BATCH_SIZE)
+                if not rows:
+                    return 0
+                await asyncio.gather(*(self._publish(row) for row in rows))
+                await conn.execute("DELETE FROM outbox WHERE id = ANY($1::bigint[])", [row['id'] for row in rows])
+        logger.info(f"Outbox relay published {len(rows)} messages.")
+        return len(rows)
@@ -0,0 +1,180 @@
+"""
+Сквозной контекст трассировки лида: пост в канале -> new_ad_found -> send_dm -> DM ->
+ответ -> dm_response -> owner_confirmed -> уведомление администратору.
+
+Контекст — id трассы и список отметок (этап, unix-время) — едет в AMQP-заголовке
+x-trace каждой публикации, в outbox (колонка trace) и между отправкой DM и ответом
+в Redis. Каждый сервис дописывает свои этапы; на последнем этапе трасса в фоне
+(TraceExporter) выгружается в JSONL-файл (TRACE_EXPORT_PATH) и/или в OTLP/HTTP-коллектор
+(TRACE_OTLP_ENDPOINT).
+Время этапов — часы хостов сервисов, поэтому им нужна синхронизация (NTP).
+"""
+import asyncio
+import json
+import logging
+import secrets
+import time
+import urllib.request
+
+from processing_service.src import config
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "x-trace"
+
+
+class TraceContext:
+    __slots__ = ("trace_id", "stages")
+
+    def __init__(self, trace_id: str, stages: list = None):
+        self.trace_id = trace_id
+        self.stages = stages or [] # [(этап, unix-время), ...] в порядке прохождения
+
+    @classmethod
+    def new(cls) -> "TraceContext":
+        return cls(secrets.token_hex(16)) # 128 бит, как trace id в OTLP
+
+    def stamp(self, stage: str, at: float = None) -> "TraceContext":
+        self.stages.append((stage, time.time() if at is None else at))
+        return self
+
+    def to_json(self) -> str:
+        return json.dumps({"id": self.trace_id, "stages": self.stages}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, value) -> "TraceContext":
+        """Контекст из заголовка, outbox или Redis; None, если трассы нет или она повреждена."""
+        if not value:
+            return None
+        try:
+            data = json.loads(value)
+            return cls(data["id"], [(stage, float(at)) for stage, at in data["stages"]])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring malformed trace context: {e}")
+            return None
+
+
+def from_message(message) -> TraceContext:
+    return TraceContext.from_json((message.headers or {}).get(TRACE_HEADER))
+
+
+def headers(trace: TraceContext) -> dict:
+    """AMQP-заголовки публикации, продолжающей трассу (пустые, если трассы нет)."""
+    return {TRACE_HEADER: trace.to_json()} if trace else {}
+
+
+def to_json(trace: TraceContext):
+    return trace.to_json() if trace else None
+
+
+def _otlp_request(trace: TraceContext, outcome: str) -> dict:
+    # Корневой спан — вся трасса, дочерние — переходы между соседними этапами
+    nanos = [int(at * 1e9) for _, at in trace.stages]
+    root_id = secrets.token_hex(8)
+    spans = [{
+        "traceId": trace.trace_id, "spanId": root_id, "name": "lead", "kind": 1,
+        "startTimeUnixNano": str(nanos[0]), "endTimeUnixNano": str(nanos[-1]),
+        "attributes": [{"key": "lead.outcome", "value": {"stringValue": outcome}}],
+    }]
+    for (stage, _), start, end in zip(trace.stages[1:], nanos, nanos[1:]):
+        spans.append({
+            "traceId": trace.trace_id, "spanId": secrets.token_hex(8), "parentSpanId": root_id,
+            "name": stage, "kind": 1, "startTimeUnixNano": str(start), "endTimeUnixNano": str(end),
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+    }]}
+
+
+def _post_otlp(body: bytes):
+    request = urllib.request.Request(config.TRACE_OTLP_ENDPOINT, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5):
+        pass
+
+
+def _write_jsonl(record: dict):
+    with open(config.TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+async def _export(trace: TraceContext, outcome: str):
+    """Выгружает завершенную трассу. Ошибки выгрузки только логируются."""
+    if config.TRACE_EXPORT_PATH:
+        record = {"trace_id": trace.trace_id, "service": config.TRACE_SERVICE_NAME, "outcome": outcome, "stages": trace.stages}
+        try:
+            await asyncio.to_thread(_write_jsonl, record)
+        except OSError as e:
+            logger.error(f"Failed to write trace {trace.trace_id} to {config.TRACE_EXPORT_PATH}: {e}")
+    if config.TRACE_OTLP_ENDPOINT:
+        body = json.dumps(_otlp_request(trace, outcome)).encode()
+        try:
+            await asyncio.to_thread(_post_otlp, body)
+        except Exception as e:
+            logger.error(f"Failed to export trace {trace.trace_id} to {config.TRACE_OTLP_ENDPOINT}: {e}")
+
+
+class TraceExporter:
+    """
+    Фоновая выгрузка трасс: submit() только кладет трассу в очередь, consumer-ы не ждут
+    ни записи в файл, ни ответа коллектора. Очередь ограничена TRACE_EXPORT_QUEUE_SIZE:
+    если выгрузка не успевает (коллектор недоступен, медленный диск), новые трассы
+    отбрасываются — трассировка не должна тормозить обработку лидов.
+    """
+
+    def __init__(self, max_size: int):
+        self._queue = asyncio.Queue(max_size)
+        self._task = None
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 5):
+        """Дает очереди выгрузиться не дольше timeout секунд, затем останавливает выгрузку."""
+        if not self._task:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._queue.qsize()} traces were not exported before shutdown.")
+        self._task.cancel()
+
+    def submit(self, trace: TraceContext, outcome: str):
+        try:
+            # Копия отметок: вызывающий может продолжать пользоваться контекстом
+            self._queue.put_nowait((TraceContext(trace.trace_id, list(trace.stages)), outcome))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped & (self.dropped - 1) == 0: # 1, 2, 4, 8... — не засоряем лог
+                logger.warning(f"Trace export queue is full, {self.dropped} traces dropped so far.")
+
+    async def _run(self):
+        while True:
+            trace, outcome = await self._queue.get()
+            try:
+                await _export(trace, outcome)
+            except Exception as e:
+                logger.error(f"Failed to export trace {trace.trace_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+_exporter = TraceExporter(config.TRACE_EXPORT_QUEUE_SIZE)
+
+
+def start():
+    """Запускает фоновую выгрузку; вызывается при старте сервиса."""
+    _exporter.start()
+
+
+async def close():
+    await _exporter.close()
+
+
+def export(trace: TraceContext, outcome: str):
+    """Отдает завершенную трассу на фоновую выгрузку и сразу возвращается."""
+    if trace is None or not trace.stages:
+        return
+    if config.TRACE_EXPORT_PATH or config.TRACE_OTLP_ENDPOINT:
+        _exporter.submit(trace, outcome)
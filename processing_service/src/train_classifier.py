@@ -0,0 +1,116 @@
+"""
+Офлайн-обучение OwnerAgentModel на размеченных ответах из БД.
+
+Метки берутся из contacted_users.status ('owner'/'agent'/'pending'), тексты — из входящих
+сообщений dialog_messages, из старой истории dialog_history и из owner_leads. Ответы
+контактов, оставшихся 'pending', учат модель воздерживаться: модель применяется как раз
+к ответам, которые не решили правила, и ложный собственник дороже нерешенного ответа.
+
+Кроме точности на отложенной выборке печатается, как модель ведет себя на ответах, не
+решенных правилами: сколько решений она принимает при CLASSIFIER_MIN_CONFIDENCE, сколько
+из них верны и не хуже ли "правила + модель", чем одни правила.
+Запуск из корня репозитория:
+    python -m processing_service.src.train_classifier --output models/owner_agent.npz [--fixture corpus.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from processing_service.src import config, db
+from processing_service.src.dialog_manager import classify_batch
+from processing_service.src.ml_classifier import OwnerAgentModel, resolve_pending
+
+
+async def load_labeled_replies() -> list:
+    pool = await db.get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT DISTINCT text, label FROM (
+                SELECT dm.message_text AS text, cu.status::text AS label
+                FROM contacted_users cu
+                JOIN dialog_messages dm ON dm.user_telegram_id = cu.telegram_id AND dm.direction = 'in'
+                WHERE cu.status IN ('owner', 'agent', 'pending')
+                UNION ALL
+                -- История до перехода на dialog_messages
+                SELECT h->>'text', cu.status::text
+                FROM contacted_users cu, jsonb_array_elements(cu.dialog_history) h
+                WHERE cu.status IN ('owner', 'agent', 'pending') AND h->>'sender' = 'user'
+                UNION ALL
+                SELECT owner_response_text, 'owner' FROM owner_leads
+            ) labeled
+            WHERE text IS NOT NULL AND text <> ''
+        """)
+    await pool.close()
+    return [(row['text'], row['label']) for row in rows]
+
+
+def load_fixture(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["text"], row["label"]) for row in rows if row["label"] in OwnerAgentModel.CLASSES]
+
+
+def accuracy(model: OwnerAgentModel, samples: list) -> float:
+    if not samples:
+        return float("nan")
+    predicted = model.classify_batch([text for text, _ in samples])
+    return sum(label == p for (_, label), (p, _) in zip(samples, predicted)) / len(samples)
+
+
+def report_pending(model: OwnerAgentModel, samples: list, min_confidence: float):
+    """Решения модели там, где она работает в сервисе, — на ответах, которые правила оставили 'pending'."""
+    texts = [text for text, _ in samples]
+    labels = [label for _, label in samples]
+    rules = classify_batch(texts)
+    hybrid = resolve_pending(model, texts, rules, min_confidence)
+    decided = [(label, status) for label, rule, (status, confidence) in zip(labels, rules, hybrid) if rule == "pending" and confidence is not None]
+    unresolved = sum(rule == "pending" for rule in rules)
+    correct = sum(label == status for label, status in decided)
+    forced = sum(label == "pending" for label, _ in decided)
+    rules_accuracy = sum(label == rule for label, rule in zip(labels, rules)) / len(samples)
+    hybrid_accuracy = sum(label == status for label, (status, _) in zip(labels, hybrid)) / len(samples)
+    print(f"rules left pending: {unresolved}, model decided {len(decided)} at confidence >= {min_confidence}: "
+          f"{correct} correct, {forced} of them truly ambiguous")
+    print(f"rules accuracy:         {rules_accuracy:.1%}")
+    print(f"rules + model accuracy: {hybrid_accuracy:.1%}")
+    if hybrid_accuracy < rules_accuracy:
+        print("WARNING: the model makes rules-only results worse; do not deploy it")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", required=True, help="Куда сохранить артефакт модели (.npz)")
+    parser.add_argument("--fixture", action="append", default=[], help="Дополнительный размеченный корпус JSONL {text, label}")
+    parser.add_argument("--no-db", action="store_true", help="Обучать только на --fixture")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Доля примеров для оценки точности")
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--min-confidence", type=float, default=config.CLASSIFIER_MIN_CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    samples = [] if args.no_db else asyncio.run(load_labeled_replies())
+    for path in args.fixture:
+        samples.extend(load_fixture(path))
+    if not samples:
+        parser.error("no labeled replies found")
+
+    random.Random(args.seed).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    train, holdout = samples[:split], samples[split:]
+
+    model = OwnerAgentModel.train([t for t, _ in train], [l for _, l in train], epochs=args.epochs)
+    print(f"samples: {len(samples)} (train {len(train)}, holdout {len(holdout)})")
+    print(f"train accuracy:   {accuracy(model, train):.1%}")
+    print(f"holdout accuracy: {accuracy(model, holdout):.1%}")
+    if holdout:
+        report_pending(model, holdout, args.min_confidence)
+
+    # Итоговая модель обучается на всех примерах
+    model = OwnerAgentModel.train([t for t, _ in samples], [l for _, l in samples], epochs=args.epochs)
+    model.save(args.output)
+    print(f"model {model.version} saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
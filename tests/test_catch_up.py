@@ -0,0 +1,110 @@
+"""
+Догон каналов (userbot_core/src/catch_up.py) на заменителях из benchmarks/fakes.py.
+
+Запуск из корня репозитория (нужны зависимости userbot_core и fakeredis):
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+import benchmarks._env # noqa: F401 — переменные окружения для config сервисов
+
+pytest.importorskip("pyrogram")
+fakeredis = pytest.importorskip("fakeredis")
+
+from benchmarks.fakes import FakeClient, FakeMessage  # noqa: E402
+from userbot_core.src import catch_up, config  # noqa: E402
+
+CHANNEL_ID = -1001
+
+
+@pytest.fixture
+def stored_checkpoints(monkeypatch):
+    """channel_checkpoints в памяти вместо БД; темп догона без пауз."""
+    stored = {}
+
+    async def get_channel_checkpoints():
+        return dict(stored)
+
+    async def save_channel_checkpoints(checkpoints):
+        for channel_id, message_id in checkpoints.items():
+            stored[channel_id] = max(stored.get(channel_id, 0), message_id)
+
+    monkeypatch.setattr(catch_up.db, "get_channel_checkpoints", get_channel_checkpoints)
+    monkeypatch.setattr(catch_up.db, "save_channel_checkpoints", save_channel_checkpoints)
+    monkeypatch.setattr(config, "CATCH_UP_MESSAGES_PER_SECOND", 10_000)
+    monkeypatch.setattr(config, "CATCH_UP_PAGE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(FakeClient, "history", {})
+    return stored
+
+
+def make_engine(checkpoints, clients, handled):
+    async def process_channel_message(client, message):
+        # Как userbot_core.main.process_channel_message: обработка, затем отметка чекпоинта
+        handled.append(message.id)
+        checkpoints.seen(message.chat.id, message.id)
+
+    return catch_up.ChannelCatchUp(
+        fakeredis.aioredis.FakeRedis(), checkpoints, clients, process_channel_message, lambda: [CHANNEL_ID], lambda: 0
+    )
+
+
+def test_live_post_before_sweep_does_not_skip_downtime_gap(stored_checkpoints):
+    async def scenario():
+        stored_checkpoints[CHANNEL_ID] = 100 # До простоя обработан пост 100
+        FakeClient.history[CHANNEL_ID] = [FakeMessage(CHANNEL_ID, f"post {i}", message_id=i) for i in range(95, 112)]
+
+        checkpoints = catch_up.ChannelCheckpoints()
+        await checkpoints.start()
+        handled = []
+        client = FakeClient("1")
+        engine = make_engine(checkpoints, {1: client}, handled)
+
+        checkpoints.hold() # start_userbot перед client.start()
+        # Живой пост успевает прийти до первого прохода догона
+        await engine._handle_post(client, FakeClient.history[CHANNEL_ID][-1])
+        await checkpoints.flush()
+        assert stored_checkpoints[CHANNEL_ID] == 100
+
+        await engine.sweep()
+        await checkpoints.close()
+        return handled
+
+    handled = asyncio.run(scenario())
+    assert handled[1:] == list(range(101, 112)) # Пропущенные посты по порядку, 111 повторно — его отбросит дедуп
+    assert stored_checkpoints[CHANNEL_ID] == 111
+
+
+def test_live_posts_advance_checkpoint_after_catch_up(stored_checkpoints):
+    async def scenario():
+        stored_checkpoints[CHANNEL_ID] = 100
+        FakeClient.history[CHANNEL_ID] = [FakeMessage(CHANNEL_ID, f"post {i}", message_id=i) for i in range(99, 101)]
+
+        checkpoints = catch_up.ChannelCheckpoints()
+        await checkpoints.start()
+        handled = []
+        client = FakeClient("1")
+        engine = make_engine(checkpoints, {1: client}, handled)
+
+        await engine.sweep()
+        await engine._handle_post(client, FakeMessage(CHANNEL_ID, "post 101", message_id=101))
+        await checkpoints.close()
+        return handled
+
+    assert asyncio.run(scenario()) == [101]
+    assert stored_checkpoints[CHANNEL_ID] == 101
+
+
+def test_catch_up_started_before_hold_does_not_release_channel(stored_checkpoints):
+    async def scenario():
+        checkpoints = catch_up.ChannelCheckpoints()
+        await checkpoints.start()
+        generation = checkpoints.generation
+        checkpoints.hold() # Аккаунт переподключился, пока шел догон
+        checkpoints.caught_up(CHANNEL_ID, 100, generation)
+        checkpoints.seen(CHANNEL_ID, 150)
+        await checkpoints.close()
+
+    asyncio.run(scenario())
+    assert CHANNEL_ID not in stored_checkpoints
@@ -0,0 +1,132 @@
+import abc
+import asyncio
+import datetime
+import logging
+
+from userbot_core.src import config, db
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter(abc.ABC):
+    """
+    Асинхронный write-behind батчер: копит записи до max_rows штук или max_delay_ms
+    миллисекунд и сбрасывает их в БД одним запросом. Каждый вызывающий получает
+    результат своей записи через future.
+    """
+
+    def __init__(self, max_rows: int, max_delay_ms: int):
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Дожидается сброса уже поставленных в очередь записей и останавливает батчер."""
+        if self._task:
+            await self._queue.join()
+            self._task.cancel()
+
+    @property
+    def backlog(self) -> int:
+        """Сколько записей ждут сброса."""
+        return self._queue.qsize()
+
+    def submit(self, record) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((record, future))
+        return future
+
+    @abc.abstractmethod
+    async def flush(self, records: list) -> list:
+        """Записывает пачку и возвращает результаты в том же порядке, что и records."""
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush_batch(self, batch: list):
+        records = [record for record, _ in batch]
+        try:
+            results = await self.flush(records)
+        except Exception as e:
+            if len(batch) == 1:
+                self._set_exception(batch[0][1], e)
+                return
+            # Одна "плохая" запись (например, нарушение FK) не должна ронять всю пачку:
+            # повторяем записи по одной, чтобы ошибку получил только ее владелец
+            logger.warning(f"Batch flush of {len(batch)} records failed ({e}), retrying one by one.")
+            for item in batch:
+                await self._flush_batch([item])
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future, exc):
+        if not future.done():
+            future.set_exception(exc)
+
+
+class ProcessedMessageWriter(BatchWriter):
+    """
+    Батчер для processed_messages: одна вставка INSERT ... ON CONFLICT DO NOTHING на пачку.
+    Результат записи — id строки в processed_messages (новой или уже существовавшей
+    для той же пары сообщение/канал) либо None, если такой текст уже сохранен
+    под другим сообщением (совпал message_hash) или то же сообщение уже есть в пачке раньше.
+    """
+
+    def __init__(self):
+        super().__init__(config.PROCESSED_MESSAGE_BATCH_MAX_ROWS, config.PROCESSED_MESSAGE_BATCH_MAX_DELAY_MS)
+
+    async def record(self, message_id: int, channel_id: int, text: str, text_hash: str, author_id: int, username: str, original_link: str,
+                     simhash: int = None, trace: str = None):
+        """trace — контекст трассировки (JSON), с которым уйдет событие new_ad_found."""
+        return await self.submit((message_id, channel_id, text, text_hash, author_id, username, original_link, simhash, trace))
+
+    async def flush(self, records: list) -> list:
+        rows = await db.record_processed_messages_bulk(records)
+        ids = {(row['message_telegram_id'], row['channel_telegram_id']): row['id'] for row in rows}
+        # Одно и то же сообщение дважды в пачке (живой пост и догон): id получает только первая
+        # запись, остальные идут по пути дубликата — событие в outbox поставлено одно
+        return [ids.pop((record[0], record[1]), None) for record in records]
+
+
+class DialogMessageWriter(BatchWriter):
+    """
+    Батчер для append-only таблицы dialog_messages: исходящие DM и входящие ответы
+    дописываются пачками, а не переписыванием JSONB-истории в contacted_users.
+    Месячные секции наперед создает сервис db_maintenance.
+    """
+
+    def __init__(self):
+        super().__init__(config.DIALOG_MESSAGE_BATCH_MAX_ROWS, config.DIALOG_MESSAGE_BATCH_MAX_DELAY_MS)
+
+    async def record(self, user_id: int, account_id: int, direction: str, text: str, telegram_message_id: int = None):
+        """direction: 'out' — DM от userbot-а, 'in' — ответ пользователя."""
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+        return await self.submit((user_id, account_id, direction, text, telegram_message_id, created_at))
+
+    async def flush(self, records: list) -> list:
+        await db.record_dialog_messages_bulk(records)
+        return [None] * len(records)
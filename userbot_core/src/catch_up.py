@@ -0,0 +1,233 @@
+import asyncio
+import logging
+
+import redis.asyncio as redis
+from pyrogram.errors import FloodWait, RPCError
+
+from userbot_core.src import config, db, metrics
+from userbot_core.src.sharding import RELEASE_LEASE_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 100 # Столько сообщений Pyrogram получает за один запрос истории
+
+
+class ChannelCheckpoints:
+    """
+    Чекпоинты каналов: до какого поста канал точно обработан. Живые посты сдвигают
+    чекпоинт канала, только когда канал догнан: иначе первый живой пост после простоя
+    перескочил бы через пропущенные посты, и догон остановился бы на нем. До тех пор
+    живые посты только поднимают отметку live (самый новый увиденный пост), и по
+    окончании догона чекпоинт становится max(live, самый новый пост истории).
+
+    hold() снова «замораживает» все каналы до следующего догона — перед запуском
+    аккаунта, пока он был отключен, его каналы могли пропустить посты. Поколение hold()
+    отсекает догоны, начатые до заморозки.
+
+    Чекпоинты сбрасываются в channel_checkpoints раз в CHANNEL_CHECKPOINT_FLUSH_SECONDS
+    одним запросом. Отставание БД на интервал сброса безопасно: повторно догнанные посты
+    отбрасывает дедупликация.
+    """
+
+    def __init__(self):
+        self._checkpoints = {} # channel_telegram_id -> message_id, до которого канал обработан
+        self._live = {} # channel_telegram_id -> самый новый увиденный пост
+        self._caught_up = set() # каналы, чекпоинт которых двигают живые посты
+        self.generation = 0
+        self._dirty = set()
+        self._task = None
+
+    async def start(self):
+        """Вызывается до запуска клиентов: чекпоинты из БД — нижняя граница первого догона."""
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    async def refresh(self):
+        """Подтягивает чекпоинты из БД: другие реплики могли продвинуть их дальше."""
+        for channel_id, message_id in (await db.get_channel_checkpoints()).items():
+            if message_id > self._checkpoints.get(channel_id, 0):
+                self._checkpoints[channel_id] = message_id
+
+    def get(self, channel_id: int):
+        return self._checkpoints.get(channel_id)
+
+    def hold(self):
+        self._caught_up.clear()
+        self.generation += 1
+
+    def seen(self, channel_id: int, message_id: int):
+        if message_id > self._live.get(channel_id, 0):
+            self._live[channel_id] = message_id
+        if channel_id in self._caught_up:
+            self._advance(channel_id, message_id)
+
+    def caught_up(self, channel_id: int, message_id: int, generation: int):
+        """Канал догнан до message_id догоном, начатым в поколении generation."""
+        if generation != self.generation:
+            return # Пока шел догон, аккаунт переподключался: нужен еще один
+        self._advance(channel_id, max(message_id, self._live.get(channel_id, 0)))
+        self._caught_up.add(channel_id)
+
+    def _advance(self, channel_id: int, message_id: int):
+        if message_id > self._checkpoints.get(channel_id, 0):
+            self._checkpoints[channel_id] = message_id
+            self._dirty.add(channel_id)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        checkpoints = {channel_id: self._checkpoints[channel_id] for channel_id in self._dirty}
+        self._dirty.clear()
+        try:
+            await db.save_channel_checkpoints(checkpoints)
+        except Exception:
+            self._dirty.update(checkpoints)
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.CHANNEL_CHECKPOINT_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to save channel checkpoints: {e}")
+
+
+class ChannelCatchUp:
+    """
+    Догоняет посты, опубликованные, пока живые обработчики их не видели (сервис лежал,
+    аккаунт переподключался или переезжал на другую реплику). Проход запускается при
+    старте, при запуске каждого аккаунта (request(), запуски в пределах
+    CATCH_UP_DEBOUNCE_SECONDS объединяются) и раз в CHANNEL_MONITOR_INTERVAL_SECONDS.
+
+    Для каждого активного канала история читается через get_chat_history от новых постов
+    к чекпоинту, и пропущенные посты в хронологическом порядке проходят через тот же
+    обработчик, что и живые (фильтр, дедупликация, пачечная запись с outbox). Каналы
+    распределяются по аккаунтам этой реплики: одновременно догоняются не больше
+    CATCH_UP_CONCURRENCY каналов, у каждого аккаунта — не больше одного. Канал догоняет
+    одна реплика — та, что захватила catch_up_lock:<канал>.
+
+    Чтобы догон не вытеснял живой поток, догоняемые посты идут с общим темпом
+    CATCH_UP_MESSAGES_PER_SECOND и ждут, пока очередь батчера processed_messages
+    не станет короче CATCH_UP_MAX_WRITER_BACKLOG.
+    """
+
+    def __init__(self, redis_client: redis.Redis, checkpoints: ChannelCheckpoints, clients: dict, handle_post, channel_ids, writer_backlog):
+        self.redis = redis_client
+        self.checkpoints = checkpoints
+        self._clients = clients # account_id -> pyrogram.Client, запущенные на этой реплике
+        self._handle_post = handle_post # async (client, message) -> None, обработчик живых постов
+        self._channel_ids = channel_ids # () -> list активных каналов
+        self._writer_backlog = writer_backlog # () -> int
+        self._release_script = redis_client.register_script(RELEASE_LEASE_SCRIPT)
+        self._semaphore = asyncio.Semaphore(config.CATCH_UP_CONCURRENCY)
+        self._account_locks = {} # account_id -> asyncio.Lock
+        self._next_post_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._wakeup.set() # Первый проход — сразу после старта
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+    def request(self):
+        """Аккаунт (пере)подключился: догнать каналы, не дожидаясь очередного прохода."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config.CHANNEL_MONITOR_INTERVAL_SECONDS)
+                await asyncio.sleep(config.CATCH_UP_DEBOUNCE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Channel catch-up failed: {e}")
+
+    async def sweep(self):
+        if not self._clients:
+            return
+        await self.checkpoints.refresh()
+        await asyncio.gather(*(self._catch_up_channel(channel_id) for channel_id in self._channel_ids()))
+
+    def _accounts_for(self, channel_id: int) -> list:
+        """Аккаунты в порядке попыток: у разных каналов — разный первый аккаунт."""
+        account_ids = sorted(self._clients)
+        start = channel_id % len(account_ids) if account_ids else 0
+        return account_ids[start:] + account_ids[:start]
+
+    async def _catch_up_channel(self, channel_id: int):
+        async with self._semaphore:
+            lock_key = f"{config.REDIS_CATCH_UP_LOCK_KEY_PREFIX}{channel_id}"
+            if not await self.redis.set(lock_key, config.REPLICA_ID, nx=True, ex=config.CATCH_UP_LOCK_TTL_SECONDS):
+                return # Канал уже догоняет другая реплика
+            try:
+                for account_id in self._accounts_for(channel_id):
+                    client = self._clients.get(account_id)
+                    if client is None:
+                        continue
+                    try:
+                        async with self._account_locks.setdefault(account_id, asyncio.Lock()):
+                            await self._catch_up_with(client, channel_id)
+                        return
+                    except FloodWait as e:
+                        # Чекпоинт не сдвинулся: недочитанное догонит следующий проход
+                        logger.warning(f"Flood wait {e.value}s reading history of {channel_id} via account {account_id}, trying another account.")
+                    except RPCError as e:
+                        logger.warning(f"Account {account_id} cannot read history of channel {channel_id}: {e}")
+                logger.warning(f"No account on replica {config.REPLICA_ID} could catch up channel {channel_id}.")
+            finally:
+                await self._release_script(keys=[lock_key], args=[config.REPLICA_ID])
+
+    async def _catch_up_with(self, client, channel_id: int):
+        generation = self.checkpoints.generation
+        checkpoint = self.checkpoints.get(channel_id)
+        if checkpoint is None:
+            # Новый канал: прошлое до подключения не разбираем, отсчет — с последнего поста
+            newest = 0
+            async for message in client.get_chat_history(channel_id, limit=1):
+                newest = message.id
+            self.checkpoints.caught_up(channel_id, newest, generation)
+            return
+
+        missed = [] # От новых к старым
+        async for message in client.get_chat_history(channel_id):
+            if message.id <= checkpoint:
+                break
+            missed.append(message)
+            if len(missed) >= config.CATCH_UP_MAX_MESSAGES_PER_CHANNEL:
+                logger.warning(f"Channel {channel_id} has more than {len(missed)} missed posts since {checkpoint}; older ones are skipped.")
+                break
+            if len(missed) % HISTORY_PAGE_SIZE == 0:
+                await asyncio.sleep(config.CATCH_UP_PAGE_DELAY_SECONDS)
+
+        for message in reversed(missed):
+            await self._throttle()
+            await self._handle_post(client, message)
+            metrics.CATCH_UP_MESSAGES.inc()
+        self.checkpoints.caught_up(channel_id, missed[0].id if missed else checkpoint, generation)
+        if missed:
+            logger.info(f"Caught up {len(missed)} missed posts in channel {channel_id} after message {checkpoint}.")
+
+    async def _throttle(self):
+        # Живые посты в приоритете: пока батчер разгребает их очередь, догон ждет
+        while self._writer_backlog() > config.CATCH_UP_MAX_WRITER_BACKLOG:
+            await asyncio.sleep(0.1)
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        at = max(self._next_post_at, now)
+        self._next_post_at = at + 1 / config.CATCH_UP_MESSAGES_PER_SECOND
+        if at > now:
+            await asyncio.sleep(at - now)
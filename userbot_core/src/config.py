@@ -1,4 +1,5 @@
 import os
+import socket
 
 # Database settings
 DB_HOST = os.getenv("POSTGRES_HOST", "db")
@@ -11,6 +12,16 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASSWORD", "guest")
 
+# Postgres LISTEN/NOTIFY channel for config cache invalidation
+PG_CONFIG_CHANNEL = "config_changed"
+# Safety-net full refresh of the config cache (seconds), in case a NOTIFY was missed
+CONFIG_CACHE_REFRESH_SECONDS = 300
+
+# Transactional outbox: events are written to the outbox table in the same transaction as the DB row
+PG_OUTBOX_CHANNEL = "outbox_added" # NOTIFY после вставки в outbox
+OUTBOX_BATCH_SIZE = 100 # Сколько строк outbox публикуется одной пачкой (подтверждения брокера ждем конвейером)
+OUTBOX_POLL_SECONDS = 1 # Страховочный опрос outbox на случай пропущенного NOTIFY
+
 # Redis settings
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 
@@ -26,16 +37,79 @@ Q_NEW_AD = "new_ad_found"
 Q_SEND_DM = "send_dm"
 Q_DM_RESPONSE = "dm_response"
 Q_OWNER_CONFIRMED = "owner_confirmed"
+Q_SEND_DM_RETRY_PREFIX = "send_dm.retry." # send_dm.retry.<delay>s — очереди задержки с dead-letter обратно в send_dm
+Q_SEND_DM_DLQ = "send_dm.dlq" # Запросы, исчерпавшие попытки
+
+# Delayed retries for send_dm when all accounts are at their cap
+DM_RETRY_DELAYS_SECONDS = (30, 300, 1800)
+DM_MAX_RETRY_ATTEMPTS = 12
+
+# Prometheus metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100")) # HTTP /metrics
+
+# Lead tracing (see tracing.py)
+TRACE_SERVICE_NAME = "userbot_core"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "") # JSONL-файл завершенных трасс; пусто — не писать
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "") # Например http://otel-collector:4318/v1/traces; пусто — не отправлять
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000")) # Трассы сверх очереди выгрузки отбрасываются
 
 # Keywords for filtering
 DEFAULT_KEYWORDS = ["продажа", "квартира", "цена", "м2", "собственник"]
 
 # Userbot specific settings
 MAX_DMS_PER_HOUR_PER_ACCOUNT = 20 # Пример: 20 DM в час с одного аккаунта
-DM_SEND_DELAY_SECONDS = (10, 30) # Случайная задержка между DM (от 10 до 30 секунд)
-CHANNEL_MONITOR_INTERVAL_SECONDS = 300 # Как часто проверять новые сообщения в каналах (5 минут)
+DM_RATE_WINDOW_SECONDS = 3600 # Длина скользящего окна для лимита DM
+DM_SEND_DELAY_SECONDS = (10, 30) # Случайная задержка между DM одного аккаунта (от 10 до 30 секунд)
+DM_SCHEDULER_POLL_SECONDS = 1 # Как часто воркер аккаунта перепроверяет свое расписание в Redis
+SEND_DM_PREFETCH_COUNT = int(os.getenv("SEND_DM_PREFETCH_COUNT", "50")) # Сколько запросов send_dm consumer берет без подтверждения
+CHANNEL_MONITOR_INTERVAL_SECONDS = 300 # Как часто догонять историю каналов с чекпоинта (5 минут), см. catch_up.py
+DM_TRACE_TTL_SECONDS = 7 * 24 * 3600 # Сколько ждем ответа на DM, чтобы продолжить его трассу
+
+# Sharding of userbot accounts across userbot_core replicas
+REPLICA_ID = os.getenv("USERBOT_REPLICA_ID") or socket.gethostname()
+ACCOUNT_LEASE_TTL_SECONDS = 30 # Аренда аккаунта истекает, если реплика перестала ее продлевать
+SHARD_RECONCILE_INTERVAL_SECONDS = 10 # Как часто реплика продлевает аренды и перераспределяет аккаунты (должно быть заметно меньше ACCOUNT_LEASE_TTL_SECONDS)
+ACCOUNT_START_CONCURRENCY = 5 # Сколько клиентов Pyrogram запускаются одновременно
+ACCOUNT_START_TIMEOUT_SECONDS = 60
+ACCOUNT_START_MAX_BACKOFF_SECONDS = 600 # Потолок паузы перед повторным запуском аккаунта после ошибки
+PG_USER_ACCOUNTS_CHANNEL = "user_accounts_changed" # NOTIFY при изменении user_accounts
+
+# Channel catch-up from checkpoints (see catch_up.py)
+CHANNEL_CHECKPOINT_FLUSH_SECONDS = 10 # Как часто чекпоинты каналов сбрасываются в БД
+CATCH_UP_DEBOUNCE_SECONDS = 5 # Запуски аккаунтов в течение этого времени догоняются одним проходом
+CATCH_UP_CONCURRENCY = 3 # Сколько каналов догоняются одновременно (у одного аккаунта — не больше одного)
+CATCH_UP_MAX_MESSAGES_PER_CHANNEL = 1000 # Больше пропущенных постов канала не догоняем (самые старые теряются)
+CATCH_UP_PAGE_DELAY_SECONDS = 1.0 # Пауза между страницами истории (100 постов) одного канала
+CATCH_UP_MESSAGES_PER_SECOND = 20 # Общий темп обработки догоняемых постов
+CATCH_UP_MAX_WRITER_BACKLOG = 100 # Догон ждет, пока очередь батчера processed_messages длиннее этого
+CATCH_UP_LOCK_TTL_SECONDS = 600 # Блокировка канала на время догона (один канал догоняет одна реплика)
+
+# Near-duplicate detection (SimHash)
+NEAR_DUP_MAX_HAMMING_DISTANCE = int(os.getenv("NEAR_DUP_MAX_HAMMING_DISTANCE", "4")) # Порог расстояния Хэмминга между 64-битными отпечатками
+NEAR_DUP_WINDOW_DAYS = 7 # За сколько дней ищем почти-дубликаты
+
+# Local (in-process) dedup tier in front of Redis
+DEDUP_BLOOM_INITIAL_CAPACITY = 100_000
+DEDUP_BLOOM_ERROR_RATE = 0.001
+DEDUP_LRU_MAX_SIZE = 50_000
+
+# Batched writes to processed_messages
+PROCESSED_MESSAGE_BATCH_MAX_ROWS = 200 # Сбрасываем пачку при накоплении стольких строк...
+PROCESSED_MESSAGE_BATCH_MAX_DELAY_MS = 50 # ...или спустя столько миллисекунд после первой записи в пачке
+
+# Batched appends to dialog_messages (partitioned by month)
+DIALOG_MESSAGE_BATCH_MAX_ROWS = 200
+DIALOG_MESSAGE_BATCH_MAX_DELAY_MS = 50
 
 # Redis Keys
-REDIS_DM_COUNT_KEY_PREFIX = "dm_count:" # dm_count:account_id:timestamp
+REDIS_DM_WINDOW_KEY_PREFIX = "dm_window:" # dm_window:account_id (sorted set времен отправок)
 REDIS_PROCESSED_MESSAGE_KEY_PREFIX = "processed_msg:" # processed_msg:message_hash
 REDIS_CONTACTED_USER_KEY_PREFIX = "contacted_user:" # contacted_user:user_id
+REDIS_DM_SCHEDULE_KEY_PREFIX = "dm_schedule:" # dm_schedule:account_id (sorted set заданий по времени отправки)
+REDIS_DM_LAST_SENT_KEY_PREFIX = "dm_last_sent:" # dm_last_sent:account_id
+REDIS_ACCOUNT_LEASE_KEY_PREFIX = "account_lease:" # account_lease:account_id -> replica_id
+REDIS_REPLICAS_KEY = "userbot_replicas" # sorted set: replica_id -> время последнего heartbeat
+REDIS_CATCH_UP_LOCK_KEY_PREFIX = "catch_up_lock:" # catch_up_lock:channel_id -> replica_id
+REDIS_DEDUP_MARKS_CHANNEL = "dedup_marks" # pub/sub: новые флаги processed/contacted для локальных кэшей
+REDIS_SIMHASH_KEY_PREFIX = "simhash:" # simhash:band_index:band_value (sorted set отпечатков)
+REDIS_DM_TRACE_KEY_PREFIX = "dm_trace:" # dm_trace:user_id -> контекст трассы отправленного DM (до ответа пользователя)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from userbot_core.src import config, db, filters
+
+logger = logging.getLogger(__name__)
+
+
+def parse_keywords(keywords_str: str) -> list:
+    return [k.strip() for k in keywords_str.split(',')]
+
+
+class ConfigCache:
+    """
+    In-memory кэш активных каналов (с разобранными ключевыми словами и
+    предкомпилированными фильтрами) и настроек.
+    Перечитывается целиком по NOTIFY из Postgres (триггеры на channels/settings),
+    поэтому горячий путь обработки сообщений не обращается к БД.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._channels = {} # telegram_id -> {'name': ..., 'keywords': [...] или None}
+        self._settings = {} # key -> value
+        self._listener_conn = None
+        self._reload_task = None
+        self._reload_pending = False
+        self._refresh_task = None
+        self._reconnect_task = None
+        self._closed = False
+
+    async def start(self):
+        await self.reload()
+        await self._listen()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        self._closed = True
+        for task in (self._refresh_task, self._reload_task, self._reconnect_task):
+            if task:
+                task.cancel()
+        if self._listener_conn and not self._listener_conn.is_closed():
+            await self._listener_conn.close()
+
+    async def reload(self):
+        """Полностью перечитывает каналы и настройки и атомарно подменяет снимок."""
+        channels_rows = await db.get_active_channels()
+        settings_rows = await db.get_settings()
+
+        channels = {}
+        for row in channels_rows:
+            channels[row['telegram_id']] = {
+                'name': row['name'],
+                'keywords': parse_keywords(row['keywords']) if row['keywords'] else None,
+            }
+        self._channels = channels
+        filters.set_channel_keywords({cid: ch['keywords'] for cid, ch in channels.items() if ch['keywords']})
+        self._settings = {row['key']: row['value'] for row in settings_rows}
+        self.version += 1
+        logger.info(f"Config cache reloaded (version {self.version}): {len(channels)} active channels.")
+
+    def get_channel_keywords(self, channel_id: int) -> list:
+        channel = self._channels.get(channel_id)
+        if channel and channel['keywords']:
+            return channel['keywords']
+        return config.DEFAULT_KEYWORDS
+
+    def channel_ids(self) -> list:
+        return list(self._channels)
+
+    def get_welcome_message(self) -> str:
+        return self._settings.get('welcome_message') or config.DEFAULT_WELCOME_MESSAGE
+
+    async def _listen(self):
+        self._listener_conn = await db.create_listener_connection()
+        await self._listener_conn.add_listener(config.PG_CONFIG_CHANNEL, self._on_notify)
+        self._listener_conn.add_termination_listener(self._on_listener_terminated)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        logger.info(f"Config change notification received ({payload}).")
+        self._schedule_reload()
+
+    def _on_listener_terminated(self, connection):
+        if self._closed:
+            return
+        logger.warning("Config cache listener connection lost. Reconnecting...")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._closed:
+            try:
+                await self._listen()
+                # Пока соединения не было, уведомления могли потеряться
+                self._schedule_reload()
+                return
+            except Exception as e:
+                logger.error(f"Config cache listener reconnect failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _schedule_reload(self):
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload_coalesced())
+        else:
+            self._reload_pending = True
+
+    async def _reload_coalesced(self):
+        # Пачка уведомлений, пришедших во время перезагрузки, схлопывается в одну повторную перезагрузку
+        while True:
+            self._reload_pending = False
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Failed to reload config cache: {e}")
+            if not self._reload_pending:
+                return
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(config.CONFIG_CACHE_REFRESH_SECONDS)
+            self._schedule_reload()
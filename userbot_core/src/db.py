@@ -1,5 +1,5 @@
 import asyncpg
-from userbot_core.src import config
+from userbot_core.src import config, metrics
 
 _pool = None
 
@@ -12,48 +12,152 @@ async def get_db_pool():
             password=config.DB_PASS,
             host=config.DB_HOST
         )
+        metrics.track_pool(_pool)
     return _pool
 
+async def create_listener_connection():
+    """Отдельное (не из пула) соединение для LISTEN: оно живет все время работы сервиса."""
+    return await asyncpg.connect(
+        database=config.DB_NAME,
+        user=config.DB_USER,
+        password=config.DB_PASS,
+        host=config.DB_HOST
+    )
+
+@metrics.db_timed
 async def get_active_user_accounts():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         return await conn.fetch("SELECT id, phone_number, session_string FROM user_accounts WHERE is_active = TRUE ORDER BY last_used_at ASC")
 
+@metrics.db_timed
 async def update_user_account_last_used(account_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE user_accounts SET last_used_at = CURRENT_TIMESTAMP WHERE id = $1", account_id)
 
+@metrics.db_timed
 async def add_user_account(phone_number: str, session_string: str):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("INSERT INTO user_accounts (phone_number, session_string) VALUES ($1, $2) ON CONFLICT (phone_number) DO UPDATE SET session_string = EXCLUDED.session_string, is_active = TRUE",
                            phone_number, session_string)
 
+@metrics.db_timed
 async def get_active_channels():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         return await conn.fetch("SELECT telegram_id, name, keywords FROM channels WHERE is_active = TRUE")
 
-async def record_processed_message(message_id: int, channel_id: int, text: str, text_hash: str, author_id: int, username: str, original_link: str):
+@metrics.db_timed
+async def get_channel_checkpoints() -> dict:
+    """channel_telegram_id -> id последнего обработанного поста."""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Check if message already processed (can happen if hash collision, but less likely with unique constraint on message_id+channel_id)
-        existing_id = await conn.fetchval("SELECT id FROM processed_messages WHERE message_telegram_id = $1 AND channel_telegram_id = $2", message_id, channel_id)
-        if existing_id:
-            return existing_id
+        rows = await conn.fetch("SELECT channel_telegram_id, last_message_id FROM channel_checkpoints")
+        return {row['channel_telegram_id']: row['last_message_id'] for row in rows}
 
-        return await conn.fetchval("""
-            INSERT INTO processed_messages (message_telegram_id, channel_telegram_id, message_text, message_hash, author_telegram_id, author_username, original_link)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-            RETURNING id
-        """, message_id, channel_id, text, text_hash, author_id, username, original_link)
+@metrics.db_timed
+async def save_channel_checkpoints(checkpoints: dict):
+    """Сохраняет чекпоинты каналов одним запросом; чекпоинт только растет (другая реплика могла уйти дальше)."""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO channel_checkpoints (channel_telegram_id, last_message_id)
+            SELECT * FROM unnest($1::bigint[], $2::bigint[])
+            ON CONFLICT (channel_telegram_id) DO UPDATE SET
+                last_message_id = GREATEST(channel_checkpoints.last_message_id, EXCLUDED.last_message_id),
+                updated_at = CURRENT_TIMESTAMP
+        """, list(checkpoints), list(checkpoints.values()))
 
+@metrics.db_timed
+async def record_processed_messages_bulk(records: list):
+    """
+    Вставляет пачку обработанных сообщений одним запросом и в той же транзакции
+    ставит событие new_ad_found в outbox для каждой действительно вставленной строки.
+    records: список кортежей (message_id, channel_id, text, text_hash, author_id, username, original_link, simhash, trace),
+    trace — контекст трассировки (JSON) для события в outbox или None.
+    Дедупликация идет через processed_message_keys (processed_messages секционирована
+    и уникальных ограничений не имеет): сначала захватывается ключ, потом пишется строка.
+    Возвращает id для вставленных строк и для строк, уже существовавших с той же парой
+    (message_telegram_id, channel_telegram_id). Записи, отклоненные по совпадению
+    message_hash с другим сообщением, в результат не попадают.
+    """
+    columns = list(zip(*records))
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            WITH input AS (
+                SELECT DISTINCT ON (message_telegram_id, channel_telegram_id) *
+                FROM unnest($1::bigint[], $2::bigint[], $3::text[], $4::text[], $5::bigint[], $6::text[], $7::text[], $8::bigint[], $9::text[])
+                    AS t(message_telegram_id, channel_telegram_id, message_text, message_hash, author_telegram_id, author_username, original_link, simhash, trace)
+            ), claimed AS (
+                INSERT INTO processed_message_keys (message_hash, message_telegram_id, channel_telegram_id, processed_message_id, processed_at)
+                SELECT message_hash, message_telegram_id, channel_telegram_id, nextval('processed_messages_id_seq'), CURRENT_TIMESTAMP
+                FROM input
+                ON CONFLICT DO NOTHING
+                RETURNING processed_message_id, message_hash, message_telegram_id, channel_telegram_id, processed_at
+            ), inserted AS (
+                INSERT INTO processed_messages (id, message_telegram_id, channel_telegram_id, message_text, message_hash, author_telegram_id, author_username, original_link, simhash, processed_at)
+                SELECT c.processed_message_id, i.message_telegram_id, i.channel_telegram_id, i.message_text, i.message_hash,
+                       i.author_telegram_id, i.author_username, i.original_link, i.simhash, c.processed_at
+                FROM claimed c
+                JOIN input i ON i.message_telegram_id = c.message_telegram_id AND i.channel_telegram_id = c.channel_telegram_id
+                RETURNING id, message_telegram_id, channel_telegram_id, author_telegram_id, author_username, original_link
+            ), outboxed AS (
+                -- Для уже существовавших строк событие было поставлено при их вставке
+                INSERT INTO outbox (routing_key, payload, trace)
+                SELECT $10::text, jsonb_build_object(
+                    'processed_message_db_id', n.id,
+                    'channel_id', n.channel_telegram_id,
+                    'message_id', n.message_telegram_id,
+                    'author_id', n.author_telegram_id,
+                    'author_username', n.author_username,
+                    'original_link', n.original_link
+                ), i.trace::jsonb
+                FROM inserted n
+                JOIN input i ON i.message_telegram_id = n.message_telegram_id AND i.channel_telegram_id = n.channel_telegram_id
+            )
+            SELECT id, message_telegram_id, channel_telegram_id FROM inserted
+            UNION ALL
+            -- Снимок запроса не видит только что захваченные ключи, поэтому здесь только ранее существовавшие
+            SELECT k.processed_message_id, k.message_telegram_id, k.channel_telegram_id
+            FROM processed_message_keys k
+            JOIN input i ON k.message_telegram_id = i.message_telegram_id AND k.channel_telegram_id = i.channel_telegram_id
+        """, *[list(column) for column in columns], config.Q_NEW_AD)
+
+@metrics.db_timed
+async def record_dialog_messages_bulk(records: list):
+    """
+    Дописывает пачку сообщений диалогов в dialog_messages одним запросом.
+    records: список кортежей (user_id, account_id, direction, text, telegram_message_id, created_at).
+    """
+    columns = list(zip(*records))
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO dialog_messages (user_telegram_id, account_id, direction, message_text, telegram_message_id, created_at)
+            SELECT user_telegram_id, account_id, direction::dialog_direction, message_text, telegram_message_id, created_at
+            FROM unnest($1::bigint[], $2::integer[], $3::text[], $4::text[], $5::bigint[], $6::timestamptz[])
+                AS t(user_telegram_id, account_id, direction, message_text, telegram_message_id, created_at)
+        """, *[list(column) for column in columns])
+
+@metrics.db_timed
+async def get_recent_simhashes(max_age_seconds: int):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT simhash, processed_at FROM processed_messages
+            WHERE simhash IS NOT NULL AND processed_at > CURRENT_TIMESTAMP - make_interval(secs => $1)
+        """, max_age_seconds)
+
+@metrics.db_timed
 async def get_contacted_user_status(user_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         return await conn.fetchval("SELECT status FROM contacted_users WHERE telegram_id = $1", user_id)
 
+@metrics.db_timed
 async def add_contacted_user(user_id: int, username: str, first_message_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
@@ -63,8 +167,15 @@ async def add_contacted_user(user_id: int, username: str, first_message_id: int)
             ON CONFLICT (telegram_id) DO UPDATE SET username = EXCLUDED.username, status = 'pending', last_contact_at = CURRENT_TIMESTAMP
         """, user_id, username, first_message_id)
 
+@metrics.db_timed
 async def get_welcome_message_from_settings():
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         message = await conn.fetchval("SELECT value FROM settings WHERE key = 'welcome_message'")
         return message if message else config.DEFAULT_WELCOME_MESSAGE
+
+@metrics.db_timed
+async def get_settings():
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch("SELECT key, value FROM settings")
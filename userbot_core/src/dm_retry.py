@@ -0,0 +1,72 @@
+import logging
+
+import aio_pika
+
+from userbot_core.src import config, metrics
+
+logger = logging.getLogger(__name__)
+
+ATTEMPTS_HEADER = "x-attempts"
+REASON_HEADER = "x-last-reason"
+
+
+def retry_queue_name(delay_seconds: int) -> str:
+    return f"{config.Q_SEND_DM_RETRY_PREFIX}{delay_seconds}s"
+
+
+async def declare_retry_queues(channel: aio_pika.abc.AbstractChannel):
+    """
+    Очереди отложенного повтора: сообщение лежит в очереди уровня TTL миллисекунд,
+    после чего RabbitMQ через dead-letter возвращает его в send_dm.
+    """
+    for delay in config.DM_RETRY_DELAYS_SECONDS:
+        await channel.declare_queue(
+            retry_queue_name(delay),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": config.Q_SEND_DM,
+            }
+        )
+    await channel.declare_queue(config.Q_SEND_DM_DLQ, durable=True)
+
+
+def pick_delay(retry_after: float = None) -> int:
+    """Наименьший уровень задержки, не меньший времени до освобождения ближайшего аккаунта."""
+    delays = sorted(config.DM_RETRY_DELAYS_SECONDS)
+    if retry_after is None:
+        return delays[0] # Ни одного запущенного аккаунта: скорее всего, реплики еще поднимаются
+    for delay in delays:
+        if delay >= retry_after:
+            return delay
+    return delays[-1]
+
+
+async def defer(channel: aio_pika.abc.AbstractChannel, message: aio_pika.IncomingMessage, retry_after: float = None, reason: str = "") -> str:
+    """
+    Откладывает запрос send_dm: публикует копию в очередь задержки (или в DLQ после
+    DM_MAX_RETRY_ATTEMPTS попыток). Исходное сообщение после этого можно подтверждать.
+    Возвращает имя очереди, куда ушло сообщение.
+    """
+    headers = dict(message.headers or {})
+    attempts = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+    headers[ATTEMPTS_HEADER] = attempts
+    headers[REASON_HEADER] = reason
+
+    if attempts > config.DM_MAX_RETRY_ATTEMPTS:
+        routing_key = config.Q_SEND_DM_DLQ
+    else:
+        routing_key = retry_queue_name(pick_delay(retry_after))
+
+    await metrics.publish(
+        channel.default_exchange,
+        aio_pika.Message(
+            body=message.body,
+            content_type=message.content_type,
+            headers=headers,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+        ),
+        routing_key
+    )
+    return routing_key
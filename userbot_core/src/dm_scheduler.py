@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import random
+import time
+
+import redis.asyncio as redis
+
+from userbot_core.src import config
+
+logger = logging.getLogger(__name__)
+
+# Атомарно ставит задание в расписание аккаунта не раньше, чем через случайную
+# задержку после последнего запланированного/отправленного DM этого аккаунта.
+# KEYS[1]: расписание (sorted set: задание -> время отправки), KEYS[2]: время последней отправки.
+# ARGV[1]: задание, ARGV[2]: задержка (сек). Возвращает время отправки строкой.
+SCHEDULE_DM_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local base = now
+local tail = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if tail[2] and tonumber(tail[2]) > base then
+    base = tonumber(tail[2])
+end
+local last_sent = tonumber(redis.call('GET', KEYS[2]) or '0')
+if last_sent > base then
+    base = last_sent
+end
+local send_at = base + tonumber(ARGV[2])
+redis.call('ZADD', KEYS[1], send_at, ARGV[1])
+return tostring(send_at)
+"""
+
+
+class DmScheduler:
+    """
+    Планировщик отправки DM: у каждого аккаунта свое расписание в Redis
+    (переживает перезапуск) и свой воркер, который отправляет задания по мере
+    наступления их времени. Consumer очереди send_dm только ставит задание в
+    расписание и сразу подтверждает сообщение, а аккаунты шлют DM параллельно,
+    каждый в своем темпе со случайной задержкой DM_SEND_DELAY_SECONDS.
+    """
+
+    def __init__(self, redis_client: redis.Redis, send_callback):
+        self.redis = redis_client
+        self._send = send_callback # async (account_id, job: dict) -> None
+        self._schedule_script = redis_client.register_script(SCHEDULE_DM_SCRIPT)
+        self._workers = {} # account_id -> asyncio.Task
+        self._wakeups = {} # account_id -> asyncio.Event
+
+    @staticmethod
+    def _schedule_key(account_id: int) -> str:
+        return f"{config.REDIS_DM_SCHEDULE_KEY_PREFIX}{account_id}"
+
+    @staticmethod
+    def _last_sent_key(account_id: int) -> str:
+        return f"{config.REDIS_DM_LAST_SENT_KEY_PREFIX}{account_id}"
+
+    async def schedule(self, account_id: int, job: dict) -> float:
+        """Ставит DM в расписание аккаунта и возвращает unix-время запланированной отправки."""
+        send_at = await self._schedule_script(
+            keys=[self._schedule_key(account_id), self._last_sent_key(account_id)],
+            args=[json.dumps(job), random.uniform(*config.DM_SEND_DELAY_SECONDS)]
+        )
+        event = self._wakeups.get(account_id)
+        if event:
+            event.set()
+        return float(send_at)
+
+    def start_account(self, account_id: int):
+        if account_id in self._workers:
+            return
+        self._wakeups[account_id] = asyncio.Event()
+        self._workers[account_id] = asyncio.create_task(self._run_account(account_id))
+
+    async def stop_account(self, account_id: int):
+        """Останавливает воркер аккаунта; неотправленные задания остаются в расписании Redis."""
+        task = self._workers.pop(account_id, None)
+        self._wakeups.pop(account_id, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self):
+        for account_id in list(self._workers):
+            await self.stop_account(account_id)
+
+    async def _wait(self, event: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run_account(self, account_id: int):
+        key = self._schedule_key(account_id)
+        event = self._wakeups[account_id]
+        while True:
+            try:
+                event.clear()
+                head = await self.redis.zrange(key, 0, 0, withscores=True)
+                if not head:
+                    await self._wait(event, config.DM_SCHEDULER_POLL_SECONDS)
+                    continue
+
+                member, send_at = head[0]
+                delay = send_at - time.time()
+                if delay > 0:
+                    await self._wait(event, min(delay, config.DM_SCHEDULER_POLL_SECONDS))
+                    continue
+
+                # Забираем задание; если ZREM вернул 0, его уже забрал другой воркер
+                if not await self.redis.zrem(key, member):
+                    continue
+                await self.redis.set(self._last_sent_key(account_id), time.time(), ex=3600)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"DM scheduler for account {account_id} failed to read its schedule: {e}")
+                await asyncio.sleep(config.DM_SCHEDULER_POLL_SECONDS)
+                continue
+
+            try:
+                await self._send(account_id, json.loads(member))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduled DM via account {account_id} failed: {e}")
@@ -0,0 +1,50 @@
+import json
+
+import aio_pika
+import msgpack
+
+from userbot_core.src import config
+
+# Компактный формат сообщений очередей, общий для всех сервисов.
+# Тело — msgpack-массив [версия схемы, тип сообщения, *значения полей в порядке схемы]:
+# имена полей по сети не передаются, а версия и тип переживают dead-letter и DLQ.
+# Крупные поля передаются по ссылке (claim-check): например, new_ad_found несет только
+# processed_message_db_id, а текст объявления при необходимости читается из processed_messages.
+SCHEMA_VERSION = 1
+CONTENT_TYPE = "application/x-msgpack"
+
+SCHEMAS = {
+    1: {
+        config.Q_NEW_AD: (1, ("processed_message_db_id", "channel_id", "message_id", "author_id", "author_username", "original_link")),
+        config.Q_SEND_DM: (2, ("user_id", "username", "welcome_message", "processed_message_db_id", "original_link")),
+        config.Q_DM_RESPONSE: (3, ("user_id", "username", "response_text")),
+        config.Q_OWNER_CONFIRMED: (4, ("user_id", "username", "response_text", "processed_message_db_id", "original_link", "timestamp")),
+    },
+}
+
+_DECODE = {
+    version: {type_code: fields for type_code, fields in schemas.values()}
+    for version, schemas in SCHEMAS.items()
+}
+
+
+def encode(message_type: str, payload: dict) -> bytes:
+    type_code, fields = SCHEMAS[SCHEMA_VERSION][message_type]
+    return msgpack.packb([SCHEMA_VERSION, type_code, *(payload.get(field) for field in fields)])
+
+
+def decode(body: bytes, content_type: str = CONTENT_TYPE) -> dict:
+    if content_type == 'application/json':
+        # Сообщения, опубликованные до перехода на msgpack
+        return json.loads(body.decode())
+    version, type_code, *values = msgpack.unpackb(body)
+    fields = _DECODE[version][type_code]
+    return dict(zip(fields, values))
+
+
+def make_message(message_type: str, payload: dict, **kwargs) -> aio_pika.Message:
+    return aio_pika.Message(body=encode(message_type, payload), content_type=CONTENT_TYPE, **kwargs)
+
+
+def unpack(message: aio_pika.abc.AbstractIncomingMessage) -> dict:
+    return decode(message.body, message.content_type)
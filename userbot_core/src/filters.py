@@ -1,32 +1,97 @@
 import re
+from collections import namedtuple
+from functools import lru_cache
+
 from userbot_core.src import config
 
+# Цена/площадь и маркеры "от собственника" не зависят от канала, поэтому компилируются один раз
+_PRICE_RE = re.compile(r'\b\d{2,7}\s*(?:₽|руб|млн|тыс|k|m|м2|м²)\b')
+_OWNER_MARKERS = ("собственник", "продавец", "без комиссии")
+
+AdMatch = namedtuple('AdMatch', ['is_ad', 'keywords', 'price_hits', 'owner_hits'])
+
+_NO_MATCH = AdMatch(False, (), (), ())
+
+
+class AdMatcher:
+    """
+    Подготовленный фильтр объявлений для одного набора ключевых слов.
+    Ключевые слова приводятся к нижнему регистру и дедуплицируются один раз при
+    сборке, а не на каждом сообщении. Поиск подстрок остается на `in`: в CPython
+    поиск подстроки в C быстрее, чем объединенное regex-выражение из альтернатив
+    (см. benchmarks/bench_filters.py).
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(k.lower() for k in keywords))
+
+    def is_ad(self, text: str) -> bool:
+        text_lower = text.lower()
+        for keyword in self.keywords:
+            if keyword in text_lower:
+                break
+        else:
+            return False
+
+        if _PRICE_RE.search(text_lower):
+            return True
+        for marker in _OWNER_MARKERS:
+            if marker in text_lower:
+                return True
+        return False
+
+    def match(self, text: str) -> AdMatch:
+        """Возвращает совпавшие ключевые слова, цены/площади и маркеры собственника."""
+        text_lower = text.lower()
+        keywords = tuple(k for k in self.keywords if k in text_lower)
+        if not keywords:
+            return _NO_MATCH
+
+        price_hits = tuple(m.group() for m in _PRICE_RE.finditer(text_lower))
+        owner_hits = tuple(m for m in _OWNER_MARKERS if m in text_lower)
+        return AdMatch(bool(price_hits or owner_hits), keywords, price_hits, owner_hits)
+
+    def classify_many(self, texts) -> list:
+        is_ad = self.is_ad
+        return [is_ad(text) for text in texts]
+
+
+@lru_cache(maxsize=1024)
+def _compile_matcher(keywords: tuple) -> AdMatcher:
+    return AdMatcher(keywords)
+
+
+def get_matcher(keywords=None) -> AdMatcher:
+    if keywords is None:
+        keywords = config.DEFAULT_KEYWORDS
+    return _compile_matcher(tuple(keywords))
+
+
+# Матчеры по каналам: telegram_id -> AdMatcher. Подменяется целиком при изменении ключевых слов.
+_channel_matchers = {}
+
+
+def set_channel_keywords(channel_keywords: dict):
+    """
+    Пересобирает матчеры каналов. Вызывается при (пере)загрузке конфигурации,
+    для неизменившихся наборов ключевых слов используется уже скомпилированный матчер.
+    """
+    global _channel_matchers
+    _channel_matchers = {channel_id: get_matcher(keywords) for channel_id, keywords in channel_keywords.items()}
+
+
+def matcher_for_channel(channel_id: int) -> AdMatcher:
+    return _channel_matchers.get(channel_id) or get_matcher()
+
+
+def classify_many(texts, channel_id: int) -> list:
+    """Пакетная классификация сообщений одного канала. Возвращает список bool."""
+    return matcher_for_channel(channel_id).classify_many(texts)
+
+
 def is_ad_message(text: str, channel_keywords: list = None) -> bool:
     """
     Проверяет, является ли сообщение объявлением о продаже недвижимости.
     Использует список ключевых слов.
     """
-    if channel_keywords is None:
-        channel_keywords = config.DEFAULT_KEYWORDS
-
-    text_lower = text.lower()
-    
-    # Простая проверка на наличие хотя бы одного ключевого слова
-    found_keyword = False
-    for keyword in channel_keywords:
-        if keyword.lower() in text_lower:
-            found_keyword = True
-            break
-    
-    if not found_keyword:
-        return False
-    
-    # Можно добавить более сложные регулярные выражения для цен, площади и т.д.
-    # Например, наличие числовых значений, похожих на цену или площадь.
-    if re.search(r'\b\d{2,7}\s*(₽|руб|млн|тыс|k|m|м2|м²)\b', text_lower):
-        return True
-    
-    if "собственник" in text_lower or "продавец" in text_lower or "без комиссии" in text_lower:
-        return True
-
-    return False
+    return get_matcher(channel_keywords).is_ad(text)
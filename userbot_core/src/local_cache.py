@@ -0,0 +1,86 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+
+class BloomFilter:
+    """Классический Bloom-фильтр фиксированной емкости на bytearray."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        # Двойное хеширование (Kirsch–Mitzenmacher): k позиций из двух хешей
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class ScalableBloomFilter:
+    """
+    Bloom-фильтр, растущий цепочкой фильтров: каждый следующий вдвое больше
+    и с вдвое меньшей вероятностью ложного срабатывания, так что суммарная
+    ошибка остается ограниченной без знания итогового числа элементов.
+    """
+
+    def __init__(self, initial_capacity: int = 100_000, error_rate: float = 0.001):
+        self._filters = [BloomFilter(initial_capacity, error_rate / 2)]
+
+    def add(self, item: str):
+        current = self._filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * 2, current.error_rate / 2)
+            self._filters.append(current)
+        current.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        return any(item in f for f in reversed(self._filters))
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self._filters)
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш с временем жизни записей."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict() # key -> время истечения (time.monotonic)
+
+    def set(self, key, ttl: float):
+        self._data[key] = time.monotonic() + ttl
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        expires_at = self._data.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return False
+        self._data.move_to_end(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._data)
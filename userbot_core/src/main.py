@@ -1,18 +1,23 @@
 import asyncio
 import logging
 import hashlib
-import random
 import time
 from pyrogram import Client, filters as pyrogram_filters
 from pyrogram.types import Message
 from pyrogram.enums import ChatType
 import aio_pika
-import json
 import redis.asyncio as redis
 
-from userbot_core.src import config, db
-from userbot_core.src.filters import is_ad_message
+from userbot_core.src import config, db, dm_retry, envelope, metrics, tracing
+from userbot_core.src.batch_writer import DialogMessageWriter, ProcessedMessageWriter
+from userbot_core.src.catch_up import ChannelCatchUp, ChannelCheckpoints
+from userbot_core.src.config_cache import ConfigCache
+from userbot_core.src.dm_scheduler import DmScheduler
+from userbot_core.src.filters import matcher_for_channel
+from userbot_core.src.near_dup import NearDuplicateIndex, simhash, to_signed
+from userbot_core.src.outbox import OutboxRelay
 from userbot_core.src.rate_limiter import RateLimiter
+from userbot_core.src.sharding import AccountShardManager
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,164 +27,267 @@ rabbit_connection = None
 rabbit_channel = None
 redis_client = None
 rate_limiter = None
+config_cache = None
+processed_message_writer = None
+dialog_message_writer = None
+near_dup_index = None
+dm_scheduler = None
+shard_manager = None
+outbox_relay = None
+channel_checkpoints = None
+channel_catch_up = None
 
 async def init_services():
-    global rabbit_connection, rabbit_channel, redis_client, rate_limiter
+    global rabbit_connection, rabbit_channel, redis_client, rate_limiter, config_cache, processed_message_writer, dialog_message_writer, near_dup_index, dm_scheduler, shard_manager, outbox_relay
+    global channel_checkpoints, channel_catch_up
+    metrics.start_server()
+    tracing.start()
     await db.get_db_pool() # Инициализируем пул БД
+
+    processed_message_writer = ProcessedMessageWriter()
+    processed_message_writer.start()
+    dialog_message_writer = DialogMessageWriter()
+    dialog_message_writer.start()
+
+    config_cache = ConfigCache()
+    await config_cache.start()
+    channel_checkpoints = ChannelCheckpoints()
+    await channel_checkpoints.start()
     
     redis_client = redis.Redis(host=config.REDIS_HOST, port=6379, db=0)
     rate_limiter = RateLimiter(redis_client)
+    await rate_limiter.start_local_cache()
+    near_dup_index = NearDuplicateIndex(redis_client)
+    await near_dup_index.warm_from_db(db)
+    dm_scheduler = DmScheduler(redis_client, send_scheduled_dm)
+    shard_manager = AccountShardManager(redis_client, start_userbot, stop_userbot)
+    channel_catch_up = ChannelCatchUp(
+        redis_client, channel_checkpoints, userbot_clients, process_channel_message,
+        config_cache.channel_ids, lambda: processed_message_writer.backlog
+    )
 
     rabbit_connection = await aio_pika.connect_robust(
         f"amqp://{config.RABBITMQ_USER}:{config.RABBITMQ_PASS}@{config.RABBITMQ_HOST}/"
     )
     rabbit_channel = await rabbit_connection.channel()
+    await rabbit_channel.set_qos(prefetch_count=config.SEND_DM_PREFETCH_COUNT)
     await rabbit_channel.declare_queue(config.Q_NEW_AD, durable=True)
     await rabbit_channel.declare_queue(config.Q_SEND_DM, durable=True)
     await rabbit_channel.declare_queue(config.Q_DM_RESPONSE, durable=True)
+    await dm_retry.declare_retry_queues(rabbit_channel)
 
-    # Запускаем consumer для отправки DM
-    await rabbit_channel.consume(config.Q_SEND_DM, on_send_dm_request)
+    outbox_relay = OutboxRelay(rabbit_connection)
+    await outbox_relay.start()
 
-async def load_and_start_userbots():
-    accounts = await db.get_active_user_accounts()
-    if not accounts:
-        logger.warning("No active user accounts found in DB. Please add at least one using session_generator.py and add to DB.")
-        return
+async def start_userbot(acc):
+    """Запускает клиент аккаунта, аренду которого захватила эта реплика. При неудаче бросает исключение."""
+    client_id = acc['id']
+    phone_number = acc['phone_number']
+    session_string = acc['session_string']
 
-    for acc in accounts:
-        client_id = acc['id']
-        phone_number = acc['phone_number']
-        session_string = acc['session_string']
+    client = Client(
+        name=str(client_id), # Уникальное имя для сессии
+        api_id=config.PYROGRAM_API_ID,
+        api_hash=config.PYROGRAM_API_HASH,
+        session_string=session_string,
+        phone_number=phone_number, # Для более удобного логирования
+        workdir="pyrogram_sessions/" # Хранение сессий
+    )
+    # Добавляем хендлеры на этот конкретный клиент
+    client.add_handler(pyrogram_filters.new_message & pyrogram_filters.private & pyrogram_filters.user(lambda _, __, msg: msg.from_user.id != client.me.id), process_dm_response)
+    client.add_handler(pyrogram_filters.new_message & pyrogram_filters.channel, process_channel_message)
 
+    # Пока аккаунт был отключен, его каналы могли пропустить посты: живые посты не сдвигают
+    # чекпоинты, пока каналы снова не догнаны
+    channel_checkpoints.hold()
+    try:
+        await client.start()
+    except BaseException:
+        # В т.ч. отмена по таймауту: не оставляем полуоткрытое соединение
         try:
-            client = Client(
-                name=str(client_id), # Уникальное имя для сессии
-                api_id=config.PYROGRAM_API_ID,
-                api_hash=config.PYROGRAM_API_HASH,
-                session_string=session_string,
-                phone_number=phone_number, # Для более удобного логирования
-                workdir="pyrogram_sessions/" # Хранение сессий
-            )
-            # Добавляем хендлеры на этот конкретный клиент
-            client.add_handler(pyrogram_filters.new_message & pyrogram_filters.private & pyrogram_filters.user(lambda _, __, msg: msg.from_user.id != client.me.id), process_dm_response)
-            client.add_handler(pyrogram_filters.new_message & pyrogram_filters.channel, process_channel_message)
-
-            await client.start()
-            userbot_clients[client_id] = client
-            logger.info(f"Userbot account {phone_number} (ID: {client_id}) started successfully.")
+            await client.disconnect()
+        except Exception:
+            pass
+        raise
+    userbot_clients[client_id] = client
+    dm_scheduler.start_account(client_id)
+    channel_catch_up.request() # Посты, вышедшие пока аккаунт был отключен
+    logger.info(f"Userbot account {phone_number} (ID: {client_id}) started successfully on replica {config.REPLICA_ID}.")
+
+async def stop_userbot(client_id: int):
+    """Останавливает клиент аккаунта, который переезжает на другую реплику или отключен."""
+    await dm_scheduler.stop_account(client_id)
+    client = userbot_clients.pop(client_id, None)
+    if client:
+        try:
+            await client.stop()
         except Exception as e:
-            logger.error(f"Failed to start userbot account {phone_number} (ID: {client_id}): {e}")
+            logger.error(f"Failed to stop userbot {client_id} cleanly: {e}")
+        logger.info(f"Userbot account {client_id} stopped on replica {config.REPLICA_ID}.")
+
+async def load_and_start_userbots():
+    """
+    Запускает (параллельно) аккаунты, доставшиеся этой реплике, и дальше следит за
+    перераспределением и изменениями user_accounts без перезапуска сервиса.
+    """
+    await shard_manager.start()
+    channel_catch_up.start()
+    if not shard_manager.dm_candidates():
+        logger.warning("No active user accounts found in DB. Please add at least one using session_generator.py and add to DB.")
 
 async def process_channel_message(client: Client, message: Message):
-    """Обрабатывает новые сообщения в каналах."""
+    """Обрабатывает новые сообщения в каналах (живые и догоняемые из истории, см. catch_up.py)."""
+    await handle_channel_post(message)
+    # Чекпоинт канала сдвигается, только когда пост сохранен или отброшен
+    channel_checkpoints.seen(message.chat.id, message.id)
+
+async def handle_channel_post(message: Message):
     if not message.text:
         return
 
     channel_id = message.chat.id
     message_text = message.text
     message_id = message.id
+    received_at = time.time()
     
-    # Получаем keywords для этого канала
-    active_channels_data = await db.get_active_channels()
-    channel_keywords = config.DEFAULT_KEYWORDS
-    for ch_data in active_channels_data:
-        if ch_data['telegram_id'] == channel_id and ch_data['keywords']:
-            channel_keywords = [k.strip() for k in ch_data['keywords'].split(',')]
-            break
-
-    if not is_ad_message(message_text, channel_keywords):
+    # Матчер канала собирается заранее при загрузке ключевых слов в кэш
+    with metrics.FILTER_SECONDS.time():
+        is_ad = matcher_for_channel(channel_id).is_ad(message_text)
+    if not is_ad:
+        metrics.CHANNEL_MESSAGES.labels("not_ad").inc()
         return
 
     message_hash = hashlib.sha256(message_text.encode()).hexdigest()
 
     if await rate_limiter.is_message_processed(message_hash):
         logger.info(f"Message {message_id} in {channel_id} already processed. Skipping.")
+        metrics.CHANNEL_MESSAGES.labels("duplicate").inc()
+        return
+
+    fingerprint = simhash(message_text)
+    if await near_dup_index.find_near_duplicate(fingerprint) is not None:
+        logger.info(f"Message {message_id} in {channel_id} is a near-duplicate of a recent ad. Skipping.")
+        await rate_limiter.mark_message_processed(message_hash)
+        metrics.CHANNEL_MESSAGES.labels("near_duplicate").inc()
         return
 
     author_id = message.from_user.id if message.from_user else None
     author_username = message.from_user.username if message.from_user else None
     original_link = message.link if message.link else None
 
-    # Записываем сообщение как обработанное в БД и Redis
-    processed_msg_db_id = await db.record_processed_message(
-        message_id, channel_id, message_text, message_hash, author_id, author_username, original_link
+    # Трасса лида начинается с публикации поста в канале
+    trace = tracing.TraceContext.new()
+    if message.date:
+        trace.stamp("channel_post", message.date.timestamp())
+    trace.stamp("received", received_at).stamp("accepted")
+
+    # Записываем сообщение как обработанное в БД (пачками) вместе с событием new_ad_found в outbox,
+    # и только потом ставим флаг в Redis: падение между шагами не теряет объявление
+    processed_msg_db_id = await processed_message_writer.record(
+        message_id, channel_id, message_text, message_hash, author_id, author_username, original_link, to_signed(fingerprint),
+        trace.to_json()
     )
     await rate_limiter.mark_message_processed(message_hash)
+    if processed_msg_db_id is None:
+        logger.info(f"Message {message_id} in {channel_id} duplicates an already stored ad. Skipping.")
+        metrics.CHANNEL_MESSAGES.labels("duplicate").inc()
+        return
+    await near_dup_index.add(fingerprint)
+    metrics.CHANNEL_MESSAGES.labels("ad").inc()
 
-    # Публикуем событие о новом объявлении
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(
-            body=json.dumps({
-                "processed_message_db_id": processed_msg_db_id,
-                "channel_id": channel_id,
-                "message_id": message_id,
-                "message_text": message_text,
-                "author_id": author_id,
-                "author_username": author_username,
-                "original_link": original_link
-            }).encode(),
-            content_type='application/json'
-        ),
-        routing_key=config.Q_NEW_AD
-    )
-    logger.info(f"New ad found and published from channel {channel_id}, message {message_id}")
+    # Событие о новом объявлении публикует OutboxRelay
+    logger.info(f"New ad found in channel {channel_id}, message {message_id}. Queued for publishing via outbox.")
 
 
 async def on_send_dm_request(message: aio_pika.IncomingMessage):
-    """Обрабатывает запросы на отправку DM."""
-    async with message.process():
-        data = json.loads(message.body.decode())
-        user_id = data['user_id']
-        welcome_message = data['welcome_message']
-        processed_message_db_id = data['processed_message_db_id']
-        username = data['username']
-
-        if await rate_limiter.is_user_contacted(user_id):
-            logger.info(f"User {user_id} already contacted. Skipping DM.")
-            return
-        
-        # Выбираем Userbot аккаунт для отправки
-        selected_client_id = None
-        for client_id, client in userbot_clients.items():
-            if await rate_limiter.check_and_increment_dm_count(client_id):
-                selected_client_id = client_id
-                break
-        
-        if selected_client_id is None:
-            logger.warning(f"No available userbot accounts to send DM to {user_id}. Re-queueing.")
-            # Вернуть сообщение в очередь или в DLQ
-            await message.nack(requeue=True) # Повторно поставить в очередь
-            return
+    """
+    Обрабатывает запросы на отправку DM: выбирает аккаунт и ставит отправку
+    в его расписание. Сама отправка (с задержкой) выполняется планировщиком,
+    поэтому сообщение подтверждается сразу.
+    """
+    with metrics.CONSUMER_IN_FLIGHT.labels(config.Q_SEND_DM).track_inprogress():
+        async with message.process():
+            data = envelope.unpack(message)
+            user_id = data['user_id']
+            trace = tracing.from_message(message)
+
+            if await rate_limiter.is_user_contacted(user_id):
+                logger.info(f"User {user_id} already contacted. Skipping DM.")
+                tracing.export(trace, "already_contacted")
+                return
         
-        client = userbot_clients[selected_client_id]
+            # Выбираем наименее загруженный аккаунт под лимитом среди запущенных на всех репликах
+            # (один вызов Redis). Отправит DM реплика-владелец: задание попадает в расписание аккаунта.
+            slot = await rate_limiter.acquire_dm_slot(shard_manager.dm_candidates())
+            selected_client_id = slot.account_id
         
-        try:
-            # Обновляем last_used_at для аккаунта
-            await db.update_user_account_last_used(selected_client_id)
-            
-            # Отправляем сообщение
-            await asyncio.sleep(random.uniform(*config.DM_SEND_DELAY_SECONDS)) # Случайная задержка
-            
+            if selected_client_id is None:
+                # Откладываем через очередь задержки вместо мгновенного requeue
+                queue_name = await dm_retry.defer(rabbit_channel, message, slot.retry_after, reason="no_account_available")
+                logger.warning(f"No available userbot accounts to send DM to {user_id} (next slot in {slot.retry_after}s). Deferred to {queue_name}.")
+                return
+
+            if trace:
+                # Задание лежит в расписании Redis как JSON: трасса едет вместе с ним
+                data['trace'] = trace.stamp("send_dm.consumed").to_json()
+            send_at = await dm_scheduler.schedule(selected_client_id, data)
+            logger.info(f"DM to {user_id} scheduled via userbot {selected_client_id} in {send_at - time.time():.0f}s.")
+
+
+async def send_scheduled_dm(client_id: int, data: dict):
+    """Отправляет DM, запланированный DmScheduler для аккаунта client_id."""
+    user_id = data['user_id']
+    welcome_message = data['welcome_message']
+    processed_message_db_id = data['processed_message_db_id']
+    username = data['username']
+    trace = tracing.TraceContext.from_json(data.get('trace'))
+
+    # Пока задание ждало своей очереди, пользователю мог написать другой аккаунт
+    if await rate_limiter.is_user_contacted(user_id):
+        logger.info(f"User {user_id} already contacted. Dropping scheduled DM.")
+        tracing.export(trace, "already_contacted")
+        return
+
+    client = userbot_clients.get(client_id)
+    if client is None:
+        logger.warning(f"Userbot {client_id} is no longer running on this replica. Returning DM for {user_id} to the queue.")
+        await metrics.publish(rabbit_channel.default_exchange, envelope.make_message(config.Q_SEND_DM, data, headers=tracing.headers(trace)), config.Q_SEND_DM)
+        return
+
+    try:
+        # Обновляем last_used_at для аккаунта
+        await db.update_user_account_last_used(client_id)
+
+        with metrics.DM_SEND_SECONDS.labels(client_id).time():
             sent_message = await client.send_message(user_id, welcome_message)
-            logger.info(f"DM sent to {user_id} using userbot {selected_client_id}. Message ID: {sent_message.id}")
-            
-            # Отмечаем пользователя как опрошенного в Redis
-            await rate_limiter.mark_user_contacted(user_id)
+        metrics.DMS.labels(client_id, "sent").inc()
+        logger.info(f"DM sent to {user_id} using userbot {client_id}. Message ID: {sent_message.id}")
 
-            # Сохраняем информацию о контакте в БД
-            await db.add_contacted_user(user_id, username, processed_message_db_id)
+        # Отмечаем пользователя как опрошенного в Redis
+        await rate_limiter.mark_user_contacted(user_id)
 
-        except Exception as e:
-            logger.error(f"Failed to send DM to {user_id} using userbot {selected_client_id}: {e}")
-            # В зависимости от ошибки, можно маркировать аккаунт как неактивный или просто пропустить
-            # Например, если PRIVACY_RESTRICTED, то пользователь закрыл DM, помечаем как contacted
-            if "PRIVACY_RESTRICTED" in str(e):
-                logger.warning(f"User {user_id} has privacy restrictions. Cannot send DM.")
-                await rate_limiter.mark_user_contacted(user_id) # все равно помечаем как "контактировали"
-                await db.add_contacted_user(user_id, username, processed_message_db_id)
-            else:
-                pass # Другие ошибки, возможно, требуют ручного вмешательства или более умного retry
+        # Сохраняем информацию о контакте и исходящее сообщение в БД
+        await db.add_contacted_user(user_id, username, processed_message_db_id)
+        await dialog_message_writer.record(user_id, client_id, 'out', welcome_message, sent_message.id)
+
+        if trace:
+            # Ответ придет отдельным событием Telegram: трасса ждет его в Redis
+            await redis_client.set(f"{config.REDIS_DM_TRACE_KEY_PREFIX}{user_id}", trace.stamp("dm_sent").to_json(), ex=config.DM_TRACE_TTL_SECONDS)
+
+    except Exception as e:
+        logger.error(f"Failed to send DM to {user_id} using userbot {client_id}: {e}")
+        # В зависимости от ошибки, можно маркировать аккаунт как неактивный или просто пропустить
+        # Например, если PRIVACY_RESTRICTED, то пользователь закрыл DM, помечаем как contacted
+        if "PRIVACY_RESTRICTED" in str(e):
+            metrics.DMS.labels(client_id, "privacy_restricted").inc()
+            logger.warning(f"User {user_id} has privacy restrictions. Cannot send DM.")
+            await rate_limiter.mark_user_contacted(user_id) # все равно помечаем как "контактировали"
+            await db.add_contacted_user(user_id, username, processed_message_db_id)
+            tracing.export(trace, "privacy_restricted")
+        else:
+            metrics.DMS.labels(client_id, "failed").inc()
+            # Другие ошибки, возможно, требуют ручного вмешательства или более умного retry
+            tracing.export(trace, "send_failed")
 
 
 async def process_dm_response(client: Client, message: Message):
@@ -191,24 +299,38 @@ async def process_dm_response(client: Client, message: Message):
     response_text = message.text
     username = message.from_user.username or f"id{user_id}"
 
+    # Продолжаем трассу отправленного DM (каждый следующий ответ продолжает ее же)
+    trace = tracing.TraceContext.from_json(await redis_client.get(f"{config.REDIS_DM_TRACE_KEY_PREFIX}{user_id}"))
+    if trace:
+        trace.stamp("dm_reply_received").stamp(f"{config.Q_DM_RESPONSE}.published")
+
     # Публикуем ответ в очередь для Processing Service
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(
-            body=json.dumps({
-                "user_id": user_id,
-                "username": username,
-                "response_text": response_text
-            }).encode(),
-            content_type='application/json'
-        ),
-        routing_key=config.Q_DM_RESPONSE
+    await metrics.publish(
+        rabbit_channel.default_exchange,
+        envelope.make_message(config.Q_DM_RESPONSE, {
+            "user_id": user_id,
+            "username": username,
+            "response_text": response_text
+        }, headers=tracing.headers(trace)),
+        config.Q_DM_RESPONSE
     )
     logger.info(f"DM response from {user_id} published to processing service.")
 
+    # Дописываем ответ в историю диалога (пачками, без переписывания contacted_users).
+    # Уже после публикации: сбой записи истории не должен терять ответ собственника
+    try:
+        await dialog_message_writer.record(user_id, int(client.name), 'in', response_text or '', message.id)
+    except Exception as e:
+        logger.error(f"Failed to record DM response from {user_id} in dialog history: {e}")
+
 async def main():
     await init_services()
     await load_and_start_userbots()
 
+    # Запускаем consumer для отправки DM, когда аккаунты этой реплики уже подняты
+    send_dm_queue = await rabbit_channel.declare_queue(config.Q_SEND_DM, durable=True)
+    await send_dm_queue.consume(on_send_dm_request)
+
     # Запускаем основной цикл Pyrogram.
     # Pyrogram Client.run() блокирует выполнение, поэтому управляем им вручную
     # через Event Loop
@@ -220,12 +342,30 @@ async def main():
         while True:
             await asyncio.sleep(60) # Просто держим Event Loop живым
     finally:
-        for client in userbot_clients.values():
-            await client.stop()
+        if channel_catch_up:
+            await channel_catch_up.close()
+        if shard_manager:
+            await shard_manager.close() # Останавливает клиенты и отпускает аренды
+        if dm_scheduler:
+            await dm_scheduler.close()
+        if processed_message_writer:
+            await processed_message_writer.close()
+        if channel_checkpoints:
+            await channel_checkpoints.close() # После батчера: сохраняем чекпоинты уже записанных постов
+        if dialog_message_writer:
+            await dialog_message_writer.close()
+        if outbox_relay:
+            await outbox_relay.close() # Неопубликованные события остаются в outbox
+        if rate_limiter:
+            logger.info(f"Local dedup cache stats: {dict(rate_limiter.stats)}")
+            await rate_limiter.close_local_cache()
+        if config_cache:
+            await config_cache.close()
         if rabbit_connection:
             await rabbit_connection.close()
         if redis_client:
             await redis_client.close()
+        await tracing.close()
         pool = await db.get_db_pool()
         if pool:
             await pool.close()
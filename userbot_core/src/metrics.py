@@ -0,0 +1,75 @@
+"""
+Метрики Prometheus сервиса, отдаются по HTTP на METRICS_PORT (/metrics).
+
+Общие для всех сервисов метрики (db_*, rabbitmq_*, consumer_*) называются одинаково:
+сервис различается по job/instance в Prometheus. У каждого сервиса свой реестр, поэтому
+несколько сервисов можно поднять в одном процессе (benchmarks/bench_pipeline.py).
+"""
+import functools
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector, start_http_server
+
+from userbot_core.src import config
+
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+
+# Фильтр объявлений работает микросекунды — стандартные корзины (от 5 мс) для него слишком грубые
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Время вызова функции db.* вместе с ожиданием соединения из пула", ["function"], registry=REGISTRY
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Соединения пула asyncpg: size — открытые, idle — свободные, max — предел", ["state"], registry=REGISTRY
+)
+PUBLISH_SECONDS = Histogram(
+    "rabbitmq_publish_seconds", "Время публикации в RabbitMQ (с подтверждением брокера, если оно включено)", ["routing_key"], registry=REGISTRY
+)
+CONSUMER_IN_FLIGHT = Gauge(
+    "consumer_in_flight_messages", "Сообщения, которые consumer получил и еще не подтвердил", ["queue"], registry=REGISTRY
+)
+
+FILTER_SECONDS = Histogram(
+    "userbot_filter_seconds", "Время проверки поста фильтром объявлений канала", buckets=FAST_BUCKETS, registry=REGISTRY
+)
+CHANNEL_MESSAGES = Counter(
+    "userbot_channel_messages_total",
+    "Текстовые посты каналов по итогу обработки: not_ad — отфильтрован, duplicate/near_duplicate — отброшен дедупом, ad — новое объявление",
+    ["outcome"], registry=REGISTRY
+)
+CATCH_UP_MESSAGES = Counter(
+    "userbot_catch_up_messages_total", "Посты, пропущенные живыми обработчиками и прочитанные из истории каналов при догоне", registry=REGISTRY
+)
+DM_SEND_SECONDS = Histogram("userbot_dm_send_seconds", "Время вызова send_message Telegram", ["account_id"], registry=REGISTRY)
+DMS = Counter("userbot_dms_total", "Попытки отправки DM: sent, privacy_restricted, failed", ["account_id", "outcome"], registry=REGISTRY)
+DM_RATE_HEADROOM = Gauge(
+    "userbot_dm_rate_headroom", "Сколько еще DM аккаунт может отправить в текущем скользящем окне", ["account_id"], registry=REGISTRY
+)
+
+
+def start_server():
+    start_http_server(config.METRICS_PORT, registry=REGISTRY)
+
+
+def track_pool(pool):
+    """Значения пула читаются в момент запроса /metrics."""
+    DB_POOL_CONNECTIONS.labels("size").set_function(pool.get_size)
+    DB_POOL_CONNECTIONS.labels("idle").set_function(pool.get_idle_size)
+    DB_POOL_CONNECTIONS.labels("max").set_function(pool.get_max_size)
+
+
+def db_timed(func):
+    """Декоратор функций db.*: время вызова попадает в DB_QUERY_SECONDS с меткой имени функции."""
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with histogram.time():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+async def publish(exchange, message, routing_key: str):
+    with PUBLISH_SECONDS.labels(routing_key).time():
+        await exchange.publish(message, routing_key=routing_key)
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import re
+import time
+
+import redis.asyncio as redis
+
+from userbot_core.src import config
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+_MASK = (1 << FINGERPRINT_BITS) - 1
+
+_PHONE_SEPARATORS_RE = re.compile(r'(?<=\d)[\s\-().]+(?=\d)')
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _normalize_token(token: str) -> str:
+    if token.isdigit():
+        if len(token) >= 10:
+            return token[-10:] # Телефон: "8999..." и "+7999..." дают одинаковые последние 10 цифр
+        if len(token) >= 5:
+            return f"#{len(token)}" # Цена: важен порядок величины, а не точное значение
+    return token
+
+
+def normalize(text: str) -> list:
+    """
+    Приводит текст к списку токенов, устойчивому к мелким правкам перепостов:
+    регистр, эмодзи и пунктуация отбрасываются, разделители внутри номеров
+    телефонов и чисел склеиваются ("+7 (999) 123-45-67" -> "9991234567"),
+    а цены сводятся к порядку величины.
+    """
+    text = _PHONE_SEPARATORS_RE.sub('', text.lower())
+    return [_normalize_token(token) for token in _TOKEN_RE.findall(text)]
+
+
+def _features(tokens: list) -> list:
+    # Слова и биграммы слов: правка одной строки меняет лишь несколько признаков
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def simhash(text: str) -> int:
+    """64-битный SimHash текста объявления."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+        for feature in _features(normalize(text))
+    ]
+    if not hashes:
+        return 0
+
+    threshold = len(hashes) / 2
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        mask = 1 << bit
+        if sum(1 for h in hashes if h & mask) > threshold:
+            fingerprint |= mask
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def to_signed(fingerprint: int) -> int:
+    """Для хранения в BIGINT Postgres."""
+    return fingerprint - (1 << FINGERPRINT_BITS) if fingerprint >= 1 << (FINGERPRINT_BITS - 1) else fingerprint
+
+
+def from_signed(value: int) -> int:
+    return value & _MASK
+
+
+class NearDuplicateIndex:
+    """
+    Индекс SimHash-отпечатков в Redis с поиском по полосам (banding).
+    Отпечаток режется на max_distance + 1 полос: по принципу Дирихле у отпечатков
+    на расстоянии Хэмминга <= max_distance хотя бы одна полоса совпадает целиком.
+    Каждая полоса — ключ sorted set (член: отпечаток, score: время добавления),
+    поэтому поиск — один pipeline из (max_distance + 1) ZRANGEBYSCORE по небольшим корзинам.
+    """
+
+    def __init__(self, redis_client: redis.Redis, max_distance: int = None, window_days: int = None):
+        self.redis = redis_client
+        self.max_distance = config.NEAR_DUP_MAX_HAMMING_DISTANCE if max_distance is None else max_distance
+        self.window_seconds = (config.NEAR_DUP_WINDOW_DAYS if window_days is None else window_days) * 86400
+
+        bands = self.max_distance + 1
+        width, extra = divmod(FINGERPRINT_BITS, bands)
+        self._bands = [] # (сдвиг, маска) для каждой полосы
+        offset = 0
+        for i in range(bands):
+            band_width = width + (1 if i < extra else 0)
+            self._bands.append((offset, (1 << band_width) - 1))
+            offset += band_width
+
+    def _band_keys(self, fingerprint: int) -> list:
+        return [
+            f"{config.REDIS_SIMHASH_KEY_PREFIX}{i}:{(fingerprint >> shift) & mask:x}"
+            for i, (shift, mask) in enumerate(self._bands)
+        ]
+
+    async def find_near_duplicate(self, fingerprint: int):
+        """
+        Возвращает ранее сохраненный отпечаток в пределах max_distance,
+        добавленный не раньше чем window_days назад, или None.
+        """
+        min_score = time.time() - self.window_seconds
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self._band_keys(fingerprint):
+            pipe.zrangebyscore(key, min_score, '+inf')
+        buckets = await pipe.execute()
+
+        for bucket in buckets:
+            for member in bucket:
+                candidate = int(member, 16)
+                if hamming_distance(fingerprint, candidate) <= self.max_distance:
+                    return candidate
+        return None
+
+    async def add(self, fingerprint: int, added_at: float = None):
+        await self.add_many([(fingerprint, added_at or time.time())])
+
+    async def add_many(self, items: list):
+        """items: список (fingerprint, unix-время добавления)."""
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for fingerprint, added_at in items:
+            member = f"{fingerprint:x}"
+            for key in self._band_keys(fingerprint):
+                pipe.zadd(key, {member: added_at})
+                pipe.zremrangebyscore(key, '-inf', now - self.window_seconds)
+                pipe.expire(key, self.window_seconds)
+        await pipe.execute()
+
+    async def warm_from_db(self, db):
+        """Заполняет индекс из processed_messages, если Redis был очищен (например, после потери данных)."""
+        marker_key = f"{config.REDIS_SIMHASH_KEY_PREFIX}warmed"
+        if await self.redis.exists(marker_key):
+            return
+        rows = await db.get_recent_simhashes(self.window_seconds)
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start:start + 1000]
+            await self.add_many([(from_signed(row['simhash']), row['processed_at'].timestamp()) for row in chunk])
+        await self.redis.set(marker_key, 1, ex=self.window_seconds)
+        logger.info(f"Near-duplicate index warmed with {len(rows)} fingerprints from DB.")
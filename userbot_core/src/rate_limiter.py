@@ -1,44 +1,229 @@
 import redis.asyncio as redis
-import time
-from userbot_core.src import config
+import asyncio
+import logging
+import uuid
+from collections import Counter, namedtuple
+from userbot_core.src import config, metrics
+from userbot_core.src.local_cache import ScalableBloomFilter, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Атомарный выбор аккаунта под лимитом скользящего окна.
+# KEYS: ключи окон аккаунтов (sorted set: отправка -> время отправки), в порядке приоритета.
+# ARGV[1]: лимит отправок за окно, ARGV[2]: длина окна в секундах, ARGV[3]: уникальный суффикс члена.
+# Возвращает {индекс выбранного ключа (1-based) или 0, отправок в окне после выбора,
+#             через сколько секунд освободится хотя бы один аккаунт (строкой, если выбрать некого),
+#             отправок в окне каждого ключа после выбора (в порядке KEYS)}.
+ACQUIRE_DM_SLOT_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local best_index, best_count, earliest_free = nil, nil, nil
+local counts = {}
+
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    counts[i] = count
+    if count < limit then
+        if best_count == nil or count < best_count then
+            best_index, best_count = i, count
+        end
+    else
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        local free_at = now + window
+        if oldest[2] then
+            free_at = tonumber(oldest[2]) + window
+        end
+        if earliest_free == nil or free_at < earliest_free then
+            earliest_free = free_at
+        end
+    end
+end
+
+if best_index == nil then
+    return {0, 0, tostring(earliest_free - now), counts}
+end
+
+local key = KEYS[best_index]
+redis.call('ZADD', key, now, tostring(now) .. ':' .. ARGV[3])
+redis.call('EXPIRE', key, window * 2)
+counts[best_index] = best_count + 1
+return {best_index, best_count + 1, '0', counts}
+"""
+
+# account_id: выбранный аккаунт или None; count: отправок этого аккаунта в текущем окне;
+# retry_after: через сколько секунд освободится ближайший аккаунт (если выбрать было некого)
+DmSlot = namedtuple('DmSlot', ['account_id', 'count', 'retry_after'])
+
+
+class _DedupTier:
+    """
+    Локальный уровень перед Redis для одного семейства флагов (prefix + ttl).
+    Bloom-фильтр содержит все ключи, когда-либо выставленные в Redis (после прогрева
+    и по pub/sub от других процессов), поэтому его отрицательный ответ — "точно не видели".
+    LRU хранит подтвержденные положительные ответы не дольше, чем им осталось жить в Redis.
+    """
+
+    def __init__(self, name: str, prefix: str, ttl: int, stats: Counter):
+        self.name = name
+        self.prefix = prefix
+        self.ttl = ttl
+        self.bloom = ScalableBloomFilter(config.DEDUP_BLOOM_INITIAL_CAPACITY, config.DEDUP_BLOOM_ERROR_RATE)
+        self.positives = TTLCache(config.DEDUP_LRU_MAX_SIZE)
+        self.stats = stats
+        self.warmed = False
+
+    async def contains(self, redis_client, value: str) -> bool:
+        if value in self.positives:
+            self.stats[f"{self.name}.local_hit"] += 1
+            return True
+        if self.warmed and value not in self.bloom:
+            self.stats[f"{self.name}.bloom_negative"] += 1
+            return False
+
+        # PTTL вместо EXISTS: локально ключ живет ровно столько, сколько ему осталось в Redis
+        # (-2 — ключа нет, -1 — ключ без срока жизни)
+        pttl = await redis_client.pttl(f"{self.prefix}{value}")
+        found = pttl != -2
+        if found:
+            self.stats[f"{self.name}.redis_hit"] += 1
+            self.positives.set(value, self.ttl if pttl == -1 else pttl / 1000)
+        else:
+            self.stats[f"{self.name}.redis_miss"] += 1
+        return found
+
+    def remember(self, value: str):
+        self.bloom.add(value)
+        self.positives.set(value, self.ttl)
 
 class RateLimiter:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
+        self._acquire_dm_slot_script = redis_client.register_script(ACQUIRE_DM_SLOT_SCRIPT) # EVALSHA с фолбэком на EVAL
+        self.stats = Counter() # Счетчики попаданий/промахов локального уровня дедупликации
+        self._processed = _DedupTier("processed", config.REDIS_PROCESSED_MESSAGE_KEY_PREFIX, 86400 * 7, self.stats)
+        self._contacted = _DedupTier("contacted", config.REDIS_CONTACTED_USER_KEY_PREFIX, 86400 * 30, self.stats)
+        self._pubsub = None
+        self._sync_task = None
+
+    async def start_local_cache(self):
+        """Подписывается на отметки других процессов и прогревает локальные Bloom-фильтры из Redis."""
+        await self._subscribe_and_warm()
+        self._sync_task = asyncio.create_task(self._sync_marks())
+
+    async def close_local_cache(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+        if self._pubsub:
+            await self._pubsub.close()
+
+    async def _subscribe_and_warm(self):
+        """
+        Оформляет подписку заново и прогревает Bloom-фильтры полным сканированием ключей.
+        Подписка — до сканирования, чтобы не потерять отметки, сделанные во время прогрева;
+        они дочитываются из подписки до того, как фильтрам снова начинают доверять.
+        """
+        tiers = {tier.name: tier for tier in (self._processed, self._contacted)}
+        if self._pubsub:
+            # После обрыва PubSub считает себя подписанным (subscribed смотрит только на список каналов)
+            await self._pubsub.close()
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(config.REDIS_DEDUP_MARKS_CHANNEL)
+
+        for tier in tiers.values():
+            count = 0
+            async for key in self.redis.scan_iter(match=f"{tier.prefix}*", count=1000):
+                tier.bloom.add(key.decode()[len(tier.prefix):])
+                count += 1
+            logger.info(f"Local dedup cache '{tier.name}' warmed with {count} keys from Redis.")
+        while (message := await self._pubsub.get_message(timeout=0)) is not None:
+            self._apply_mark(tiers, message)
+        for tier in tiers.values():
+            tier.warmed = True
+
+    @staticmethod
+    def _apply_mark(tiers: dict, message: dict):
+        if message['type'] != 'message':
+            return # Подтверждения подписки
+        name, _, value = message['data'].decode().partition(':')
+        if name in tiers:
+            tiers[name].bloom.add(value)
+
+    async def _sync_marks(self):
+        tiers = {tier.name: tier for tier in (self._processed, self._contacted)}
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    self._apply_mark(tiers, message)
+                raise ConnectionError("subscription closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Пока подписка не восстановлена и фильтры не прогреты заново, чужие отметки
+                # могут пройти мимо фильтра: отрицательным ответам Bloom-фильтров не доверяем
+                logger.error(f"Dedup marks subscription failed: {e}. Falling back to Redis lookups.")
+                for tier in tiers.values():
+                    tier.warmed = False
+            while True:
+                await asyncio.sleep(5)
+                try:
+                    await self._subscribe_and_warm()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Failed to restore dedup marks subscription: {e}")
+
+    async def _mark(self, tier: _DedupTier, value: str):
+        tier.remember(value)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(f"{tier.prefix}{value}", 1, ex=tier.ttl)
+        pipe.publish(config.REDIS_DEDUP_MARKS_CHANNEL, f"{tier.name}:{value}")
+        await pipe.execute()
+
+    async def acquire_dm_slot(self, account_ids: list) -> DmSlot:
+        """
+        За один вызов Redis выбирает наименее загруженный аккаунт из account_ids,
+        у которого не исчерпан лимит DM в скользящем окне, и учитывает для него отправку.
+        При равной загрузке побеждает аккаунт, стоящий раньше в списке.
+        """
+        if not account_ids:
+            return DmSlot(None, 0, None)
+
+        keys = [f"{config.REDIS_DM_WINDOW_KEY_PREFIX}{account_id}" for account_id in account_ids]
+        index, count, retry_after, counts = await self._acquire_dm_slot_script(
+            keys=keys,
+            args=[config.MAX_DMS_PER_HOUR_PER_ACCOUNT, config.DM_RATE_WINDOW_SECONDS, uuid.uuid4().hex]
+        )
+        # Окна всех кандидатов только что пересчитаны скриптом: обновляем запас у каждого
+        for account_id, window_count in zip(account_ids, counts):
+            metrics.DM_RATE_HEADROOM.labels(account_id).set(max(config.MAX_DMS_PER_HOUR_PER_ACCOUNT - window_count, 0))
+        if index == 0:
+            return DmSlot(None, 0, float(retry_after))
+        return DmSlot(account_ids[index - 1], count, None)
 
     async def check_and_increment_dm_count(self, account_id: int) -> bool:
         """
         Проверяет, не превышен ли лимит DM для данного аккаунта за последний час.
         Возвращает True, если можно отправить, False если лимит превышен.
         """
-        key = f"{config.REDIS_DM_COUNT_KEY_PREFIX}{account_id}:{int(time.time() // 3600)}" # Лимит по часам
-        
-        current_count = await self.redis.get(key)
-        current_count = int(current_count) if current_count else 0
-
-        if current_count >= config.MAX_DMS_PER_HOUR_PER_ACCOUNT:
-            return False
-        
-        await self.redis.incr(key)
-        await self.redis.expire(key, 3600 * 2) # Ключ живет 2 часа на всякий случай
-        return True
+        slot = await self.acquire_dm_slot([account_id])
+        return slot.account_id is not None
 
     async def is_message_processed(self, message_hash: str) -> bool:
         """Проверяет, было ли сообщение уже обработано по его хешу."""
-        key = f"{config.REDIS_PROCESSED_MESSAGE_KEY_PREFIX}{message_hash}"
-        return await self.redis.exists(key)
+        return await self._processed.contains(self.redis, message_hash)
 
     async def mark_message_processed(self, message_hash: str):
         """Отмечает сообщение как обработанное."""
-        key = f"{config.REDIS_PROCESSED_MESSAGE_KEY_PREFIX}{message_hash}"
-        await self.redis.set(key, 1, ex=86400 * 7) # Храним флаг 7 дней
+        await self._mark(self._processed, message_hash) # Храним флаг 7 дней
 
     async def is_user_contacted(self, user_id: int) -> bool:
         """Проверяет, был ли пользователь уже опрошен."""
-        key = f"{config.REDIS_CONTACTED_USER_KEY_PREFIX}{user_id}"
-        return await self.redis.exists(key)
+        return await self._contacted.contains(self.redis, str(user_id))
 
     async def mark_user_contacted(self, user_id: int):
         """Отмечает пользователя как опрошенного."""
-        key = f"{config.REDIS_CONTACTED_USER_KEY_PREFIX}{user_id}"
-        await self.redis.set(key, 1, ex=86400 * 30) # Храним флаг 30 дней
+        await self._mark(self._contacted, str(user_id)) # Храним флаг 30 дней
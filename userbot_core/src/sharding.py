@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+import redis.asyncio as redis
+
+from userbot_core.src import config, db
+
+logger = logging.getLogger(__name__)
+
+# Продлевает/снимает аренду, только если она принадлежит этой реплике.
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _rendezvous_score(account_id: int, replica_id: str) -> int:
+    digest = hashlib.blake2b(f"{account_id}:{replica_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def desired_owner(account_id: int, replicas: list) -> str:
+    """Rendezvous-хеширование: при входе/выходе реплики переезжает лишь ~1/N аккаунтов."""
+    return max(replicas, key=lambda replica_id: _rendezvous_score(account_id, replica_id))
+
+
+class AccountState:
+    """Состояние аккаунта на этой реплике: статус, время запуска, ошибки и backoff повторов."""
+
+    def __init__(self):
+        self.status = 'stopped' # starting / running / failed / stopped
+        self.startup_seconds = None
+        self.last_error = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.session_hash = None
+
+    def as_dict(self) -> dict:
+        return {
+            'status': self.status,
+            'startup_seconds': self.startup_seconds,
+            'last_error': self.last_error,
+            'failures': self.failures,
+        }
+
+
+def _session_hash(session_string: str) -> str:
+    return hashlib.blake2b(session_string.encode(), digest_size=8).hexdigest()
+
+
+class AccountShardManager:
+    """
+    Распределяет userbot-аккаунты между репликами userbot_core.
+    Каждая реплика регистрирует heartbeat в Redis; аккаунт "должен" принадлежать
+    реплике, выбранной rendezvous-хешированием среди живых, и запускается ею только
+    после захвата аренды account_lease:<id> (SET NX PX). Аренда продлевается на каждом
+    цикле и истекает сама, если реплика пропала, после чего аккаунт забирает другая.
+
+    Цикл сверки запускается по таймеру и по NOTIFY на изменение user_accounts, поэтому
+    добавленные, отключенные или перевыпущенные (новая session_string) аккаунты
+    подхватываются без перезапуска. Клиенты стартуют параллельно, не более
+    ACCOUNT_START_CONCURRENCY одновременно, с таймаутом на каждый.
+    """
+
+    def __init__(self, redis_client: redis.Redis, start_account, stop_account, replica_id: str = None):
+        self.redis = redis_client
+        self.replica_id = replica_id or config.REPLICA_ID
+        self._start_account = start_account # async (account_row) -> None, исключение при неудаче
+        self._stop_account = stop_account # async (account_id) -> None
+        self._renew_script = redis_client.register_script(RENEW_LEASE_SCRIPT)
+        self._release_script = redis_client.register_script(RELEASE_LEASE_SCRIPT)
+        self.owned = set() # аккаунты, аренда которых у этой реплики (запущенные и запускающиеся)
+        self.states = {} # account_id -> AccountState
+        self._leased_accounts = [] # аккаунты с действующей арендой у любой реплики, в порядке last_used_at
+        self._start_tasks = {} # account_id -> asyncio.Task
+        self._start_semaphore = asyncio.Semaphore(config.ACCOUNT_START_CONCURRENCY)
+        self._reconcile_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._listener_conn = None
+        self._task = None
+        self._lease_ms = config.ACCOUNT_LEASE_TTL_SECONDS * 1000
+
+    @staticmethod
+    def _lease_key(account_id: int) -> str:
+        return f"{config.REDIS_ACCOUNT_LEASE_KEY_PREFIX}{account_id}"
+
+    def dm_candidates(self) -> list:
+        """Аккаунты, которые сейчас запущены какой-либо репликой (кандидаты для отправки DM)."""
+        return list(self._leased_accounts)
+
+    async def start(self):
+        """Выполняет первую сверку и дожидается запуска доставшихся реплике аккаунтов."""
+        await self._listen()
+        await self.reconcile()
+        # Цикл сверки продлевает аренды и heartbeat, поэтому запускается до ожидания клиентов:
+        # запуск многих аккаунтов (ACCOUNT_START_CONCURRENCY за раз, до ACCOUNT_START_TIMEOUT_SECONDS
+        # каждый) длится дольше ACCOUNT_LEASE_TTL_SECONDS, и без продления аренды истекли бы,
+        # а другая реплика запустила бы ту же сессию второй раз
+        self._task = asyncio.create_task(self._run())
+        if self._start_tasks:
+            await asyncio.gather(*self._start_tasks.values(), return_exceptions=True)
+        await self._refresh_leased_accounts(await db.get_active_user_accounts())
+
+    async def close(self):
+        """Корректно отпускает аккаунты, чтобы другие реплики забрали их, не дожидаясь истечения аренды."""
+        if self._task:
+            self._task.cancel()
+        for task in self._start_tasks.values():
+            task.cancel()
+        if self._listener_conn and not self._listener_conn.is_closed():
+            await self._listener_conn.close()
+        for account_id in list(self.owned):
+            await self._release(account_id)
+        await self.redis.zrem(config.REDIS_REPLICAS_KEY, self.replica_id)
+
+    async def _listen(self):
+        try:
+            self._listener_conn = await db.create_listener_connection()
+            await self._listener_conn.add_listener(config.PG_USER_ACCOUNTS_CHANNEL, self._on_notify)
+        except Exception as e:
+            # Без уведомлений изменения все равно подхватятся периодической сверкой
+            logger.error(f"Failed to LISTEN for user_accounts changes: {e}")
+            self._listener_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config.SHARD_RECONCILE_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if self._listener_conn is None or self._listener_conn.is_closed():
+                    await self._listen()
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Shard reconcile failed: {e}")
+
+    async def _live_replicas(self) -> list:
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(config.REDIS_REPLICAS_KEY, {self.replica_id: now})
+        pipe.zremrangebyscore(config.REDIS_REPLICAS_KEY, '-inf', now - config.ACCOUNT_LEASE_TTL_SECONDS)
+        pipe.zrange(config.REDIS_REPLICAS_KEY, 0, -1)
+        _, _, replicas = await pipe.execute()
+        return [r.decode() for r in replicas]
+
+    async def reconcile(self):
+        async with self._reconcile_lock:
+            replicas = await self._live_replicas()
+            accounts = await db.get_active_user_accounts()
+            active = {acc['id']: acc for acc in accounts}
+
+            # Продлеваем свои аренды; отпускаем аккаунты, которые теперь должны жить на другой реплике
+            for account_id in list(self.owned):
+                if account_id not in active or desired_owner(account_id, replicas) != self.replica_id:
+                    logger.info(f"Handing off account {account_id} (rebalance or deactivation).")
+                    await self._release(account_id)
+                elif not await self._renew_script(keys=[self._lease_key(account_id)], args=[self.replica_id, self._lease_ms]):
+                    logger.warning(f"Lease for account {account_id} was lost. Stopping it locally.")
+                    await self._release(account_id)
+                elif self._session_changed(active[account_id]):
+                    logger.info(f"Session for account {account_id} changed. Restarting client.")
+                    await self._stop(account_id)
+                    self._spawn_start(active[account_id])
+
+            now = time.time()
+            for acc in accounts:
+                account_id = acc['id']
+                if account_id in self.owned or desired_owner(account_id, replicas) != self.replica_id:
+                    continue
+                state = self.states.get(account_id)
+                if state and state.status == 'failed' and state.retry_at > now:
+                    continue # Ждем окончания backoff после неудачного запуска
+                lease_key = self._lease_key(account_id)
+                if not await self.redis.set(lease_key, self.replica_id, nx=True, px=self._lease_ms):
+                    # Аренда с нашим id остается после перезапуска реплики с тем же REPLICA_ID — забираем ее
+                    if not await self._renew_script(keys=[lease_key], args=[self.replica_id, self._lease_ms]):
+                        continue # Прежний владелец еще не отпустил аккаунт; заберем на следующем цикле
+                self.owned.add(account_id)
+                self._spawn_start(acc)
+
+            await self._refresh_leased_accounts(accounts)
+
+    async def _refresh_leased_accounts(self, accounts: list):
+        leases = await self.redis.mget([self._lease_key(acc['id']) for acc in accounts]) if accounts else []
+        self._leased_accounts = [
+            acc['id'] for acc, lease in zip(accounts, leases)
+            # Свои аккаунты — только уже запущенные, чтобы не планировать DM на незапущенный клиент
+            if lease is not None and (lease.decode() != self.replica_id or self._is_running(acc['id']))
+        ]
+
+    def _is_running(self, account_id: int) -> bool:
+        state = self.states.get(account_id)
+        return state is not None and state.status == 'running'
+
+    def _session_changed(self, acc) -> bool:
+        state = self.states.get(acc['id'])
+        return state is not None and state.status == 'running' and state.session_hash != _session_hash(acc['session_string'])
+
+    def _spawn_start(self, acc):
+        state = self.states.setdefault(acc['id'], AccountState())
+        state.status = 'starting'
+        self._start_tasks[acc['id']] = asyncio.create_task(self._start(acc, state))
+
+    async def _start(self, acc, state: AccountState):
+        account_id = acc['id']
+        try:
+            async with self._start_semaphore:
+                started = time.monotonic()
+                await asyncio.wait_for(self._start_account(acc), config.ACCOUNT_START_TIMEOUT_SECONDS)
+                state.startup_seconds = time.monotonic() - started
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            state.status = 'failed'
+            state.failures += 1
+            state.last_error = str(e) or type(e).__name__
+            state.retry_at = time.time() + min(config.ACCOUNT_START_MAX_BACKOFF_SECONDS, config.SHARD_RECONCILE_INTERVAL_SECONDS * 2 ** state.failures)
+            logger.error(f"Account {account_id} failed to start ({state.failures} failures): {state.last_error}")
+            if account_id in self.owned:
+                self.owned.discard(account_id)
+                await self._release_script(keys=[self._lease_key(account_id)], args=[self.replica_id])
+            return
+        finally:
+            # При перезапуске (смена сессии) в словаре уже может лежать новая задача
+            if self._start_tasks.get(account_id) is asyncio.current_task():
+                del self._start_tasks[account_id]
+
+        if account_id not in self.owned:
+            # Аккаунт успели отпустить, пока клиент запускался
+            await self._stop_account(account_id)
+            state.status = 'stopped'
+            return
+        state.status = 'running'
+        state.failures = 0
+        state.last_error = None
+        state.session_hash = _session_hash(acc['session_string'])
+        logger.info(f"Account {account_id} started in {state.startup_seconds:.1f}s.")
+
+    async def _stop(self, account_id: int):
+        task = self._start_tasks.pop(account_id, None)
+        if task:
+            task.cancel()
+        await self._stop_account(account_id)
+        state = self.states.get(account_id)
+        if state:
+            state.status = 'stopped'
+
+    async def _release(self, account_id: int):
+        self.owned.discard(account_id)
+        await self._stop(account_id)
+        await self._release_script(keys=[self._lease_key(account_id)], args=[self.replica_id])